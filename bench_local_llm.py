@@ -0,0 +1,123 @@
+# bench_local_llm.py
+"""
+Throughput of the local LLMService backend on this machine, per precision
+and thread count: model load time, region-classification latency (small
+classifier model on CPU) and compliance-answer prefill / decode speed over
+the sample_data.csv features.
+
+Run: python bench_local_llm.py --device cpu --precision int8 fp32 --threads 4 8 --n 4
+"""
+import argparse
+import csv
+import gc
+import itertools
+import time
+
+from compliance_prompt import compliance_prompt
+from document_loader import DocumentLoader
+from llm_service import DEFAULT_MODEL, LLMService, cpu_threads_available
+from main import region_prompt
+
+
+def load_features(path: str, n: int):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("feature_name") or r.get("feature_description"))]
+    return [f"{r.get('feature_name', '').strip()}: {r.get('feature_description', '').strip()}" for r in rows[:n]]
+
+
+def load_context(texts_csv: str, regulations_dir: str, max_chars: int) -> str:
+    """A regulation excerpt of about max_chars, standing in for retrieved chunks."""
+    with open(texts_csv, "r", encoding="utf-8-sig", newline="") as f:
+        _, filename = next(row for row in csv.reader(f) if len(row) >= 2)
+    parts, size = [], 0
+    for doc in DocumentLoader(f"{regulations_dir.rstrip('/')}/{filename}").lazy_load():
+        parts.append(doc.page_content)
+        size += len(doc.page_content)
+        if size >= max_chars:
+            break
+    return "\n".join(parts)[:max_chars]
+
+
+def run(service: LLMService, features, context: str, max_new_tokens: int) -> dict:
+    tok = service.pipe.tokenizer
+    classify_s = 0.0
+    for q in features:
+        t0 = time.perf_counter()
+        service.classify_text(region_prompt(q))
+        classify_s += time.perf_counter() - t0
+
+    prompt_tokens = out_tokens = 0
+    prefill_s = generate_s = 0.0
+    for q in features:
+        prompt = compliance_prompt().format_prompt(question=q, context=context).to_string()
+        prompt_tokens += len(tok(prompt)["input_ids"])
+        # Prefill alone (one new token), then the full answer; decode = difference
+        t0 = time.perf_counter()
+        service.pipe(prompt, max_new_tokens=1)
+        prefill_s += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        text = service.pipe(prompt, max_new_tokens=max_new_tokens)[0]["generated_text"]
+        generate_s += time.perf_counter() - t0
+        out_tokens += len(tok(text, add_special_tokens=False)["input_ids"])
+
+    n = max(1, len(features))
+    decode_s = max(generate_s - prefill_s, 1e-9)
+    return {
+        "classify_ms": round(classify_s * 1e3 / n),
+        "prefill_tok_s": round(prompt_tokens / max(prefill_s, 1e-9)),
+        "decode_tok_s": round(out_tokens / decode_s, 1),
+        "answer_s": round(generate_s / n, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local LLM backend (CPU precision / threads).")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--classifier_model", default=None, help='Region classifier ("" = use the main model).')
+    parser.add_argument("--device", choices=["auto", "cpu", "cuda"], default="cpu")
+    parser.add_argument("--precision", nargs="+", choices=["int8", "fp32"], default=["int8"], help="CPU only.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[cpu_threads_available()], help="CPU only.")
+    parser.add_argument("--pin_threads", action="store_true")
+    parser.add_argument("--n", type=int, default=4, help="Number of sample features to run.")
+    parser.add_argument("--max_new_tokens", type=int, default=256)
+    parser.add_argument("--context_chars", type=int, default=4000)
+    parser.add_argument("--queries", default="sample_data.csv")
+    parser.add_argument("--texts", default="texts-available.csv")
+    parser.add_argument("--regulations_dir", default="./regulations/")
+    args = parser.parse_args()
+
+    features = load_features(args.queries, args.n)
+    context = load_context(args.texts, args.regulations_dir, args.context_chars)
+    # Pinning only narrows the affinity mask, so go from most to fewest threads
+    threads = sorted(args.threads, reverse=True)
+    configs = list(itertools.product(args.precision, threads)) if args.device != "cuda" else [("gpu", 0)]
+
+    columns = ["precision", "threads", "load_s", "classify_ms", "prefill_tok_s", "decode_tok_s", "answer_s"]
+    rows = []
+    for precision, n_threads in configs:
+        print(f"Loading {args.model} ({precision}, {n_threads or '-'} threads)")
+        t0 = time.perf_counter()
+        service = LLMService(
+            model_name=args.model,
+            max_new_tokens=args.max_new_tokens,
+            use_worker=False,
+            device=args.device,
+            cpu_threads=n_threads or None,
+            pin_threads=args.pin_threads,
+            cpu_int8=precision == "int8",
+            classifier_model=args.classifier_model,
+        )
+        row = {"precision": precision, "threads": n_threads or "", "load_s": round(time.perf_counter() - t0, 1)}
+        row.update(run(service, features, context, args.max_new_tokens))
+        rows.append(row)
+        del service
+        gc.collect()
+
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print(" ".join(c.rjust(widths[c]) for c in columns))
+    for r in rows:
+        print(" ".join(str(r[c]).rjust(widths[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# bench_terminology.py
+"""
+Benchmark glossary term detection/expansion: the old single regex alternation
+vs. the Aho-Corasick TerminologyEngine, for growing glossary sizes.
+
+Run: python bench_terminology.py --terms 1000 10000 20000
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from terminology import GLOSSARY, TerminologyEngine
+
+
+def synthetic_glossary(n: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    glossary = dict(GLOSSARY)
+    while len(glossary) < n:
+        if rng.random() < 0.5:
+            # Acronym-style codename: 2-5 upper-case letters/digits
+            term = "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(rng.randint(2, 5)))
+        else:
+            # CamelCase codename
+            term = "".join(
+                rng.choice(string.ascii_uppercase) + "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 7)))
+                for _ in range(rng.randint(1, 2))
+            )
+        glossary.setdefault(term, f"Definition of {term}")
+    return glossary
+
+
+def synthetic_text(glossary: dict, words: int, hit_rate: float = 0.05, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    terms = list(glossary)
+    filler = ["the", "feature", "users", "minors", "region", "logs", "policy", "rollout", "account", "content"]
+    return " ".join(rng.choice(terms) if rng.random() < hit_rate else rng.choice(filler) for _ in range(words))
+
+
+def bench(fn, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark regex alternation vs Aho-Corasick glossary matching.")
+    parser.add_argument("--terms", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--words", type=int, default=2000, help="Words per query text (default: 2000).")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'terms':>8} {'build_re_s':>11} {'build_ac_s':>11} {'detect_re_ms':>13} {'detect_ac_ms':>13} {'expand_re_ms':>13} {'expand_ac_ms':>13} {'hits_re':>8} {'hits_ac':>8}")
+    for n in args.terms:
+        glossary = synthetic_glossary(n)
+        text = synthetic_text(glossary, args.words)
+
+        t0 = time.perf_counter()
+        ordered = sorted(glossary, key=len, reverse=True)
+        term_re = re.compile(r"\b(" + "|".join(map(re.escape, ordered)) + r")\b")
+        build_re = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        engine = TerminologyEngine([glossary])
+        build_ac = time.perf_counter() - t0
+
+        def detect_re(t):
+            return sorted(set(m.group(1) for m in term_re.finditer(t)))
+
+        def expand_re(t):
+            return term_re.sub(lambda m: f"{m.group(1)} ({glossary[m.group(1)]})", t)
+
+        detect_re_s = bench(detect_re, text, args.repeat)
+        detect_ac_s = bench(engine.detect_terms, text, args.repeat)
+        expand_re_s = bench(expand_re, text, args.repeat)
+        expand_ac_s = bench(engine.expand_query, text, args.repeat)
+
+        print(
+            f"{n:>8} {build_re:>11.3f} {build_ac:>11.3f} "
+            f"{detect_re_s * 1e3:>13.2f} {detect_ac_s * 1e3:>13.2f} "
+            f"{expand_re_s * 1e3:>13.2f} {expand_ac_s * 1e3:>13.2f} "
+            f"{len(detect_re(text)):>8} {len(engine.detect_terms(text)):>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# bench_vector_store.py
+"""
+Concurrent-load benchmark of the shared vector store client.
+
+Copies the published index to a temp directory, then for each reader count
+runs that many threads searching it (sample_data.csv queries, embedded once
+up front) for --seconds, optionally while a writer thread keeps adding
+chunks to the same store the way in-place ingestion does (batches of
+existing vectors under new ids). Reports query latency percentiles and
+throughput per level, and the writer's chunks per second.
+
+Run: python bench_vector_store.py --readers 1 2 4 8 --seconds 10 --writer both
+"""
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+from db import DB, chunk_store_for, index_path, query_collection
+from sweep_retrieval import EMBEDDING_MODEL, load_queries
+from terminology import expand_query
+
+COLUMNS = ["readers", "writer", "queries", "qps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "written", "write_chunks_s"]
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Writer(threading.Thread):
+    """Adds batches of existing vectors under new ids until stopped."""
+
+    def __init__(self, db: DB, batch_size: int, pause: float):
+        super().__init__(daemon=True)
+        self.db = db
+        self.pause = pause
+        self.stop_event = threading.Event()
+        self.written = 0
+        with db.lock.read():
+            sample = db.db._collection.get(
+                where=db.regulation_filter(None), limit=batch_size, include=["embeddings", "metadatas", "documents"]
+            )
+        self.embeddings = [[float(x) for x in v] for v in sample["embeddings"]]
+        self.metadatas = [dict(m or {}) for m in sample["metadatas"]]
+        self.chunks = chunk_store_for(db.db)
+        if self.chunks is not None:
+            found = self.chunks.get_many(sample["ids"])
+            self.texts = [found.get(i, "") for i in sample["ids"]]
+        else:
+            self.texts = list(sample["documents"])
+
+    def run(self):
+        while not self.stop_event.is_set() and self.embeddings:
+            ids = [uuid.uuid4().hex for _ in self.embeddings]
+            documents = self.texts
+            if self.chunks is not None:
+                self.chunks.put_many(zip(ids, self.texts))
+                documents = None
+            self.db.insert_embedded(ids, self.embeddings, self.metadatas, documents)
+            self.written += len(ids)
+            self.stop_event.wait(self.pause)
+
+
+def run_level(db: DB, vectors, readers: int, seconds: float, k: int, writer_on: bool, batch_size: int, pause: float) -> dict:
+    where = db.regulation_filter(None)
+    chunks = chunk_store_for(db.db)
+    latencies = [[] for _ in range(readers)]
+    stop = threading.Event()
+
+    def read(n):
+        lat = latencies[n]
+        for i in itertools.count(n):
+            if stop.is_set():
+                return
+            t0 = time.perf_counter()
+            query_collection(db.db, [vectors[i % len(vectors)]], k=k, where=where, chunks=chunks)
+            lat.append((time.perf_counter() - t0) * 1e3)
+
+    writer = Writer(db, batch_size, pause) if writer_on else None
+    threads = [threading.Thread(target=read, args=(n,), daemon=True) for n in range(readers)]
+    if writer is not None:
+        writer.start()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    if writer is not None:
+        writer.stop_event.set()
+        writer.join()
+
+    all_ms = [ms for lat in latencies for ms in lat]
+    written = writer.written if writer is not None else 0
+    return {
+        "readers": readers,
+        "writer": "on" if writer_on else "off",
+        "queries": len(all_ms),
+        "qps": round(len(all_ms) / elapsed, 1),
+        "p50_ms": round(percentile(all_ms, 0.50), 2),
+        "p95_ms": round(percentile(all_ms, 0.95), 2),
+        "p99_ms": round(percentile(all_ms, 0.99), 2),
+        "max_ms": round(max(all_ms, default=0.0), 2),
+        "written": written,
+        "write_chunks_s": round(written / elapsed, 1) if writer_on else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query latency/throughput of the vector store at 1..N readers, with and without a concurrent writer.")
+    parser.add_argument("--index", default=None, help="Index directory to copy (default: the published index).")
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each level.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--writer", choices=["off", "on", "both"], default="both")
+    parser.add_argument("--write_batch", type=int, default=64, help="Chunks per write batch.")
+    parser.add_argument("--write_pause", type=float, default=0.05, help="Seconds between write batches.")
+    parser.add_argument("--queries", default="sample_data.csv")
+    args = parser.parse_args()
+
+    src = args.index or index_path()
+    tmp = tempfile.mkdtemp(prefix="bench_store_")
+    db = None
+    try:
+        # Writes go to a throwaway copy; the published index is left untouched
+        path = os.path.join(tmp, "index")
+        shutil.copytree(src, path, ignore=shutil.ignore_patterns("versions", "CURRENT"))
+        embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        queries = list(load_queries(args.queries).values())
+        vectors = embedding.embed_documents([expand_query(q) for q in queries])
+        db = DB(embedding, persist_directory=path)
+        print(f"{len(vectors)} queries against a copy of {src} ({db.db._collection.count()} chunks)")
+        query_collection(db.db, vectors[:1], k=args.k, chunks=chunk_store_for(db.db))  # warm-up
+
+        modes = {"off": [False], "on": [True], "both": [False, True]}[args.writer]
+        rows = []
+        for writer_on, readers in itertools.product(modes, sorted(args.readers)):
+            print(f"{readers} reader(s), writer {'on' if writer_on else 'off'}")
+            rows.append(run_level(db, vectors, readers, args.seconds, args.k, writer_on, args.write_batch, args.write_pause))
+
+        widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in COLUMNS}
+        print(" ".join(c.rjust(widths[c]) for c in COLUMNS))
+        for r in rows:
+            print(" ".join(str(r[c]).rjust(widths[c]) for c in COLUMNS))
+    finally:
+        if db is not None:
+            db.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
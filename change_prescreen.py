@@ -0,0 +1,257 @@
+# change_prescreen.py
+"""
+Local relevance pre-screen for staged code changes.
+
+Runs before CodeChangeEvaluator so files that cannot matter for
+geo-compliance never reach the LLM. Each changed file is decided by, in
+order:
+  1. path rules: data files, lockfiles, styles, images, build output -> skip
+  2. glossary terms (terminology.detect_terms) in the path or diff -> evaluate
+  3. embedding similarity of the diff text to per-region regulation
+     centroids and the glossary centroid -> evaluate at or above `threshold`
+Without an index to build centroids from, unmatched files are evaluated.
+Regulation centroids are summed up by document_manager.py while it embeds
+the chunks and stored next to the index (db.CENTROIDS_FILE); indexes built
+before that are averaged from their stored embeddings once per version.
+
+Run: python change_prescreen.py changes/*.json --threshold 0.25
+prints every decision and the skip rate, to tune the rules and threshold.
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from terminology import default_engine, detect_terms
+
+SKIP_EXTENSIONS = {
+    ".csv", ".tsv", ".lock", ".css", ".scss", ".sass", ".less", ".svg", ".png", ".jpg", ".jpeg",
+    ".gif", ".ico", ".webp", ".woff", ".woff2", ".ttf", ".eot", ".map", ".pdf", ".zip", ".gz",
+    ".snap", ".min.js", ".pyc",
+}
+SKIP_FILENAMES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock", "Cargo.lock",
+    "go.sum", "composer.lock", "Gemfile.lock", ".gitignore", ".gitattributes", ".editorconfig",
+    "LICENSE", "requirements.txt",
+}
+SKIP_DIRS = {"node_modules", "dist", "build", "vendor", "__pycache__", ".venv", "venv", "changes", "chroma"}
+
+
+@dataclass
+class ScreenDecision:
+    file_path: str
+    relevant: bool
+    reason: str                       # path | terms | similarity | below_threshold | no_index
+    score: Optional[float] = None
+    terms: List[str] = field(default_factory=list)
+    rule: str = ""
+
+
+def path_rule(file_path: str) -> Optional[str]:
+    """Name of the rule that rules the path out, or None."""
+    parts = file_path.replace("\\", "/").split("/")
+    name = parts[-1]
+    if name in SKIP_FILENAMES:
+        return f"file:{name}"
+    lower = name.lower()
+    for ext in SKIP_EXTENSIONS:
+        if lower.endswith(ext):
+            return f"ext:{ext}"
+    for part in parts[:-1]:
+        if part in SKIP_DIRS:
+            return f"dir:{part}"
+    return None
+
+
+def change_text(changed_file: dict, max_chars: int = 4000) -> str:
+    """Path plus the added/removed lines of a recorded change (changes JSON format)."""
+    parts = [changed_file.get("file_path", "")]
+    size = len(parts[0])
+    for item in changed_file.get("line_changes", []):
+        change = item.get("change", {})
+        line = (change.get("new_line") or change.get("previous_line") or "").strip()
+        if not line:
+            continue
+        parts.append(line)
+        size += len(line) + 1
+        if size >= max_chars:
+            break
+    return "\n".join(parts)[:max_chars]
+
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = sum(x * x for x in vector) ** 0.5 or 1.0
+    return [x / norm for x in vector]
+
+
+def _centroid(vectors: Iterable[Sequence[float]]) -> Optional[List[float]]:
+    total, n = None, 0
+    for v in vectors:
+        v = _normalize(v)
+        total = list(v) if total is None else [a + b for a, b in zip(total, v)]
+        n += 1
+    return _normalize(total) if n else None
+
+
+def add_region_sums(sums: Dict[str, list], region: str, vectors: Iterable[Sequence[float]]) -> None:
+    """Add normalized vectors to the running [sum, count] of a region (for save_region_sums)."""
+    for v in vectors:
+        v = _normalize(v)
+        entry = sums.get(region)
+        if entry is None:
+            sums[region] = [list(v), 1]
+        else:
+            entry[0] = [a + b for a, b in zip(entry[0], v)]
+            entry[1] += 1
+
+
+def load_region_sums(path: str) -> Optional[Dict[str, list]]:
+    """Region sums stored with an index, or None if it has none."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {r: [e["sum"], e["count"]] for r, e in json.load(f)["regions"].items()}
+    except FileNotFoundError:
+        return None
+
+
+def save_region_sums(path: str, sums: Dict[str, list]) -> None:
+    """Write the sums atomically; readers see the old or the new file."""
+    data = {"regions": {r: {"sum": total, "count": n} for r, (total, n) in sums.items()}}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class ChangePreScreen:
+    """
+    Routes changed files to the LLM or skips them, and counts decisions by
+    reason so skip rates can be reported. Centroids are rebuilt when the
+    index version or the glossary changes. Safe to share across threads.
+    """
+
+    def __init__(self, embedding, db_orchestrator=None, threshold: float = 0.25, max_chars: int = 4000):
+        '''
+        Parameters:
+            embedding: embedding model (same one the index was built with)
+            db_orchestrator: source of regulation chunk embeddings for the centroids
+            threshold: minimum cosine similarity to any centroid to evaluate a file
+            max_chars: diff text embedded per file
+        '''
+        self.embedding = embedding
+        self.db_orchestrator = db_orchestrator
+        self.threshold = threshold
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._centroids: Dict[str, List[float]] = {}
+        self._index_version = None
+        self._glossary = None
+
+    def _regulation_centroids(self) -> Dict[str, List[float]]:
+        from db import centroids_path  # db loads chromadb; the path rules and tests do not need it
+        db = self.db_orchestrator.db
+        sums = load_region_sums(centroids_path(db.db_path))
+        if sums is not None:
+            return {f"regulation:{r}": _normalize(total) for r, (total, n) in sums.items() if n}
+        # Index built without centroids: average every stored embedding (once per index version)
+        where = db.regulation_filter(None)
+        with db.lock.read():
+            res = db.db._collection.get(where=where, include=["embeddings", "metadatas"])
+        by_region: Dict[str, list] = {}
+        for vector, meta in zip(res.get("embeddings") or [], res.get("metadatas") or []):
+            by_region.setdefault((meta or {}).get("region") or "Global", []).append(vector)
+        return {f"regulation:{r}": _centroid(vs) for r, vs in by_region.items() if vs}
+
+    def centroids(self) -> Dict[str, List[float]]:
+        version = self.db_orchestrator.index_version() if self.db_orchestrator is not None else None
+        engine = default_engine()
+        engine.maybe_reload()
+        glossary = engine.glossary  # replaced (not mutated) on reload, so identity tracks changes
+        with self._lock:
+            if version == self._index_version and glossary is self._glossary and self._centroids:
+                return self._centroids
+        centroids = {}
+        if self.db_orchestrator is not None:
+            try:
+                centroids.update(self._regulation_centroids())
+            except Exception as e:
+                print(f"Pre-screen: could not read regulation embeddings: {e}")
+        if glossary:
+            entries = [f"{term}: {meaning}" for term, meaning in glossary.items()]
+            centroids["glossary"] = _centroid(self.embedding.embed_documents(entries))
+        with self._lock:
+            self._centroids, self._index_version, self._glossary = centroids, version, glossary
+        return centroids
+
+    def screen(self, changed_files: List[dict]) -> List[ScreenDecision]:
+        '''One decision per changed file (changes JSON entries), in input order.'''
+        decisions: List[Optional[ScreenDecision]] = [None] * len(changed_files)
+        to_embed = []
+        for i, changed_file in enumerate(changed_files):
+            path = changed_file.get("file_path", "")
+            rule = path_rule(path)
+            if rule is not None:
+                decisions[i] = ScreenDecision(path, False, "path", rule=rule)
+                continue
+            text = change_text(changed_file, self.max_chars)
+            terms = detect_terms(text)
+            if terms:
+                decisions[i] = ScreenDecision(path, True, "terms", terms=terms)
+                continue
+            to_embed.append((i, path, text))
+
+        if to_embed:
+            centroids = [c for c in self.centroids().values() if c]
+            if not centroids:
+                for i, path, _ in to_embed:
+                    decisions[i] = ScreenDecision(path, True, "no_index")
+            else:
+                vectors = self.embedding.embed_documents([text for _, _, text in to_embed])
+                for (i, path, _), vector in zip(to_embed, vectors):
+                    v = _normalize(vector)
+                    score = max(sum(a * b for a, b in zip(v, c)) for c in centroids)
+                    relevant = score >= self.threshold
+                    decisions[i] = ScreenDecision(path, relevant, "similarity" if relevant else "below_threshold", round(score, 4))
+
+        with self._lock:
+            for d in decisions:
+                self._counts[d.reason] = self._counts.get(d.reason, 0) + 1
+        return decisions
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        skipped = counts.get("path", 0) + counts.get("below_threshold", 0)
+        return {
+            "screened": total,
+            "skipped": skipped,
+            "skip_rate": round(skipped / total, 3) if total else 0.0,
+            "by_reason": counts,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+    from db_orchestrator import DBOrchestrator
+
+    parser = argparse.ArgumentParser(description="Dry-run the code-change pre-screen on recorded changes JSON files.")
+    parser.add_argument("changes", nargs="+", help="changes/changes_<ts>.json files")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    prescreen = ChangePreScreen(embedding, DBOrchestrator(embedding), threshold=args.threshold)
+    for path in args.changes:
+        with open(path, "r", encoding="utf-8") as f:
+            changed_files = json.load(f).get("changed_files", [])
+        for d in prescreen.screen(changed_files):
+            score = "" if d.score is None else f"{d.score:.3f}"
+            print(f"{'EVAL' if d.relevant else 'skip':4} {d.reason:15} {score:6} {d.file_path} {d.rule or ' '.join(d.terms)}")
+    print(prescreen.stats())
@@ -0,0 +1,182 @@
+# chunk_store.py
+"""
+Compressed chunk-text store, addressed by chunk id.
+
+Chroma keeps only the vectors and metadata of regulation chunks; their text
+lives here as one compressed frame per chunk (zstd with a dictionary trained
+on the first batch, zlib when zstandard is not installed). Searches return
+ids and scores, and only the documents that reach the prompt are looked up
+and decompressed (see materialize).
+
+One store per index, next to the Chroma files (<index>/chunks.sqlite3, see
+db.chunk_store_path), shared by the region shards of that index.
+"""
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is the fallback codec
+    zstandard = None
+
+CHUNK_ID_KEY = "chunk_id"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+"""
+
+
+class ChunkStore:
+    """
+    SQLite table of compressed chunk texts. The codec (and zstd dictionary)
+    is fixed when the store is created and recorded in `meta`, so readers
+    always decode with what the writer used.
+    """
+
+    def __init__(self, path: str, level: int = 9, dict_size: int = 32768, min_dict_samples: int = 64):
+        self.path = path
+        self.level = level
+        self.dict_size = dict_size
+        self.min_dict_samples = min_dict_samples
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('codec', ?)",
+                ("zstd" if zstandard is not None else "zlib",),
+            )
+            conn.commit()
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        self.codec = meta["codec"]
+        self._dict_data = meta.get("zstd_dict")
+        if self.codec == "zstd" and zstandard is None:
+            raise ImportError(f"{path} is zstd-compressed; install zstandard to read it")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    # zstd (de)compressor objects must not be shared between threads
+    def _codec(self, dict_data: Optional[bytes]):
+        local = self._local
+        if getattr(local, "dict_data", False) is not dict_data:
+            zdict = zstandard.ZstdCompressionDict(dict_data) if dict_data else None
+            local.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=zdict)
+            local.decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+            local.dict_data = dict_data
+        return local.compressor, local.decompressor
+
+    def _compress(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if self.codec == "zlib":
+            return zlib.compress(data, self.level)
+        return self._codec(self._dict_data)[0].compress(data)
+
+    def _decompress(self, blob: bytes) -> str:
+        if self.codec == "zlib":
+            return zlib.decompress(blob).decode("utf-8")
+        return self._codec(self._dict_data)[1].decompress(blob).decode("utf-8")
+
+    def _train_dictionary(self, conn: sqlite3.Connection, texts: Sequence[str]) -> None:
+        # Chunks are a few KB: a shared dictionary is what makes per-chunk frames compress well
+        if self.codec != "zstd" or self._dict_data is not None or len(texts) < self.min_dict_samples:
+            return
+        try:
+            zdict = zstandard.train_dictionary(self.dict_size, [t.encode("utf-8") for t in texts])
+        except zstandard.ZstdError:
+            return
+        if conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]:
+            return  # frames already written without a dictionary
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('zstd_dict', ?)", (zdict.as_bytes(),))
+        self._dict_data = conn.execute("SELECT value FROM meta WHERE key='zstd_dict'").fetchone()[0]
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> int:
+        items = list(items)
+        if not items:
+            return 0
+        with closing(self._connect()) as conn:
+            self._train_dictionary(conn, [text for _, text in items])
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, data) VALUES (?, ?)",
+                [(chunk_id, self._compress(text)) for chunk_id, text in items],
+            )
+            conn.commit()
+        return len(items)
+
+    def get_many(self, ids: Sequence[str]) -> Dict[str, str]:
+        ids = list(dict.fromkeys(ids))
+        found: Dict[str, str] = {}
+        with closing(self._connect()) as conn:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT id, data FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for chunk_id, blob in rows:
+                    found[chunk_id] = self._decompress(blob)
+        return found
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM chunks").fetchone()
+        return {"chunks": count, "compressed_bytes": size, "codec": self.codec, "dictionary": self._dict_data is not None}
+
+
+_OPEN: Dict[str, ChunkStore] = {}
+_OPEN_LOCK = threading.Lock()
+
+
+def open_chunk_store(path: str, create: bool = False) -> Optional[ChunkStore]:
+    """
+    Process-wide ChunkStore for path (see db.chunk_store_path); None when it
+    does not exist, i.e. the index keeps its text inline in Chroma.
+    """
+    with _OPEN_LOCK:
+        store = _OPEN.get(path)
+        if store is None and (create or os.path.exists(path)):
+            store = _OPEN[path] = ChunkStore(path)
+        return store
+
+
+def close_chunk_store(path: str) -> None:
+    """Forget the process-wide store for path (e.g. its index version was deleted)."""
+    target = os.path.abspath(path)
+    with _OPEN_LOCK:
+        for key in [k for k in _OPEN if os.path.abspath(k) == target]:
+            del _OPEN[key]
+
+
+def materialize(docs: Iterable, stores: Sequence[ChunkStore]) -> None:
+    """
+    Fill in page_content (in place) of documents returned without text.
+    Each chunk is read and decompressed once, however often it repeats.
+    """
+    pending: Dict[str, List] = {}
+    for doc in docs:
+        chunk_id = (doc.metadata or {}).get(CHUNK_ID_KEY)
+        if chunk_id and not doc.page_content:
+            pending.setdefault(chunk_id, []).append(doc)
+    for store in stores:
+        if not pending:
+            break
+        for chunk_id, text in store.get_many(list(pending)).items():
+            for doc in pending.pop(chunk_id):
+                doc.page_content = text
+    if pending:
+        print(f"Chunk store: no text for {len(pending)} chunk(s)")
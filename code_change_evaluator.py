@@ -3,10 +3,19 @@ import json
 from llm_service import LLMService
 from evaluate_change_prompt import evaluate_change_prompt
 from rag_chain import extract_json
+from evaluation_cache import EvaluationCache, blob_hash, cache_key, prompt_hash
+from change_prescreen import ChangePreScreen
 
 class CodeChangeEvaluator:
-    def __init__(self, llm: LLMService):
+    def __init__(self, llm: LLMService, cache: EvaluationCache = None, prescreen: ChangePreScreen = None):
+        '''
+        cache: optional EvaluationCache; files whose content, prompt and model
+               were already evaluated are answered from it without an LLM call
+        prescreen: optional ChangePreScreen; files it rules out are skipped
+        '''
         self.llm = llm
+        self.cache = cache
+        self.prescreen = prescreen
 
 
     def evaluate(self, json_path: str):
@@ -21,19 +30,48 @@ class CodeChangeEvaluator:
             raise Exception(f"Error loading {json_path}: {e}")
         
         EVALUATE_PROMPT = evaluate_change_prompt()
+        prompt_version = prompt_hash(EVALUATE_PROMPT.template)
+        model = getattr(self.llm, "model_name", type(self.llm).__name__)
+
+        changed_files = evaluate['changed_files']
+        if self.prescreen is not None:
+            decisions = self.prescreen.screen(changed_files)
+            for d in decisions:
+                if not d.relevant:
+                    print(f"Pre-screen skipped {d.file_path} ({d.rule or d.reason}{'' if d.score is None else f', score {d.score:.3f}'})")
+            changed_files = [f for f, d in zip(changed_files, decisions) if d.relevant]
+            print(f"Pre-screen: {self.prescreen.stats()}")
 
         # Package change and entire file
         evaluated_changes = []
-        for changed_file in evaluate['changed_files']:
+        for changed_file in changed_files:
             file_path = changed_file['file_path']
-            with open(file_path, "r", encoding='utf-8') as f:
-                file_content = f.read()
+            file_content = changed_file.get('file_content')
+            raw = None
+            if file_content is None:
+                # Bytes as on disk (no newline translation), so the cache key is the file's blob id
+                with open(file_path, "rb") as f:
+                    raw = f.read()
+                file_content = raw.decode('utf-8')
+
+            key = None
+            if self.cache is not None:
+                key = cache_key(file_path, blob_hash(raw if raw is not None else file_content), prompt_version, model)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    evaluated_changes.append(cached)
+                    continue
 
             # Populate prompt with file_path and file_change
             prompt = EVALUATE_PROMPT.format(context=file_path, change=file_content)
 
             response = self.llm.pipe(prompt)[0]['generated_text']
             obj = extract_json(response)
+            if key is not None and isinstance(obj, dict):
+                self.cache.put(key, file_path, obj)
             evaluated_changes.append(obj)
 
+        if self.cache is not None:
+            print(f"Evaluation cache: {self.cache.stats()}")
+
         return evaluated_changes
\ No newline at end of file
@@ -42,3 +42,23 @@ def compliance_prompt(json_mode: str = "text"):
 
     # Works with Gemini (JSON mime) and local Llama (prompt-enforced JSON)
     return ChatPromptTemplate.from_messages([("system", SYSTEM), ("user", USER)])
+
+
+def evidence_prompt():
+    """
+    Re-ask for the `evidence` quotes of issues whose quote was not found in Context.
+      - {issues} → numbered "issue — reasoning" lines
+      - {context} → the same excerpts the answer was generated from
+    """
+    SYSTEM = (
+        "You are a geo-regulation compliance assistant.\n"
+        "For each numbered issue, copy ONE sentence from Context that supports it.\n\n"
+        "Rules:\n"
+        "• Copy the sentence character for character: no paraphrase, no shortening, no added words.\n"
+        "• Pick the most specific sentence (closest to the cited subsection).\n"
+        "• If no sentence in Context supports an issue, use an empty string for it.\n\n"
+        "Output format (STRICT): Return ONLY one valid JSON object, one entry per issue, in order:\n"
+        '{{ "evidence": ["<verbatim sentence for issue 1>", "<verbatim sentence for issue 2>"] }}\n'
+    )
+    USER = "Issues:\n{issues}\n\nContext:\n{context}"
+    return ChatPromptTemplate.from_messages([("system", SYSTEM), ("user", USER)])
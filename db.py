@@ -1,29 +1,408 @@
 import chromadb
 import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager, nullcontext
 
 from langchain_community.vectorstores import Chroma
+from langchain.schema import Document
+
+from chunk_store import CHUNK_ID_KEY, close_chunk_store, materialize, open_chunk_store
+from evidence_index import close_evidence_index
+
+# Glossary docs live in their own collection so they never compete with
+# regulation chunks for the top-k slots of a search.
+GLOSSARY_COLLECTION = "glossary"
+REGULATION_COLLECTION = "langchain"   # langchain's default collection name
+
+SHARDS_DIR = "shards"
+# Compressed chunk texts of an index (see chunk_store.py), shared by its shards
+CHUNK_STORE_FILE = "chunks.sqlite3"
+# Sentence hashes of the chunk texts, for evidence verification (see evidence_index.py)
+EVIDENCE_INDEX_FILE = "evidence.sqlite3"
+# Per-region embedding sums written at build time, for the code-change pre-screen (see change_prescreen.py)
+CENTROIDS_FILE = "centroids.json"
+
+# Versioned layout: ingestion builds chroma/versions/<id>/ and then publishes it
+# by atomically replacing chroma/CURRENT (which holds <id>). Without CURRENT the
+# legacy single store in chroma/ is used.
+CHROMA_ROOT = "chroma"
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+RETIRED_FILE = ".retired"
+
+def current_version(root: str = CHROMA_ROOT) -> str | None:
+  """Published version id, or None for the legacy unversioned layout."""
+  try:
+    with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+      version = f.read().strip()
+  except FileNotFoundError:
+    return None
+  return version if version and os.path.isdir(os.path.join(root, VERSIONS_DIR, version)) else None
+
+def index_path(root: str = CHROMA_ROOT, version: str | None = None) -> str:
+  """Directory of the given (default: currently published) index version."""
+  version = version or current_version(root)
+  return os.path.join(root, VERSIONS_DIR, version) if version else root
+
+def new_version(root: str = CHROMA_ROOT) -> tuple[str, str]:
+  """Reserve a fresh version directory to build into. Returns (version id, path)."""
+  version = time.strftime("%Y%m%d-%H%M%S") + f"-{uuid.uuid4().hex[:8]}"
+  path = os.path.join(root, VERSIONS_DIR, version)
+  os.makedirs(path)
+  return version, path
+
+def publish_version(version: str, root: str = CHROMA_ROOT):
+  """
+  Atomically point CURRENT at `version`. Readers see either the old or the new
+  id, never a partial file. The replaced version is marked retired for gc.
+  """
+  previous = current_version(root)
+  tmp = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+  with open(tmp, "w", encoding="utf-8") as f:
+    f.write(version)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, os.path.join(root, CURRENT_FILE))
+  if previous and previous != version:
+    with open(os.path.join(root, VERSIONS_DIR, previous, RETIRED_FILE), "w", encoding="utf-8") as f:
+      f.write(str(time.time()))
+
+def abandon_version(version: str, root: str = CHROMA_ROOT):
+  """Mark a build that must not be published; the next gc_versions deletes it."""
+  with open(os.path.join(root, VERSIONS_DIR, version, RETIRED_FILE), "w", encoding="utf-8") as f:
+    f.write("0")
+
+def _last_modified(path: str) -> float:
+  try:
+    return max([os.path.getmtime(path)] + [e.stat().st_mtime for e in os.scandir(path)])
+  except OSError:
+    return time.time()
+
+def _remove_version(path: str):
+  # Drop this process's handles on the version's side stores along with the files
+  close_chunk_store(chunk_store_path(path))
+  close_evidence_index(evidence_index_path(path))
+  shutil.rmtree(path, ignore_errors=True)
+
+def gc_versions(root: str = CHROMA_ROOT, grace_seconds: float = 3600.0, stale_build_seconds: float = 86400.0) -> list[str]:
+  """
+  Delete versions retired more than grace_seconds ago (long enough for running
+  processes to have switched over) and abandoned builds. Unpublished builds
+  are kept while in progress; one untouched for stale_build_seconds was left
+  by a killed ingestion and is deleted too.
+  """
+  removed = []
+  versions_dir = os.path.join(root, VERSIONS_DIR)
+  if not os.path.isdir(versions_dir):
+    return removed
+  current = current_version(root)
+  now = time.time()
+  for version in os.listdir(versions_dir):
+    path = os.path.join(versions_dir, version)
+    marker = os.path.join(path, RETIRED_FILE)
+    if version == current or not os.path.isdir(path):
+      continue
+    if not os.path.exists(marker):
+      if now - _last_modified(path) >= stale_build_seconds:
+        _remove_version(path)
+        removed.append(version)
+      continue
+    try:
+      with open(marker, "r", encoding="utf-8") as f:
+        retired_at = float(f.read().strip() or 0)
+    except (OSError, ValueError):
+      continue
+    if now - retired_at >= grace_seconds:
+      _remove_version(path)
+      removed.append(version)
+  return removed
+
+def shard_path(region: str, base_path: str = "chroma") -> str:
+  """Directory of the physical per-region shard, e.g. chroma/shards/united_states."""
+  slug = re.sub(r"[^A-Za-z0-9]+", "_", region).strip("_").lower()
+  return os.path.join(base_path, SHARDS_DIR, slug)
+
+def index_root(persist_directory: str) -> str:
+  '''The index a store belongs to: region shards (<index>/shards/<region>/) map to <index>.'''
+  path = os.path.normpath(persist_directory)
+  parent = os.path.dirname(path)
+  if os.path.basename(parent) == SHARDS_DIR:
+    path = os.path.dirname(parent)
+  return path
+
+def chunk_store_path(persist_directory: str) -> str:
+  '''The index root's chunk text store; region shards share it.'''
+  return os.path.join(index_root(persist_directory), CHUNK_STORE_FILE)
+
+def evidence_index_path(persist_directory: str) -> str:
+  return os.path.join(index_root(persist_directory), EVIDENCE_INDEX_FILE)
+
+def centroids_path(persist_directory: str) -> str:
+  return os.path.join(index_root(persist_directory), CENTROIDS_FILE)
+
+class ReadWriteLock:
+  '''
+  Many concurrent readers or one writer. Writer-preferring: once a writer
+  waits, new readers queue behind it, so ingestion is not starved by a
+  steady stream of queries.
+  '''
+  def __init__(self):
+    self._cond = threading.Condition()
+    self._readers = 0
+    self._writer = False
+    self._waiting_writers = 0
+
+  @contextmanager
+  def read(self):
+    with self._cond:
+      while self._writer or self._waiting_writers:
+        self._cond.wait()
+      self._readers += 1
+    try:
+      yield
+    finally:
+      with self._cond:
+        self._readers -= 1
+        if not self._readers:
+          self._cond.notify_all()
+
+  @contextmanager
+  def write(self):
+    with self._cond:
+      self._waiting_writers += 1
+      while self._writer or self._readers:
+        self._cond.wait()
+      self._waiting_writers -= 1
+      self._writer = True
+    try:
+      yield
+    finally:
+      with self._cond:
+        self._writer = False
+        self._cond.notify_all()
+
+
+# One chromadb client and one read/write lock per persist directory, shared by
+# every DB handle in the process (Streamlit sessions, worker threads, ingestion).
+# Clients are reference-counted per DB handle and stopped with the last one.
+_CLIENTS: dict = {}   # abspath -> [client, handles, path it was opened with]
+_LOCKS: dict = {}
+_REGISTRY_LOCK = threading.RLock()  # client finalizers may run (via GC) while held
+
+def _registry_key(persist_directory: str) -> str:
+  return os.path.abspath(persist_directory)
+
+def acquire_client(persist_directory: str):
+  '''The process-wide chromadb client for a persist directory, with one more reference held.'''
+  key = _registry_key(persist_directory)
+  with _REGISTRY_LOCK:
+    entry = _CLIENTS.get(key)
+    if entry is None:
+      entry = _CLIENTS[key] = [chromadb.PersistentClient(path=persist_directory), 0, persist_directory]
+    entry[1] += 1
+    return entry[0]
+
+def release_client(persist_directory: str):
+  '''Drop one reference; the last one stops the client so the store's memory is freed.'''
+  key = _registry_key(persist_directory)
+  with _REGISTRY_LOCK:
+    entry = _CLIENTS.get(key)
+    if entry is None:
+      return
+    entry[1] -= 1
+    if entry[1] > 0:
+      return
+    del _CLIENTS[key]
+    # Under the registry lock: nobody can pick up the system while it stops
+    stop_client_system(entry[2])
+
+def client_refs(persist_directory: str) -> int:
+  with _REGISTRY_LOCK:
+    entry = _CLIENTS.get(_registry_key(persist_directory))
+    return entry[1] if entry is not None else 0
+
+def store_lock(persist_directory: str) -> ReadWriteLock:
+  '''Searches of a store hold its read lock; writes hold the write lock.'''
+  key = _registry_key(persist_directory)
+  with _REGISTRY_LOCK:
+    lock = _LOCKS.get(key)
+    if lock is None:
+      lock = _LOCKS[key] = ReadWriteLock()
+    return lock
+
+def chunk_store_for(store: Chroma):
+  '''ChunkStore holding the text of a regulation store's chunks; None if the text is inline in Chroma.'''
+  directory = getattr(store, "_persist_directory", None)
+  if not directory or store._collection.name != REGULATION_COLLECTION:
+    return None
+  return open_chunk_store(chunk_store_path(directory))
+
 
 class DB:
-  def __init__(self, embedding):
-    self.CHROMA_BASE_PATH = "chroma"
-    self.db_path = self.CHROMA_BASE_PATH
-    self.db: Chroma = Chroma(
-      embedding_function=embedding,
-      persist_directory=self.db_path
-    )
+  def __init__(self, embedding, collection_name: str = REGULATION_COLLECTION, persist_directory: str | None = None):
+    self.CHROMA_BASE_PATH = CHROMA_ROOT
+    self.db_path = persist_directory or index_path(self.CHROMA_BASE_PATH)
+    self.collection_name = collection_name
+    # Handles are cheap: the client behind them is shared per directory
+    self.lock = store_lock(self.db_path)
+    client = acquire_client(self.db_path)
+    try:
+      self.db: Chroma = Chroma(
+        client=client,
+        collection_name=collection_name,
+        embedding_function=embedding,
+        persist_directory=self.db_path
+      )
+    except BaseException:
+      release_client(self.db_path)
+      raise
+    # The reference is released by close(), or once the store (which retrievers
+    # handed out may still hold) is garbage collected
+    self._release = weakref.finalize(self.db, release_client, self.db_path)
+    self._legacy_glossary = None
 
 
   def insert_chunks(self, chunks):
-    self.db.add_documents(chunks)
+    with self.lock.write():
+      self.db.add_documents(chunks)
+
+  def insert_embedded(self, ids, embeddings, metadatas, documents=None):
+    '''
+    Add precomputed vectors. documents=None stores no text in Chroma (the
+    text lives in the index's ChunkStore under the same ids).
+    '''
+    with self.lock.write():
+      self.db._collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
 
   def get_retriever(self, search_type: str = "similarity", region: str | None = None, k: int = 5):
     if self.db is None:
       raise RuntimeError("DB not loaded. Call load_db() first.")
     kwargs = {"k": k}
     if search_type == "similarity":
-      if region and region.lower() != "global":
-        kwargs["filter"] = {"region": region}
+      where = self.regulation_filter(region)
+      if where:
+        kwargs["filter"] = where
       return self.db.as_retriever(search_type="similarity", search_kwargs=kwargs)
 
+  def has_legacy_glossary(self) -> bool:
+    '''
+    True if glossary docs were ingested into this collection (stores built
+    before glossary entries moved to their own collection). Checked once.
+    '''
+    if self._legacy_glossary is None:
+      if self.collection_name == GLOSSARY_COLLECTION:
+        self._legacy_glossary = False
+      else:
+        with self.lock.read():
+          found = self.db._collection.get(where={"doc_type": "glossary"}, limit=1, include=[])
+        self._legacy_glossary = bool(found["ids"])
+    return self._legacy_glossary
+
+  def regulation_filter(self, region: str | None = None) -> dict | None:
+    '''
+    Metadata filter applied inside the vector search: restricts to a region
+    and, for legacy mixed stores, excludes glossary docs so every one of the
+    k results is a regulation chunk.
+    '''
+    clauses = []
+    if region and region.lower() != "global":
+      clauses.append({"region": region})
+    if self.has_legacy_glossary():
+      clauses.append({"doc_type": {"$ne": "glossary"}})
+    if not clauses:
+      return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+  def index_version(self) -> str:
+    '''
+    Cheap fingerprint of the persisted index; changes whenever ingestion
+    writes to the store (used to invalidate caches keyed on retrieval).
+    Versioned stores are prefixed with their id; the file fingerprint still
+    counts because `document_manager.py --in_place` writes into a published
+    version.
+    '''
+    parent, name = os.path.split(os.path.normpath(self.db_path))
+    parts = [name] if os.path.basename(parent) == VERSIONS_DIR else []
+    for name in ("chroma.sqlite3", "chroma.sqlite3-wal"):
+      path = os.path.join(self.db_path, name)
+      if os.path.exists(path):
+        st = os.stat(path)
+        parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+    return "|".join(parts) or "empty"
+
   def close(self):
-    self.db.close()
+    '''Release this handle's reference to the shared client (idempotent).'''
+    self._release()
+
+
+def stop_client_system(persist_directory: str):
+  '''
+  langchain's Chroma wrapper has no close(); stop chromadb's cached per-path
+  system so a released store (e.g. an evicted shard) actually frees memory.
+  Only for clients no handle uses any more (see release_client).
+  '''
+  try:
+    from chromadb.api.shared_system_client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(persist_directory, None)
+    if system is not None:
+      system.stop()
+  except Exception:
+    pass
+
+
+def similarity_from_distance(distance: float, space: str = "l2") -> float:
+  '''
+  Cosine similarity for a Chroma distance between unit-length embeddings
+  (MiniLM output is normalized): "l2" is squared L2 = 2 - 2*cos, while
+  "cosine" and "ip" are 1 - cos.
+  '''
+  if space == "l2":
+    return 1.0 - distance / 2.0
+  return 1.0 - distance
+
+def distance_space(store: Chroma) -> str:
+  return (store._collection.metadata or {}).get("hnsw:space") or "l2"
+
+
+def query_collection(store: Chroma, query_embeddings, k: int = 5, where: dict | None = None,
+                     chunks=None, materialize_text: bool = True):
+  '''
+  Run one vectorized search for many query embeddings against a Chroma store.
+
+  chunks: the index's ChunkStore when chunk text is kept out of Chroma. The
+          search then fetches only ids, metadata and distances; documents carry
+          metadata["chunk_id"] and have their text filled in here only if
+          materialize_text (otherwise call chunk_store.materialize later).
+
+  Output:
+    list (one per query) of list of (Document, distance), nearest first
+  '''
+  if not query_embeddings:
+    return []
+  include = ["metadatas", "distances"] if chunks is not None else ["documents", "metadatas", "distances"]
+  directory = getattr(store, "_persist_directory", None)
+  with (store_lock(directory).read() if directory else nullcontext()):
+    res = store._collection.query(
+      query_embeddings=[list(v) for v in query_embeddings],
+      n_results=k,
+      where=where or None,
+      include=include,
+    )
+  results = []
+  for i, (ids, metas, dists) in enumerate(zip(res["ids"], res["metadatas"], res["distances"])):
+    texts = res["documents"][i] if chunks is None else [""] * len(ids)
+    pairs = []
+    for chunk_id, text, meta, dist in zip(ids, texts, metas, dists):
+      meta = dict(meta or {})
+      if chunks is not None:
+        meta[CHUNK_ID_KEY] = chunk_id
+      pairs.append((Document(page_content=text or "", metadata=meta), dist))
+    results.append(pairs)
+  if chunks is not None and materialize_text:
+    materialize((doc for pairs in results for doc, _ in pairs), [chunks])
+  return results
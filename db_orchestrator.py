@@ -1,19 +1,96 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Union
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 
-from db import DB
+from db import CHROMA_ROOT, CURRENT_FILE, DB, SHARDS_DIR, current_version, index_path, shard_path
+from retriever_service import RetrievalCache
 
 class DBOrchestrator:
-    CHROMA_BASE_PATH = "chroma/"
+    CHROMA_BASE_PATH = CHROMA_ROOT
 
-    def __init__(self, embedding: HuggingFaceEmbeddings):
+    def __init__(self, embedding: HuggingFaceEmbeddings, sharded: bool | None = None, max_open_shards: int = 4,
+                 check_interval: float = 2.0, retrieval_cache_size: int = 4096):
+        '''
+        Parameters:
+            embedding: embedding model shared by every store
+            sharded: route single-region queries to physical per-region shards
+                     (<index>/shards/<region>/). None = use shards if any exist.
+            max_open_shards: bound on simultaneously open shard handles (LRU)
+            check_interval: seconds between checks for a newly published index version
+            retrieval_cache_size: search results kept for RetrieverService (0 = no cache)
+        '''
         self.embedding = embedding
-        regions = os.listdir(self.CHROMA_BASE_PATH)
-        # self.db_by_region = {}
-        # for region in regions:
-        #     self.db_by_region[region] = DB(region, self.embedding)
-        self.db = DB(embedding=self.embedding)  
+        self._sharded_opt = sharded
+        self.max_open_shards = max(1, max_open_shards)
+        self.check_interval = check_interval
+        self._shards: "OrderedDict[str, DB]" = OrderedDict()
+        self._lock = threading.RLock()
+        # Shared by the short-lived RetrieverServices built per query/batch
+        self.retrieval_cache = RetrievalCache(retrieval_cache_size) if retrieval_cache_size > 0 else None
+        self._pointer_mtime = self._current_mtime()
+        self._last_check = time.monotonic()
+        self._open(current_version(self.CHROMA_BASE_PATH))
+
+    def _current_mtime(self):
+        try:
+            return os.stat(os.path.join(self.CHROMA_BASE_PATH, CURRENT_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _open(self, version: str | None):
+        '''Open the stores of one index version (the legacy chroma/ store when None).'''
+        base_path = index_path(self.CHROMA_BASE_PATH, version)
+        shards_root = os.path.join(base_path, SHARDS_DIR)
+        shard_regions = set(os.listdir(shards_root)) if os.path.isdir(shards_root) else set()
+        # The full store serves Global queries and regions without a shard; always warm
+        db = DB(embedding=self.embedding, persist_directory=base_path)
+        with self._lock:
+            self.version, self.base_path = version, base_path
+            self.shard_regions = shard_regions
+            self.sharded = bool(shard_regions) if self._sharded_opt is None else self._sharded_opt
+            self.db = db
+            self._shards = OrderedDict()
+        # In-flight queries may still use the old handles, so they are not closed
+        # here; each releases its client reference once unreferenced (see DB)
+
+    def maybe_refresh(self) -> bool:
+        '''Switch to a newly published index version. Returns True if swapped.'''
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        mtime = self._current_mtime()
+        if mtime == self._pointer_mtime:
+            return False
+        self._pointer_mtime = mtime
+        version = current_version(self.CHROMA_BASE_PATH)
+        if version == self.version:
+            return False
+        # New handles are opened before the swap, so queries never wait on it
+        self._open(version)
+        print(f"Switched to index version {version}")
+        return True
+
+    def _get_shard(self, region: str) -> DB | None:
+        '''Open a region shard on first use, keeping at most max_open_shards handles.'''
+        path = shard_path(region, self.base_path)
+        if os.path.basename(path) not in self.shard_regions:
+            return None
+        with self._lock:
+            shard = self._shards.get(region)
+            if shard is not None:
+                self._shards.move_to_end(region)
+                return shard
+            shard = DB(embedding=self.embedding, persist_directory=path)
+            self._shards[region] = shard
+            while len(self._shards) > self.max_open_shards:
+                # Retrievers handed out earlier may still hold the store; its
+                # client reference goes with the last of them, not under a running query
+                self._shards.popitem(last=False)
+            return shard
 
     def get_retriever_by_region(self, region):
         '''
@@ -25,7 +102,13 @@ class DBOrchestrator:
         Output:
             dict: key: region, value: retriever
         '''
+        self.maybe_refresh()
         if isinstance(region, str):
+            if self.sharded and region.lower() != "global":
+                shard = self._get_shard(region)
+                if shard is not None:
+                    # The shard only holds this region: no region filter to evaluate
+                    return shard.get_retriever()
             return self.db.get_retriever(region=region)
 
         # Input is list
@@ -36,4 +119,7 @@ class DBOrchestrator:
         except KeyError:
             print(f"Region {r} not found in the database")
         return retrievers
-            
\ No newline at end of file
+
+    def index_version(self) -> str:
+        self.maybe_refresh()
+        return self.db.index_version()
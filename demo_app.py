@@ -19,67 +19,42 @@ for name in [
 
 # --- Your project imports ---
 from gemini_llm_service import GeminiLLMService
-from main import process_query  # your RetrievalQA + parsing
-
-# ---------- Helpers: CSV history ----------
-HISTORY_COLUMNS = ["timestamp", "feature", "feature_description", "response_json"]
-
-def _ensure_history_df(path: str) -> pd.DataFrame:
-    """Load history CSV, tolerating missing headers; return a normalized DataFrame."""
-    if not os.path.exists(path):
-        return pd.DataFrame(columns=HISTORY_COLUMNS)
-
-    try:
-        df = pd.read_csv(path)
-        # If someone wrote without headers (old script), try to coerce:
-        if set(df.columns) & set(HISTORY_COLUMNS) != set(HISTORY_COLUMNS):
-            df = pd.read_csv(path, header=None, names=["feature", "feature_description", "response_json"])
-            # If no timestamp, inject an approximate one
-            df["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            df = df[HISTORY_COLUMNS]
-    except Exception:
-        # Fallback: try no-header mode
-        df = pd.read_csv(path, header=None, names=["feature", "feature_description", "response_json"])
-        df["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        df = df[HISTORY_COLUMNS]
-
-    # Fill NaNs
-    for c in HISTORY_COLUMNS:
-        if c not in df.columns:
-            df[c] = ""
-    return df[HISTORY_COLUMNS]
-
-
-def upsert_history(path: str, feature: str, feature_description: str, response_obj: dict) -> None:
-    """Upsert a row keyed by 'feature'. Always writes canonical header."""
-    df = _ensure_history_df(path)
-
-    # Compact JSON for CSV storage
-    resp_str = json.dumps(response_obj, ensure_ascii=False, separators=(",", ":"))
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    if (df["feature"] == feature).any():
-        mask = df["feature"] == feature
-        df.loc[mask, "feature_description"] = feature_description
-        df.loc[mask, "response_json"] = resp_str
-        df.loc[mask, "timestamp"] = ts
-    else:
-        df.loc[len(df)] = [ts, feature, feature_description, resp_str]
+from main import stream_query, load_embeddings  # your RetrievalQA + parsing
+from db_orchestrator import DBOrchestrator
+from rag_chain import parse_partial_json
+from retriever_service import AdaptiveCutoff
+from semantic_cache import SemanticCache
+from history_store import HistoryStore, HISTORY_COLUMNS
+
+# ---------- Helpers: cached resources (process-wide, shared across sessions) ----------
+@st.cache_resource(show_spinner=False)
+def get_llm_service(model_name: str, max_tokens: int) -> GeminiLLMService:
+    """One Gemini client per (model, max tokens) setting."""
+    return GeminiLLMService(
+        model_json=model_name,
+        model_text=model_name,
+        max_output_tokens=max_tokens,
+    )
 
-    df.to_csv(path, index=False)
 
+@st.cache_resource(show_spinner=False)
+def get_retrieval_resources():
+    """Embedding model + vector store handles, loaded once per process."""
+    embeddings = load_embeddings()
+    return embeddings, DBOrchestrator(embeddings)
+
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache() -> SemanticCache:
+    """Answer cache for near-duplicate feature descriptions, shared across sessions."""
+    return SemanticCache()
 
-def load_history(path: str) -> pd.DataFrame:
-    """Read history CSV and return newest-first."""
-    df = _ensure_history_df(path)
-    # Sort by timestamp if present
-    if "timestamp" in df.columns:
-        try:
-            df["ts_sort"] = pd.to_datetime(df["timestamp"], errors="coerce")
-            df = df.sort_values("ts_sort", ascending=False).drop(columns=["ts_sort"])
-        except Exception:
-            pass
-    return df
+
+# ---------- Helpers: history store ----------
+@st.cache_resource
+def get_history_store(path: str) -> HistoryStore:
+    """One SQLite-backed store per path, shared across sessions."""
+    return HistoryStore(path)
 
 
 # ---------- UI THEME / STYLES ----------
@@ -118,7 +93,7 @@ with colA:
     st.markdown("## 🧭 Geo-Reg Compliance Demo")
     st.markdown(
         "Evaluate a feature description against region-specific regulations using your RAG pipeline + Gemini. "
-        "Returns a strict JSON schema, with a persistent CSV log and a collapsible history panel."
+        "Returns a strict JSON schema, with a persistent history log and a collapsible history panel."
     )
 
 with colB:
@@ -127,6 +102,9 @@ with colB:
         key_ok = "GEMINI_API_KEY" in os.environ and bool(os.environ["GEMINI_API_KEY"].strip())
         st.metric("Gemini API key", "Found" if key_ok else "Missing", delta=None)
         st.caption("Set `GEMINI_API_KEY` in your environment before running Streamlit.")
+        cache_stats = get_semantic_cache().stats()
+        st.metric("Answer cache hit rate", f"{cache_stats['hit_rate']:.0%}",
+                  help=f"{cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['entries']} entries")
         st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------- SIDEBAR CONTROLS ----------
@@ -134,11 +112,21 @@ with st.sidebar:
     st.markdown("### ⚙️ Settings")
     model_name = st.selectbox("Gemini model", ["gemini-2.5-flash", "gemini-2.5-pro"], index=0)
     k = st.slider("Top-K retrieval", 1, 5, 3)
+    adaptive_k = st.checkbox("Adaptive K (drop weak matches)", value=True)
     max_tokens = st.slider("Max output tokens", 256, 8192, 4096, step=128)
     st.markdown("---")
+    history_db = st.text_input("History database path", value="history.db",
+                               help="Each run upserts by 'feature' into this SQLite database.")
     # CSV path defaults to the batch logger's file for consistency
     history_csv = st.text_input("Results CSV path", value="sample_data_response.csv",
-                                help="Each run upserts by 'feature' into this CSV.")
+                                help="Imported once into the history database; export writes back here.")
+    history = get_history_store(history_db)
+    imported = history.import_csv_once(history_csv)
+    if imported:
+        st.caption(f"Imported {imported} rows from `{history_csv}`.")
+    if st.button("Export history to CSV", use_container_width=True):
+        exported = history.export_csv(history_csv)
+        st.success(f"Exported {exported} rows to `{history_csv}`.")
     st.caption(f"Run timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 # ---------- INPUTS ----------
@@ -169,61 +157,81 @@ if run:
     elif not os.environ.get("GEMINI_API_KEY"):
         st.error("GEMINI_API_KEY not set. Please export it in your environment and restart.")
     else:
-        with st.spinner("Running retrieval + Gemini…"):
-            # Instantiate Gemini service
-            service = GeminiLLMService(
-                model_json=model_name,
-                model_text=model_name,
-                max_output_tokens=max_tokens,
+        try:
+            with st.spinner("Loading models…"):
+                # Cached: only the first run (per model/max-token setting) pays for this
+                service = get_llm_service(model_name, max_tokens)
+                embeddings, db_orchestrator = get_retrieval_resources()
+
+            # Stream the JSON into the page as it is generated
+            st.markdown("#### JSON (Markdown)")
+            live_text = st.empty()
+            st.markdown("#### Parsed (live)")
+            live_json = st.empty()
+
+            chunks = []
+            with st.spinner("Running retrieval + Gemini…"):
+                for chunk in stream_query(service, feature_desc, k,
+                                          embeddings=embeddings, db_orchestrator=db_orchestrator,
+                                          cache=get_semantic_cache(),
+                                          cutoff=AdaptiveCutoff() if adaptive_k else None):
+                    chunks.append(chunk)
+                    text = "".join(chunks)
+                    live_text.markdown(text)
+                    partial = parse_partial_json(text)
+                    if partial is not None:
+                        live_json.json(partial)
+            result_obj = "".join(chunks)
+
+            # ---------- DISPLAY ----------
+            st.success("Evaluation complete.")
+
+            # Download button
+            st.download_button(
+                label="Download JSON",
+                data=result_obj,
+                file_name=f"{(feature or 'response').strip()}.json",
+                mime="application/json",
+                use_container_width=True,
             )
 
-            try:
-                # Your existing pipeline (returns parsed JSON/dict)
-                # Note: We do not concatenate feature+desc for the LLM unless that's your intended input design.
-                result_obj = process_query(service, feature_desc, k)
-
-                # ---------- DISPLAY ----------
-                st.success("Evaluation complete.")
-
-                # Markdown code view (no fences inside the string)
-                st.markdown("#### JSON (Markdown)")
-                st.markdown(result_obj)
-
-                # Download button
-                st.download_button(
-                    label="Download JSON",
-                    data=result_obj,
-                    file_name=f"{(feature or 'response').strip()}.json",
-                    mime="application/json",
-                    use_container_width=True,
-                )
-
-                # ---------- CSV UPSERT ----------
-                if not feature.strip():
-                    st.info("Tip: Provide a 'Feature name' to store this run in the CSV history.")
-                else:
-                    upsert_history(history_csv, feature.strip(), feature_desc.strip(), result_obj)
-                    st.success(f"Saved/updated **{feature.strip()}** in `{history_csv}`.")
-
-            except Exception as e:
-                st.error(f"Error while processing: {e}")
+            # ---------- HISTORY UPSERT ----------
+            if not feature.strip():
+                st.info("Tip: Provide a 'Feature name' to store this run in the history.")
+            else:
+                history.upsert(feature.strip(), feature_desc.strip(), result_obj)
+                st.success(f"Saved/updated **{feature.strip()}** in `{history_db}`.")
+
+        except Exception as e:
+            st.error(f"Error while processing: {e}")
 
 # ---------- HISTORY PANEL ----------
 st.markdown("### History")
 with st.expander("Show past queries & responses", expanded=False):
-    df = load_history(history_csv)
-    if df.empty:
-        st.caption("No history yet. Runs will be added here.")
+    hc1, hc2 = st.columns([0.7, 0.3])
+    with hc1:
+        search = st.text_input("Search descriptions", key="history_search",
+                               placeholder="e.g., curfew Utah")
+    with hc2:
+        page_size = st.selectbox("Rows per page", [10, 25, 50, 100], index=1)
+    total = history.count(search)
+    if total == 0:
+        st.caption("No history yet. Runs will be added here." if not search else "No matching runs.")
     else:
+        pages = (total + page_size - 1) // page_size
+        page_no = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+        rows = history.page(limit=page_size, offset=(page_no - 1) * page_size, search=search)
+        st.caption(f"{total} runs")
+        df = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
         # Optional quick table
         st.dataframe(
             df[["timestamp", "feature", "feature_description"]],
             use_container_width=True,
             hide_index=True
         )
-        # Scrollable detailed view
+        # Scrollable detailed view (current page only)
         st.markdown("<div class='history-scroll'>", unsafe_allow_html=True)
-        for _, row in df.iterrows():
+        for row in rows:
             st.markdown(f"**{row['feature']}** — _{row['timestamp']}_")
             st.markdown(f"> {row['feature_description']}")
             try:
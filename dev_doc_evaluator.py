@@ -1,16 +1,35 @@
 import os
+import re
 import pypdf
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 from llm_service import LLMService
+from gemini_llm_service import GeminiLLMService
 from evaluate_dev_doc_prompt import evaluate_dev_doc_prompt
 from bs4 import BeautifulSoup
 from markdown import Markdown
 from rag_chain import extract_json
 
 class DevDocEvaluator:
-    def __init__(self, llm: LLMService):
+    def __init__(
+        self,
+        llm: LLMService,
+        embedding=None,
+        window_chars: int = 12000,
+        max_workers: Optional[int] = None,
+        dedup_threshold: float = 0.9,
+    ):
         self.llm = llm
         self.EVALUATE_PROMPT = evaluate_dev_doc_prompt()
+        # Windowed (map-reduce) mode settings
+        self.embedding = embedding              # optional; enables similarity de-duplication
+        self.window_chars = window_chars
+        # The local HF pipeline is not thread-safe: only Gemini gets parallel windows by default
+        if max_workers is None:
+            max_workers = 4 if isinstance(llm, GeminiLLMService) else 1
+        self.max_workers = max_workers
+        self.dedup_threshold = dedup_threshold
 
     def extract_dir_contents(self, dev_doc_dir: str) -> dict:
         # Parse different types of dev docs
@@ -40,7 +59,18 @@ class DevDocEvaluator:
                 content.append('')
         return content
 
-    def evaluate(self, dev_doc_path: str) -> list:
+    def evaluate(self, dev_doc_path: str, windowed: bool = False) -> list:
+        '''
+        Extract features from a dev doc (or every doc in a directory).
+
+        Parameters:
+            dev_doc_path: path to a file or directory
+            windowed: split each document into page/section windows, extract
+                features from the windows concurrently and merge the results
+
+        Output:
+            list of dict: {"file": str, "features": [{feature_name, feature_description}]}
+        '''
         # If path is directory, extract all contents
         if os.path.isdir(dev_doc_path):
             contents = self.extract_dir_contents(dev_doc_path)
@@ -50,19 +80,121 @@ class DevDocEvaluator:
         
         responses = []
         for file, content in contents.items():
-            prompt = self.EVALUATE_PROMPT.format(context=content)
-            response = self.llm.pipe(prompt)[0]['generated_text']
-            try:
-                responses.append(extract_json(response))
-            except Exception as e:
-                print(f'Error extracting JSON from {file}: {e}')
-                if response[-1] != '}':
-                    response = response + '}'
-                    try:
-                        responses.append(extract_json(response))
-                    except Exception as e:
-                        print(f'Error extracting JSON from {file}: {e}')
+            if windowed:
+                responses.append(self.evaluate_windowed(file, content))
+                continue
+            obj = self._extract_features(file, content)
+            if obj is not None:
+                responses.append(obj)
         return responses
+
+    def evaluate_windowed(self, file: str, content: list) -> dict:
+        '''
+        Map-reduce extraction: each window is evaluated independently (map) and
+        the per-window features are de-duplicated into one result (reduce).
+        Latency follows the largest window rather than the whole document.
+        '''
+        windows = self.split_windows(content, self.window_chars)
+        if not windows:
+            return {"file": file, "features": []}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(windows)))) as pool:
+            partials = list(pool.map(lambda w: self._extract_features(file, w), windows))
+
+        features = []
+        for obj in partials:
+            if obj is None:
+                continue
+            features.extend(f for f in obj.get("features", []) if isinstance(f, dict))
+        return {"file": file, "features": self.dedupe_features(features)}
+
+    def _extract_features(self, file: str, content) -> Optional[dict]:
+        prompt = self.EVALUATE_PROMPT.format(context=content)
+        response = self.llm.pipe(prompt)[0]['generated_text']
+        try:
+            return extract_json(response)
+        except Exception as e:
+            print(f'Error extracting JSON from {file}: {e}')
+            if response[-1] != '}':
+                response = response + '}'
+                try:
+                    return extract_json(response)
+                except Exception as e:
+                    print(f'Error extracting JSON from {file}: {e}')
+        return None
+
+    @staticmethod
+    def split_windows(content: list, window_chars: int) -> List[str]:
+        '''
+        Group pages into windows of at most window_chars characters.
+        Pages larger than a window are split on blank-line section breaks,
+        and hard-split only when a single section is still too large.
+        '''
+        pieces = []
+        for page in content:
+            if not page or not page.strip():
+                continue
+            if len(page) <= window_chars:
+                pieces.append(page)
+                continue
+            for section in re.split(r'\n\s*\n', page):
+                if not section.strip():
+                    continue
+                for i in range(0, len(section), window_chars):
+                    pieces.append(section[i:i + window_chars])
+
+        windows, current, size = [], [], 0
+        for piece in pieces:
+            if current and size + len(piece) > window_chars:
+                windows.append('\n\n'.join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 2
+        if current:
+            windows.append('\n\n'.join(current))
+        return windows
+
+    def dedupe_features(self, features: list) -> list:
+        '''
+        Cheap reduce step: merge features with the same normalized name, then
+        (if an embedding model is configured) merge features whose
+        name + description embeddings are more similar than dedup_threshold.
+        The longer description wins on merge.
+        '''
+        by_name = {}
+        for f in features:
+            name = str(f.get('feature_name', '')).strip()
+            if not name:
+                continue
+            key = re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+            kept = by_name.get(key)
+            if kept is None or len(str(f.get('feature_description', ''))) > len(str(kept.get('feature_description', ''))):
+                by_name[key] = f
+        merged = list(by_name.values())
+
+        if self.embedding is None or len(merged) < 2:
+            return merged
+
+        vectors = self.embedding.embed_documents(
+            [f"{f.get('feature_name', '')} {f.get('feature_description', '')}" for f in merged]
+        )
+        norms = [sum(x * x for x in v) ** 0.5 or 1.0 for v in vectors]
+        kept_idx = []
+        for i, v in enumerate(vectors):
+            duplicate_of = None
+            for j in kept_idx:
+                sim = sum(a * b for a, b in zip(v, vectors[j])) / (norms[i] * norms[j])
+                if sim >= self.dedup_threshold:
+                    duplicate_of = j
+                    break
+            if duplicate_of is None:
+                kept_idx.append(i)
+            elif len(str(merged[i].get('feature_description', ''))) > len(str(merged[duplicate_of].get('feature_description', ''))):
+                # Keep the richer description under the first-seen slot
+                merged[duplicate_of] = merged[i]
+                vectors[duplicate_of] = vectors[i]
+                norms[duplicate_of] = norms[i]
+        return [merged[i] for i in kept_idx]
     
     def evaluate_doc_from_change(self, change: dict):
         pass
@@ -72,4 +204,4 @@ if __name__ == "__main__":
     dev_doc_evaluator = DevDocEvaluator(llm)
     texts = dev_doc_evaluator.evaluate('dev_docs/example_prd.pdf')
     print(texts)
-    # print(texts)
\ No newline at end of file
+    # print(texts)
@@ -1,16 +1,140 @@
+from html.parser import HTMLParser
+from typing import Iterator, List
+
+from langchain.schema import Document
 from langchain_community.document_loaders import BSHTMLLoader
 from langchain_community.document_loaders import PyPDFLoader
 
+PDF_BACKENDS = ("pypdf", "pymupdf")
+
+class _HTMLSectionParser(HTMLParser):
+  '''
+  Incremental HTML -> text parser. Text is cut into sections at headings (or
+  once a section grows past max_chars at a block boundary), so only the
+  current section is held in memory.
+  '''
+  BLOCK_TAGS = {"p", "div", "br", "li", "tr", "table", "section", "article", "blockquote", "pre", "dd", "dt"}
+  HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+  SKIP_TAGS = {"script", "style", "noscript", "head"}
+
+  def __init__(self, max_chars: int):
+    super().__init__(convert_charrefs=True)
+    self.max_chars = max_chars
+    self.title = ""
+    self.sections: List[str] = []
+    self._parts: List[str] = []
+    self._size = 0
+    self._skip = 0
+    self._in_title = False
+
+  def _flush(self):
+    text = "".join(self._parts).strip()
+    if text:
+      self.sections.append(text)
+    self._parts, self._size = [], 0
+
+  def handle_starttag(self, tag, attrs):
+    if tag == "title":
+      self._in_title = True
+    if tag in self.SKIP_TAGS:
+      self._skip += 1
+    elif tag in self.HEADING_TAGS:
+      self._flush()
+    elif tag in self.BLOCK_TAGS:
+      if self._size >= self.max_chars:
+        self._flush()
+      else:
+        self._parts.append("\n")
+
+  def handle_endtag(self, tag):
+    if tag == "title":
+      self._in_title = False
+    if tag in self.SKIP_TAGS:
+      self._skip = max(0, self._skip - 1)
+    elif tag in self.HEADING_TAGS or tag in self.BLOCK_TAGS:
+      self._parts.append("\n")
+
+  def handle_data(self, data):
+    if self._in_title:
+      self.title += data.strip()
+    if self._skip or not data.strip():
+      return
+    self._parts.append(data)
+    self._size += len(data)
+
+  def close(self):
+    super().close()
+    self._flush()
+
 class DocumentLoader:
-  def __init__(self, file_path):
+  def __init__(self, file_path, pdf_backend: str = "pypdf", read_bytes: int = 1 << 16, max_section_chars: int = 20000):
+    '''
+    Parameters:
+      pdf_backend: "pypdf" (default) or "pymupdf" (faster text extraction; needs PyMuPDF installed)
+      read_bytes: HTML is read and parsed in blocks of this size
+      max_section_chars: HTML sections longer than this are cut at the next block element
+    '''
     file_path = file_path.strip()
+    self.file_path = file_path
+    self.pdf_backend = pdf_backend
+    self.read_bytes = read_bytes
+    self.max_section_chars = max_section_chars
     if file_path.endswith(".html"):
       self.loader = BSHTMLLoader(file_path=file_path, open_encoding="utf-8")
     elif file_path.endswith(".pdf"):
+      if pdf_backend not in PDF_BACKENDS:
+        raise ValueError(f"Unsupported PDF backend: {pdf_backend}")
       self.loader = PyPDFLoader(file_path=file_path)
     else:
       print(file_path.endswith(".html"), file_path[-5:])
       raise ValueError(f"Unsupported file type: {file_path}")
 
   def load(self):
-    return self.loader.load()
\ No newline at end of file
+    return self.loader.load()
+
+  def lazy_load(self) -> Iterator[Document]:
+    '''Yield one Document per PDF page / HTML section without materializing the whole file.'''
+    if self.file_path.endswith(".html"):
+      yield from self._lazy_load_html()
+    elif self.pdf_backend == "pymupdf":
+      yield from self._lazy_load_pymupdf()
+    else:
+      yield from self.loader.lazy_load()
+
+  def _lazy_load_pymupdf(self) -> Iterator[Document]:
+    try:
+      import fitz  # PyMuPDF
+    except ImportError:
+      print("PyMuPDF not installed; falling back to pypdf")
+      yield from self.loader.lazy_load()
+      return
+    with fitz.open(self.file_path) as pdf:
+      for i, page in enumerate(pdf):
+        yield Document(
+          page_content=page.get_text(),
+          metadata={"source": self.file_path, "page": i, "total_pages": pdf.page_count}
+        )
+
+  def _lazy_load_html(self) -> Iterator[Document]:
+    parser = _HTMLSectionParser(self.max_section_chars)
+    section = 0
+
+    def drain():
+      nonlocal section
+      for text in parser.sections:
+        yield Document(
+          page_content=text,
+          metadata={"source": self.file_path, "title": parser.title, "section": section}
+        )
+        section += 1
+      parser.sections.clear()
+
+    with open(self.file_path, "r", encoding="utf-8") as f:
+      while True:
+        block = f.read(self.read_bytes)
+        if not block:
+          break
+        parser.feed(block)
+        yield from drain()
+    parser.close()
+    yield from drain()
@@ -1,5 +1,6 @@
 # document_manager.py
 import os
+import uuid
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import DirectoryLoader
@@ -7,26 +8,113 @@ from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document  # NEW
 
 from document_loader import DocumentLoader
-from db import DB
-from terminology import GLOSSARY  # NEW: use your glossary dict
+from statute_chunker import StatuteChunker
+from change_prescreen import add_region_sums, load_region_sums, save_region_sums
+from chunk_store import open_chunk_store
+from db import (
+  DB, GLOSSARY_COLLECTION, abandon_version, centroids_path, chunk_store_path, evidence_index_path, gc_versions,
+  index_path, new_version, publish_version, shard_path
+)
+from evidence_index import open_evidence_index
+from terminology import get_glossary  # NEW: glossary from terminology_table.csv (+ built-ins)
 
 class DocumentManager():
-  def __init__(self, dir):
+  def __init__(self, dir, shard_by_region=False, pdf_backend="pypdf", batch_size=256, versioned=True, grace_seconds=3600,
+               base_path=None, embedding=None, chunk_store=True):
     self.dir = dir
+    # Also write each region's chunks to its own physical shard (<index>/shards/<region>/)
+    self.shard_by_region = shard_by_region
+    # Build into chroma/versions/<id>/ and publish atomically when done, instead of
+    # writing into the store that running processes are querying
+    self.versioned = versioned
+    self.grace_seconds = grace_seconds
+    # Unversioned builds write here (default: the published index)
+    self.base_path = base_path or index_path()
+    self.pdf_backend = pdf_backend
+    # Chunks are embedded and written in batches of this size while pages stream in
+    self.batch_size = batch_size
+    # Keep chunk text compressed in <index>/chunks.sqlite3 instead of inside Chroma
+    self.use_chunk_store = chunk_store
+    self.chunks = None
+    self.evidence = None
+    self.region_sums = None
+    self._dbs = {}
+    self.written = 0
     self.EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-    self.embedding = HuggingFaceEmbeddings(model_name=self.EMBEDDING_MODEL)
+    self.embedding = embedding or HuggingFaceEmbeddings(model_name=self.EMBEDDING_MODEL)
 
-  def process_documents(self, chunk_size=1000, chunk_overlap=500):
+  def process_documents(self, chunk_size=None, chunk_overlap=500, chunker="statute"):
     '''
     Chunks the documents and saves them to the database as embeddings.
     Takes regional metadata from texts-available.csv.
     Saves the embeddings to the database (single collection) with region metadata.
+
+    chunker: "statute" splits on section/subsection boundaries and tags each chunk
+             with its anchor (windowed fallback only for oversized subsections);
+             "recursive" is the plain overlapping window splitter.
+    chunk_size: defaults to 1500 for "statute", 1000 for "recursive".
+
+    A versioned build is published only if every source loaded and chunks were
+    written; otherwise it is abandoned (deleted) and RuntimeError is raised,
+    so the published index is never replaced by an empty or partial one.
     '''
 
+    version = None
+    self.written = 0
+    if self.versioned:
+      version, self.base_path = new_version()
+      print(f"Building index version {version} in {self.base_path}")
+    try:
+      failed = self._ingest(chunk_size, chunk_overlap, chunker)
+    except BaseException:
+      if version is not None:
+        self._abandon(version)
+      raise
+    # In-place writes are in the store even if incomplete, so their sums are kept too
+    if self.region_sums is not None and self.written:
+      save_region_sums(centroids_path(self.base_path), self.region_sums)
+    # Writing is over: release the clients before running processes switch to the new version
+    self._close_dbs()
+
+    if failed or not self.written:
+      reason = f"{len(failed)} source(s) failed ({', '.join(failed)})" if failed else "no chunks were written"
+      if version is None:
+        raise RuntimeError(f"In-place ingestion into {self.base_path} is incomplete: {reason}")
+      self._abandon(version)
+      raise RuntimeError(f"Index version {version} not published: {reason}")
+
+    if version is not None:
+      publish_version(version)
+      print(f"Published index version {version}")
+      removed = gc_versions(grace_seconds=self.grace_seconds)
+      if removed:
+        print(f"Removed retired index versions: {', '.join(removed)}")
+
+  def _close_dbs(self):
+    for db in self._dbs.values():
+      db.close()
+    self._dbs.clear()
+
+  def _abandon(self, version):
+    self._close_dbs()
+    abandon_version(version)
+    gc_versions(grace_seconds=self.grace_seconds)
+    print(f"Abandoned index version {version}")
+
+  def _ingest(self, chunk_size, chunk_overlap, chunker):
+    '''Load, chunk and store every source plus the glossary. Returns the sources that failed.'''
+    self.chunks = self._open_chunk_store()
+    # Sentence hashes for evidence verification; keyed by chunk id, so only with the chunk store
+    if self.chunks is not None:
+      self.evidence = open_evidence_index(evidence_index_path(self.base_path), create=True)
+    self.region_sums = self._load_region_sums()
+
     with open("texts-available.csv", "r") as f:
       _ = f.readline()            # skip header
       texts_available = f.readlines()
 
+    if chunk_size is None:
+      chunk_size = 1500 if chunker == "statute" else 1000
     text_splitter = RecursiveCharacterTextSplitter(
       chunk_size=chunk_size,
       chunk_overlap=chunk_overlap,
@@ -34,35 +122,93 @@ class DocumentManager():
       add_start_index=True
     )
 
+    failed = []
     for row in texts_available:
       if not row.strip():
         continue
       region, text_name = [s.strip() for s in row.split(",", 1)]
       try:
-        loader = DocumentLoader(os.path.join(self.dir, text_name))
-        document = loader.load()
+        loader = DocumentLoader(os.path.join(self.dir, text_name), pdf_backend=self.pdf_backend)
+        # Pages/sections stream straight into the splitter; only one batch of
+        # chunks is held in memory at a time
+        if chunker == "statute":
+          chunks = StatuteChunker(chunk_size=chunk_size).split(loader.lazy_load())
+        else:
+          chunks = (c for page in loader.lazy_load() for c in text_splitter.split_documents([page]))
+        batch = []
+        for chunk in chunks:
+          batch.append(chunk)
+          if len(batch) >= self.batch_size:
+            self.save_to_db(region, batch)
+            batch = []
+        if batch:
+          self.save_to_db(region, batch)
       except Exception as e:
         print(f"Error loading {text_name}: {e}")
+        failed.append(text_name)
         continue
 
-      chunks = text_splitter.split_documents(document)
-      self.save_to_db(region, chunks)
-
     self.save_glossary_to_db()
+    return failed
+
+  def _open_chunk_store(self):
+    if not self.use_chunk_store:
+      return None
+    path = chunk_store_path(self.base_path)
+    # An existing store with its text inside Chroma (in-place build) stays that way
+    if not os.path.exists(path) and os.path.exists(os.path.join(self.base_path, "chroma.sqlite3")):
+      print("Index keeps chunk text in Chroma; not adding a chunk store")
+      return None
+    return open_chunk_store(path, create=True)
+
+  def _load_region_sums(self):
+    # Pre-screen centroids; an in-place build adds to the ones already stored
+    sums = load_region_sums(centroids_path(self.base_path))
+    if sums is None and os.path.exists(os.path.join(self.base_path, "chroma.sqlite3")):
+      return None   # older index without centroids: the pre-screen averages its embeddings instead
+    return sums or {}
 
   def save_to_db(self, region, chunks):
     for d in chunks:
       if not getattr(d, "metadata", None):
         d.metadata = {}
       d.metadata["region"] = region.strip()
+      d.metadata["doc_type"] = "regulation"
+
+    # Embedded once, written to the full store and (optionally) the region shard
+    texts = [d.page_content for d in chunks]
+    ids = [uuid.uuid4().hex for _ in chunks]
+    vectors = self.embedding.embed_documents(texts)
+    metadatas = [d.metadata for d in chunks]
+    documents = texts
+    if self.chunks is not None:
+      self.chunks.put_many(zip(ids, texts))
+      documents = None
+    if self.evidence is not None:
+      self.evidence.add_chunks(ids, texts, [m.get("anchor") for m in metadatas])
+    if self.region_sums is not None:
+      add_region_sums(self.region_sums, region.strip(), vectors)
 
-    db = DB(self.embedding)
-    db.insert_chunks(chunks)
+    targets = [self.base_path]
+    if self.shard_by_region:
+      targets.append(shard_path(region.strip(), self.base_path))
+    for path in targets:
+      self._get_db(path).insert_embedded(ids, vectors, metadatas, documents)
+    self.written += len(ids)
+
+  def _get_db(self, persist_directory):
+    # One handle per store for the whole run instead of one per batch
+    if persist_directory not in self._dbs:
+      self._dbs[persist_directory] = DB(self.embedding, persist_directory=persist_directory)
+    return self._dbs[persist_directory]
 
   def save_glossary_to_db(self):
-    """Insert short, single-line glossary docs with doc_type='glossary'."""
+    """
+    Insert short, single-line glossary docs with doc_type='glossary'.
+    They go to a separate collection so they never take top-k slots from regulation chunks.
+    """
     docs = []
-    for term, definition in GLOSSARY.items():
+    for term, definition in get_glossary().items():
       content = f"{term}: {definition}"
       docs.append(
         Document(
@@ -75,9 +221,29 @@ class DocumentManager():
         )
       )
     if docs:
-      db = DB(self.embedding)
-      db.insert_chunks(docs)  # Keep it simple; call once to avoid duplicates
+      db = DB(self.embedding, collection_name=GLOSSARY_COLLECTION, persist_directory=self.base_path)
+      try:
+        db.insert_chunks(docs)  # Keep it simple; call once to avoid duplicates
+      finally:
+        db.close()
 
 if __name__ == "__main__":
-  manager = DocumentManager("./regulations/")
-  manager.process_documents()
+  import argparse
+  parser = argparse.ArgumentParser(description="Chunk, embed and store the regulations.")
+  parser.add_argument("--shard_by_region", action="store_true", help="Also build one physical shard per region under chroma/shards/.")
+  parser.add_argument("--pdf_backend", choices=["pypdf", "pymupdf"], default="pypdf", help="PDF text extraction backend (pymupdf is faster; needs PyMuPDF).")
+  parser.add_argument("--chunker", choices=["statute", "recursive"], default="statute", help="statute: split on section/subsection boundaries with anchor metadata (default); recursive: overlapping windows.")
+  parser.add_argument("--in_place", action="store_true", help="Write into the currently published index instead of building a new version.")
+  parser.add_argument("--grace_seconds", type=float, default=3600, help="Keep replaced index versions this long before deleting them (default: 3600).")
+  parser.add_argument("--batch_size", type=int, default=256, help="Chunks embedded and written per batch (default: 256).")
+  parser.add_argument("--inline_text", action="store_true", help="Store chunk text inside Chroma instead of the compressed chunk store.")
+  args = parser.parse_args()
+
+  manager = DocumentManager("./regulations/", shard_by_region=args.shard_by_region,
+                            pdf_backend=args.pdf_backend, batch_size=args.batch_size,
+                            versioned=not args.in_place, grace_seconds=args.grace_seconds,
+                            chunk_store=not args.inline_text)
+  try:
+    manager.process_documents(chunker=args.chunker)
+  except RuntimeError as e:
+    raise SystemExit(f"Error: {e}")
@@ -0,0 +1,103 @@
+# evaluation_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Optional, Union
+
+DEFAULT_DB = os.path.join("changes", "evaluation_cache.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    key TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    result_json TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_evaluations_last_used ON evaluations(last_used);
+"""
+
+
+def blob_hash(content: Union[str, bytes]) -> str:
+    """
+    Git blob id of the raw bytes (same as `git hash-object --no-filters`),
+    without calling git. A str is hashed as its UTF-8 encoding.
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def prompt_hash(template: str) -> str:
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(file_path: str, blob: str, prompt: str, model: str) -> str:
+    return hashlib.sha1("\0".join([file_path, blob, prompt, model]).encode("utf-8")).hexdigest()
+
+
+class EvaluationCache:
+    """
+    Persistent cache of per-file code-change evaluations.
+
+    Keyed by (file path, git blob hash of the evaluated content, prompt
+    template hash, model), so a file whose content is unchanged across
+    amends, rebases and cherry-picks is not sent to the LLM again, while a
+    prompt or model change invalidates it. SQLite (WAL) so the pre-commit
+    hook, the queue worker and the CLI share one cache; the least recently
+    used rows are pruned beyond `max_entries`.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT result_json FROM evaluations WHERE key=?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE evaluations SET last_used=? WHERE key=?", (time.time(), key))
+                conn.commit()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row["result_json"])
+
+    def put(self, key: str, file_path: str, result: dict) -> None:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO evaluations (key, file_path, result_json, created_at, last_used) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET result_json=excluded.result_json, last_used=excluded.last_used",
+                (key, file_path, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            conn.execute(
+                "DELETE FROM evaluations WHERE key IN ("
+                " SELECT key FROM evaluations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
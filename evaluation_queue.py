@@ -0,0 +1,408 @@
+# evaluation_queue.py
+"""
+Durable queue of code-change evaluations.
+
+The pre-commit hook only records the staged changes and enqueues the JSON
+file keyed by the staged tree hash, then returns. A background worker
+drains the queue with bounded concurrency and writes each result next to
+its changes file (changes/changes_<ts>.result.json).
+
+Run:
+  python evaluation_queue.py status
+  python evaluation_queue.py work --max_concurrency 2
+  python evaluation_queue.py enqueue changes/changes_<ts>.json
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+from datetime import datetime
+from typing import List, Optional
+
+DEFAULT_DB = os.path.join("changes", "evaluation_queue.db")
+WORKER_LOG = os.path.join("changes", "worker.log")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    changes_path TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result_path TEXT,
+    error TEXT,
+    claim_token TEXT,
+    not_before REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, enqueued_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+# Columns added after the first release; ALTERed into existing queue databases
+_ADDED_COLUMNS = {
+    "claim_token": "TEXT",
+    "not_before": "REAL NOT NULL DEFAULT 0",
+}
+
+
+def _now() -> float:
+    return time.time()
+
+
+def _fmt(ts: Optional[float]) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else ""
+
+
+def result_path_for(changes_path: str) -> str:
+    root, _ = os.path.splitext(changes_path)
+    return f"{root}.result.json"
+
+
+class EvaluationQueue:
+    """
+    SQLite (WAL) job table: pending -> running -> done / failed.
+
+    - enqueue is idempotent per key (the staged tree hash), so re-running
+      the hook for an unchanged tree does not queue a second evaluation
+    - claim is a single IMMEDIATE transaction, so several workers can drain
+      the same queue without taking a job twice; each claim gets a fresh
+      token, and complete/fail only take effect for the current claim
+    - a running job not finished within lease_seconds (e.g. its worker was
+      killed) is handed out again, unless it used up max_attempts; failed
+      jobs are retried after an exponential backoff (retry_backoff doubling
+      per attempt, at most max_backoff) up to max_attempts
+    """
+
+    def __init__(self, path: str = DEFAULT_DB, lease_seconds: float = 1800, max_attempts: int = 3,
+                 retry_backoff: float = 30.0, max_backoff: float = 600.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            existing = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            for column, decl in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {decl}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def enqueue(self, key: str, changes_path: str) -> bool:
+        """Queue changes_path under key. Returns False if that key is already queued or done."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO jobs (key, changes_path, enqueued_at) VALUES (?, ?, ?)",
+                (key, changes_path, _now()),
+            )
+            if cur.rowcount:
+                return True
+            # A previously failed evaluation of the same tree is retried from scratch
+            cur = conn.execute(
+                "UPDATE jobs SET status='pending', attempts=0, changes_path=?, enqueued_at=?, error=NULL,"
+                " claim_token=NULL, not_before=0 WHERE key=? AND status='failed'",
+                (changes_path, _now(), key),
+            )
+            return cur.rowcount > 0
+
+    def claim(self) -> Optional[dict]:
+        """
+        Atomically take the oldest runnable job: pending and past its backoff,
+        or running with an expired lease. The job carries its claim_token.
+        """
+        now = _now()
+        stale = now - self.lease_seconds
+        token = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Expired leases that already used every attempt are not handed out again
+            conn.execute(
+                "UPDATE jobs SET status='failed', finished_at=?, claim_token=NULL,"
+                " error='lease expired on the last attempt'"
+                " WHERE status='running' AND started_at < ? AND attempts >= ?",
+                (now, stale, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status='pending' AND not_before <= ?)"
+                " OR (status='running' AND started_at < ?)"
+                " ORDER BY enqueued_at LIMIT 1",
+                (now, stale),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status='running', attempts=attempts+1, started_at=?, claim_token=? WHERE key=?",
+                    (now, token, row["key"]),
+                )
+            conn.execute("COMMIT")
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["claim_token"] = token
+        return job
+
+    def complete(self, key: str, token: str, result_path: str, staged_path: Optional[str] = None) -> bool:
+        """
+        Mark the job done if token is still its current claim. staged_path (the
+        result written to a temp file) is moved to result_path in the same
+        transaction, so a worker whose lease was taken over never overwrites
+        the result. Returns False if the claim was lost.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = conn.execute(
+                    "UPDATE jobs SET status='done', finished_at=?, result_path=?, error=NULL, claim_token=NULL"
+                    " WHERE key=? AND claim_token=? AND status='running'",
+                    (_now(), result_path, key, token),
+                )
+                if cur.rowcount and staged_path is not None:
+                    os.replace(staged_path, result_path)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return cur.rowcount > 0
+
+    def fail(self, key: str, token: str, error: str) -> bool:
+        """
+        Back to pending after a backoff, or failed once max_attempts is reached.
+        Returns False (and changes nothing) if token is no longer the job's claim.
+        """
+        now = _now()
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " finished_at=?, error=?, claim_token=NULL,"
+                " not_before=? + min(?, ? * (1 << (max(attempts, 1) - 1)))"
+                " WHERE key=? AND claim_token=? AND status='running'",
+                (self.max_attempts, now, error, now, self.max_backoff, self.retry_backoff, key, token),
+            )
+        return cur.rowcount > 0
+
+    def counts(self) -> dict:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({r["status"]: r["n"] for r in rows})
+        return counts
+
+    def jobs(self, limit: int = 20, status: Optional[str] = None) -> List[dict]:
+        where, params = ("WHERE status=?", [status]) if status else ("", [])
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT * FROM jobs {where} ORDER BY enqueued_at DESC LIMIT ?", params + [limit]
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def heartbeat(self) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('worker_heartbeat', ?)"
+                " ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (str(_now()),),
+            )
+
+    def clear_heartbeat(self) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM meta WHERE key='worker_heartbeat'")
+
+    def worker_alive(self, within: float = 30) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key='worker_heartbeat'").fetchone()
+        return row is not None and _now() - float(row["value"]) < within
+
+
+def tree_key() -> Optional[str]:
+    """Hash of the staged tree (what the commit being made will point to)."""
+    try:
+        out = subprocess.run(["git", "write-tree"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def spawn_worker(db_path: str = DEFAULT_DB, max_concurrency: int = 2, model: str = "gemini", use_worker: bool = False) -> bool:
+    """Start a detached worker unless one is already heartbeating. Returns True if one was started."""
+    if EvaluationQueue(db_path).worker_alive():
+        return False
+    os.makedirs(os.path.dirname(WORKER_LOG) or ".", exist_ok=True)
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--db", db_path, "work",
+        "--max_concurrency", str(max_concurrency), "--model", model, "--idle_exit", "300",
+    ]
+    if use_worker:
+        cmd.append("--use_worker")
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    with open(WORKER_LOG, "a", encoding="utf-8") as log:
+        subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, **kwargs)
+    return True
+
+
+def _evaluate(job: dict, k: int, llm, **resources) -> str:
+    """Run the evaluation and stage its result in a temp file (see EvaluationQueue.complete)."""
+    from main import evaluate_code_file
+
+    code_changes, results = evaluate_code_file(llm, job["changes_path"], k, **resources)
+    out = result_path_for(job["changes_path"])
+    tmp = f"{out}.{job['claim_token']}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "key": job["key"],
+            "changes_file": job["changes_path"],
+            "evaluated_at": datetime.now().isoformat(),
+            "code_changes": code_changes,
+            "results": results,
+        }, f, indent=2, ensure_ascii=False, default=str)
+    return tmp
+
+
+def work(queue: EvaluationQueue, model: str = "gemini", k: int = 5, max_concurrency: int = 2,
+         idle_exit: float = 0, poll_seconds: float = 1.0, prescreen_threshold: float = 0.25,
+         use_worker: bool = False) -> None:
+    '''
+    Drain the queue, running at most max_concurrency evaluations at once.
+    The LLM, embeddings and vector stores are loaded on the first job and
+    shared by all later ones. idle_exit > 0 stops the worker after that many
+    seconds without work (0 = run until interrupted). use_worker=True sends
+    local-model prompts to a running model_worker.py.
+    '''
+    shared = {}
+    lock = threading.Lock()
+
+    def resources():
+        with lock:
+            if shared:
+                return shared
+            from main import load_embeddings
+            from db_orchestrator import DBOrchestrator
+            from semantic_cache import SemanticCache
+            from evaluation_cache import EvaluationCache
+            from change_prescreen import ChangePreScreen
+            from evidence_index import EvidenceVerifier
+            from retriever_service import AdaptiveCutoff
+            from gemini_llm_service import GeminiLLMService
+            from llm_service import LLMService
+            llm = GeminiLLMService() if model == "gemini" else LLMService(use_worker=use_worker)
+            embeddings = load_embeddings()
+            db_orchestrator = DBOrchestrator(embeddings)
+            # Filled only once everything loaded, so a failed load is retried by the next job
+            shared.update(
+                llm=llm,
+                embeddings=embeddings,
+                db_orchestrator=db_orchestrator,
+                cache=SemanticCache(),
+                eval_cache=EvaluationCache(),
+                prescreen=ChangePreScreen(embeddings, db_orchestrator, threshold=prescreen_threshold),
+                verifier=EvidenceVerifier(db_orchestrator),
+                cutoff=AdaptiveCutoff(),
+            )
+            return shared
+
+    def run(job):
+        r = resources()
+        return _evaluate(job, k, **r)
+
+    running = {}
+    idle_since = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            while True:
+                queue.heartbeat()
+                while len(running) < max_concurrency:
+                    job = queue.claim()
+                    if job is None:
+                        break
+                    print(f"[{_fmt(_now())}] Evaluating {job['changes_path']} (attempt {job['attempts']})", flush=True)
+                    running[pool.submit(run, job)] = job
+                if not running:
+                    if idle_exit and time.monotonic() - idle_since > idle_exit:
+                        print(f"[{_fmt(_now())}] Queue idle for {idle_exit:.0f}s; exiting", flush=True)
+                        return
+                    time.sleep(poll_seconds)
+                    continue
+                done, _ = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        staged = future.result()
+                    except Exception as e:
+                        print(f"[{_fmt(_now())}] Failed {job['changes_path']}: {e}", flush=True)
+                        if not queue.fail(job["key"], job["claim_token"], str(e)):
+                            print(f"[{_fmt(_now())}] Lease on {job['changes_path']} was taken over", flush=True)
+                        continue
+                    out = result_path_for(job["changes_path"])
+                    if queue.complete(job["key"], job["claim_token"], out, staged_path=staged):
+                        print(f"[{_fmt(_now())}] Wrote {out}", flush=True)
+                    else:
+                        # Another worker holds the job now; its result is the one kept
+                        os.remove(staged)
+                        print(f"[{_fmt(_now())}] Lease on {job['changes_path']} was taken over; result discarded", flush=True)
+                idle_since = time.monotonic()
+    finally:
+        queue.clear_heartbeat()
+
+def print_status(queue: EvaluationQueue, limit: int = 20) -> None:
+    counts = queue.counts()
+    alive = "running" if queue.worker_alive() else "not running"
+    print(" ".join(f"{s}={n}" for s, n in counts.items()) + f" | worker {alive}")
+    for job in queue.jobs(limit=limit):
+        when = _fmt(job["finished_at"] or job["started_at"] or job["enqueued_at"])
+        detail = job["result_path"] if job["status"] == "done" else (job["error"] or "")
+        print(f"{job['status']:8} {when}  {job['key'][:12]}  {job['changes_path']}  {detail}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Queue, run and inspect background code-change evaluations.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLite queue database path.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser("enqueue", help="Queue a recorded changes JSON.")
+    p_enqueue.add_argument("changes_file")
+    p_enqueue.add_argument("--key", help="Job key (default: staged tree hash, else the file path).")
+
+    p_work = sub.add_parser("work", help="Drain the queue.")
+    p_work.add_argument("--model", choices=["gemini", "local"], default="gemini")
+    p_work.add_argument("-k", "--k", type=int, default=5)
+    p_work.add_argument("--max_concurrency", type=int, default=2, help="Evaluations running at once.")
+    p_work.add_argument("--prescreen_threshold", type=float, default=0.25, help="Similarity below which a changed file skips the LLM.")
+    p_work.add_argument("--use_worker", action="store_true", help="Local model: use a running model_worker.py.")
+    p_work.add_argument("--idle_exit", type=float, default=0, help="Exit after this many idle seconds (0 = never).")
+
+    p_status = sub.add_parser("status", help="Show pending and finished evaluations.")
+    p_status.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    queue = EvaluationQueue(args.db)
+    if args.command == "enqueue":
+        key = args.key or tree_key() or os.path.abspath(args.changes_file)
+        print("Queued" if queue.enqueue(key, args.changes_file) else "Already queued", key)
+    elif args.command == "work":
+        work(queue, model=args.model, k=args.k, max_concurrency=args.max_concurrency, idle_exit=args.idle_exit,
+             prescreen_threshold=args.prescreen_threshold, use_worker=args.use_worker)
+    else:
+        print_status(queue, limit=args.limit)
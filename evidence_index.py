@@ -0,0 +1,317 @@
+# evidence_index.py
+"""
+Verification of the `evidence` quotes in compliance answers.
+
+The compliance prompt asks for one verbatim sentence from Context per issue.
+Each quote is checked against the chunks that were actually in the prompt,
+cheapest test first:
+  1. sentence hash: normalized sentence -> chunk ids, from the EvidenceIndex
+     built at ingestion (<index>/evidence.sqlite3); chunks without a chunk id
+     (indexes with inline text) are hashed on the fly
+  2. containment: the quote is a verbatim span of a retrieved chunk
+  3. fuzzy repair: the closest sentence of the retrieved chunks (RapidFuzz,
+     difflib when it is not installed) replaces a near-miss quote
+Issues that still fail are returned to the caller, which re-asks the model
+for just those quotes (see rag_chain.ask_evidence) and hands the reply to
+EvidenceVerifier.apply_retry.
+"""
+import difflib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:  # optional; difflib is the fallback matcher
+    fuzz = process = None
+
+from chunk_store import CHUNK_ID_KEY
+
+# Issues the prompt allows to come without a quote
+NO_EVIDENCE_ISSUES = {"insufficient context"}
+
+_TRANSLATE = str.maketrans({
+    "“": '"', "”": '"', "‘": "'", "’": "'",
+    "–": "-", "—": "-", "\u00a0": " ",
+})
+# A sentence ends at . ! ? followed by something that can start one; "p.m. and",
+# "e.g. the" or "U.S.C. sec" do not split
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'“‘(\[§])")
+# "... parental consent. (13-63-105(3)(a))": the anchor the prompt asks the model to append
+_TRAILING_ANCHOR = re.compile(r"(?<=[.!?:;\"'”’])\s*\((?:[^()]|\([^()]*\))*\)\s*$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sentences (
+    hash TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    anchor TEXT,
+    PRIMARY KEY (hash, chunk_id)
+) WITHOUT ROWID;
+"""
+
+
+def normalize_sentence(text: str) -> str:
+    """Case, quote/dash style, whitespace and outer punctuation do not count."""
+    text = re.sub(r"\s+", " ", (text or "").translate(_TRANSLATE)).strip().lower()
+    return text.strip(" \"'").rstrip(".;:,").strip()
+
+
+def sentence_hash(text: str) -> str:
+    return hashlib.blake2b(normalize_sentence(text).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of a chunk; statute line breaks inside a sentence are joined."""
+    text = re.sub(r"\s+", " ", text or "").strip()
+    return [s for s in _SENTENCE_END.split(text) if s]
+
+
+def evidence_variants(evidence: str) -> List[str]:
+    """The quote as given, and without the anchor appended in parentheses."""
+    variants = [evidence]
+    stripped = _TRAILING_ANCHOR.sub("", evidence or "").strip()
+    if stripped and stripped != evidence:
+        variants.append(stripped)
+    return variants
+
+
+class EvidenceIndex:
+    """SQLite map of sentence hash -> (chunk id, anchor) for one index."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def add_chunks(self, ids: Sequence[str], texts: Sequence[str], anchors: Sequence[Optional[str]]) -> int:
+        rows = {}
+        for chunk_id, text, anchor in zip(ids, texts, anchors):
+            for sentence in split_sentences(text):
+                rows[(sentence_hash(sentence), chunk_id)] = anchor
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sentences (hash, chunk_id, anchor) VALUES (?, ?, ?)",
+                [(h, chunk_id, anchor) for (h, chunk_id), anchor in rows.items()],
+            )
+            conn.commit()
+        return len(rows)
+
+    def lookup(self, hashes: Iterable[str]) -> Dict[str, List[Tuple[str, Optional[str]]]]:
+        hashes = list(dict.fromkeys(hashes))
+        found: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        if not hashes:
+            return found
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT hash, chunk_id, anchor FROM sentences WHERE hash IN ({','.join('?' * len(hashes))})", hashes
+            ).fetchall()
+        for h, chunk_id, anchor in rows:
+            found.setdefault(h, []).append((chunk_id, anchor))
+        return found
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            sentences, chunks = conn.execute("SELECT COUNT(*), COUNT(DISTINCT chunk_id) FROM sentences").fetchone()
+        return {"sentences": sentences, "chunks": chunks}
+
+
+_OPEN: Dict[str, EvidenceIndex] = {}
+_OPEN_LOCK = threading.Lock()
+
+
+def open_evidence_index(path: str, create: bool = False) -> Optional[EvidenceIndex]:
+    """Process-wide EvidenceIndex for path (see db.evidence_index_path); None when it does not exist."""
+    with _OPEN_LOCK:
+        index = _OPEN.get(path)
+        if index is None and (create or os.path.exists(path)):
+            index = _OPEN[path] = EvidenceIndex(path)
+        return index
+
+
+def close_evidence_index(path: str) -> None:
+    """Forget the process-wide index for path (e.g. its index version was deleted)."""
+    target = os.path.abspath(path)
+    with _OPEN_LOCK:
+        for key in [k for k in _OPEN if os.path.abspath(k) == target]:
+            del _OPEN[key]
+
+
+class _Context:
+    """The retrieved chunks of one answer, with sentence data built on first use."""
+
+    def __init__(self, docs, index: Optional[EvidenceIndex]):
+        self.docs = list(docs or [])
+        self.index = index
+        self.chunk_ids = {(d.metadata or {}).get(CHUNK_ID_KEY) for d in self.docs} - {None}
+        self._local = None
+        self._texts = None
+        self._sentences = None
+
+    def local_hashes(self) -> set:
+        # Chunks the EvidenceIndex cannot answer for are hashed here
+        if self._local is None:
+            self._local = {
+                sentence_hash(s)
+                for d in self.docs
+                if self.index is None or (d.metadata or {}).get(CHUNK_ID_KEY) is None
+                for s in split_sentences(d.page_content)
+            }
+        return self._local
+
+    def texts(self) -> List[str]:
+        if self._texts is None:
+            self._texts = [normalize_sentence(d.page_content) for d in self.docs]
+        return self._texts
+
+    def sentences(self) -> List[Tuple[str, str, Optional[str]]]:
+        """(normalized, original, anchor) for every sentence of the retrieved chunks."""
+        if self._sentences is None:
+            self._sentences = [
+                (normalize_sentence(s), s, (d.metadata or {}).get("anchor"))
+                for d in self.docs
+                for s in split_sentences(d.page_content)
+            ]
+        return self._sentences
+
+
+class EvidenceVerifier:
+    """
+    Checks, repairs and counts evidence quotes. Safe to share across threads;
+    `stats()` reports how quotes were settled.
+    """
+
+    def __init__(self, db_orchestrator=None, fuzzy_threshold: float = 90.0, min_words: int = 5, max_retries: int = 1):
+        '''
+        Parameters:
+            db_orchestrator: source of the current index path (for its EvidenceIndex)
+            fuzzy_threshold: similarity (0-100) above which a quote is replaced by the closest sentence
+            min_words: shorter quotes are not accepted by containment alone
+            max_retries: re-asks of the model for the quotes that still fail
+        '''
+        self.db_orchestrator = db_orchestrator
+        self.fuzzy_threshold = fuzzy_threshold
+        self.min_words = min_words
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def _index(self) -> Optional[EvidenceIndex]:
+        if self.db_orchestrator is None:
+            return None
+        from db import evidence_index_path  # db loads chromadb; nothing else here needs it
+        return open_evidence_index(evidence_index_path(self.db_orchestrator.base_path))
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+
+    def _settle(self, issue: dict, ctx: _Context) -> Optional[str]:
+        """How the quote of one issue checks out (hash/span/repaired), or None."""
+        variants = evidence_variants(str(issue.get("evidence") or "").strip())
+        if not variants[0]:
+            return None
+        hashes = [sentence_hash(v) for v in variants]
+        if ctx.index is not None and ctx.chunk_ids:
+            for entries in ctx.index.lookup(hashes).values():
+                if any(chunk_id in ctx.chunk_ids for chunk_id, _ in entries):
+                    return "hash"
+        if any(h in ctx.local_hashes() for h in hashes):
+            return "hash"
+
+        normalized = [normalize_sentence(v) for v in variants]
+        if any(len(n.split()) >= self.min_words and any(n in t for t in ctx.texts()) for n in normalized):
+            return "span"
+
+        sentences = ctx.sentences()
+        if not sentences:
+            return None
+        best, best_score = None, 0.0
+        for n in normalized:
+            if process is not None:
+                match = process.extractOne(n, [s[0] for s in sentences], scorer=fuzz.ratio,
+                                           score_cutoff=self.fuzzy_threshold)
+                if match is not None and match[1] > best_score:
+                    best, best_score = sentences[match[2]], match[1]
+            else:
+                for s in sentences:
+                    matcher = difflib.SequenceMatcher(None, n, s[0])
+                    if matcher.real_quick_ratio() * 100 < max(self.fuzzy_threshold, best_score):
+                        continue
+                    score = matcher.ratio() * 100
+                    if score >= self.fuzzy_threshold and score > best_score:
+                        best, best_score = s, score
+        if best is None:
+            return None
+        _, sentence, anchor = best
+        issue["evidence"] = f"{sentence} ({anchor})" if anchor else sentence
+        return "repaired"
+
+    def check(self, answer: dict, docs) -> List[int]:
+        '''
+        Verify (and repair in place) every quote of a parsed compliance answer
+        against the documents that were in its prompt.
+
+        Output:
+            indices of the issues whose quote could not be verified
+        '''
+        issues = answer.get("issues") if isinstance(answer, dict) else None
+        if not isinstance(issues, list):
+            return []
+        ctx = _Context(docs, self._index())
+        failed = []
+        for i, issue in enumerate(issues):
+            if not isinstance(issue, dict):
+                continue
+            if not str(issue.get("evidence") or "").strip() and \
+                    str(issue.get("issue", "")).strip().lower() in NO_EVIDENCE_ISSUES:
+                continue
+            outcome = self._settle(issue, ctx)
+            self._count(outcome or "failed")
+            if outcome is None:
+                failed.append(i)
+        return failed
+
+    def apply_retry(self, answer: dict, docs, failed: Sequence[int], retry: Optional[dict]) -> List[int]:
+        '''
+        Take the re-asked quotes ({"evidence": [...]}, one per failed issue, in
+        order) for the issues that failed, check them, and return the indices
+        that are still unverified.
+        '''
+        quotes = (retry or {}).get("evidence") if isinstance(retry, dict) else None
+        quotes = quotes if isinstance(quotes, list) else []
+        ctx = _Context(docs, self._index())
+        still = []
+        for i, quote in zip(failed, quotes + [""] * (len(failed) - len(quotes))):
+            issue = answer["issues"][i]
+            previous = issue.get("evidence")
+            issue["evidence"] = str(quote or "").strip()
+            outcome = self._settle(issue, ctx) if issue["evidence"] else None
+            if outcome is None:
+                issue["evidence"] = previous
+                still.append(i)
+            self._count("retried" if outcome else "retry_failed")
+        return still
+
+    def mark_unverified(self, answer: dict, failed: Sequence[int]) -> None:
+        """Flag quotes that could not be matched to Context (kept as given)."""
+        for i in failed:
+            answer["issues"][i]["evidence_verified"] = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        checked = sum(v for k, v in counts.items() if k not in ("retried", "retry_failed"))
+        return {"checked": checked, **counts}
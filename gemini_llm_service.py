@@ -1,22 +1,81 @@
 # gemini_llm_service.py
+import asyncio
+import hashlib
+import json
 import os
+import random
+from typing import Any, Dict, Optional
+
+import httpx
 from langchain_google_genai import ChatGoogleGenerativeAI
 from google.generativeai.types import HarmBlockThreshold, HarmCategory
 from transformers import ( pipeline
 )
 
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+_ROLES = {"human": "user", "user": "user", "ai": "model", "assistant": "model"}
+_SAFETY = [
+    {"category": c, "threshold": "BLOCK_NONE"}
+    for c in (
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+    )
+]
+
+
+class GeminiRequestError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Gemini request failed ({status}): {message}")
+        self.status = status
+
+
 class GeminiLLMService:
     """
     llm: ChatGoogleGenerativeAI configured for schema (function-calling) mode.
          Do NOT set response_mime_type when using structured output.
     _raw: plain text helper for small utilities (classification, etc.).
+
+    Async path (agenerate_text / agenerate_json) talks to the REST API through
+    one pooled httpx.AsyncClient per event loop:
+      - at most `max_in_flight` requests at once (semaphore)
+      - exponential backoff with full jitter on 429/5xx and transport errors,
+        honouring Retry-After
+      - identical in-flight prompts share a single request
+    Point `base_url` (or GEMINI_BASE_URL) at a local stub server to test it.
+    Only the async path honours it: `llm` and the sync generate_text() go
+    through langchain and always reach the Google endpoint.
     """
     def __init__(
         self,
         model_json: str = "gemini-2.5-flash",
         model_text: str = "gemini-2.5-flash",
         max_output_tokens: int = 8192,
+        max_in_flight: int = 8,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        request_timeout: float = 120.0,
+        base_url: Optional[str] = None,
     ):
+        self.model_name = model_json
+        self.model_json = model_json
+        self.model_text = model_text
+        self.max_output_tokens = max_output_tokens
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_timeout = request_timeout
+        self.base_url = (base_url or os.environ.get("GEMINI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self._api_key = os.environ["GEMINI_API_KEY"]
+        self._loop = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
         safety = {
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
@@ -39,3 +98,102 @@ class GeminiLLMService:
     def generate_text(self, prompt: str) -> str:
         msg = self._raw.invoke(prompt)
         return getattr(msg, "content", "") or ""
+
+    # ---------- Async path ----------
+    def _ensure_async(self) -> httpx.AsyncClient:
+        # Clients, semaphores and futures are bound to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.request_timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight,
+                    max_keepalive_connections=self.max_in_flight,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._inflight = {}
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _to_request(prompt: Any) -> Dict[str, Any]:
+        """Turn a str / PromptValue / message list into generateContent fields."""
+        if isinstance(prompt, str):
+            messages = [("user", prompt)]
+        else:
+            if hasattr(prompt, "to_messages"):
+                prompt = prompt.to_messages()
+            messages = [(getattr(m, "type", "user"), getattr(m, "content", str(m))) for m in prompt]
+
+        system = [text for role, text in messages if role == "system"]
+        contents = [
+            {"role": _ROLES.get(role, "user"), "parts": [{"text": text}]}
+            for role, text in messages if role != "system"
+        ]
+        request: Dict[str, Any] = {"contents": contents}
+        if system:
+            request["systemInstruction"] = {"parts": [{"text": "\n\n".join(system)}]}
+        return request
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _post(self, model: str, body: Dict[str, Any]) -> str:
+        client = self._ensure_async()
+        url = f"/v1beta/models/{model}:generateContent"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    resp = await client.post(url, params={"key": self._api_key}, json=body)
+                if resp.status_code == 200:
+                    data = resp.json()
+                    parts = ((data.get("candidates") or [{}])[0].get("content") or {}).get("parts") or []
+                    return "".join(p.get("text", "") for p in parts)
+                if resp.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise GeminiRequestError(resp.status_code, resp.text[:500])
+                retry_after = resp.headers.get("retry-after")
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            # Sleep outside the semaphore so other requests can proceed
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+        raise GeminiRequestError(0, "retries exhausted")
+
+    async def agenerate(self, prompt: Any, *, json_mode: bool = False, max_output_tokens: Optional[int] = None) -> str:
+        model = self.model_json if json_mode else self.model_text
+        generation_config: Dict[str, Any] = {
+            "temperature": 0.0,
+            "maxOutputTokens": max_output_tokens or (self.max_output_tokens if json_mode else 4096),
+        }
+        if json_mode:
+            generation_config["responseMimeType"] = "application/json"
+        body = {**self._to_request(prompt), "generationConfig": generation_config, "safetySettings": _SAFETY}
+
+        self._ensure_async()
+        key = hashlib.sha256(json.dumps([model, body], sort_keys=True).encode("utf-8")).hexdigest()
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._post(model, body))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller being cancelled must not cancel the shared request
+        return await asyncio.shield(pending)
+
+    async def agenerate_text(self, prompt: Any) -> str:
+        return await self.agenerate(prompt, json_mode=False)
+
+    async def agenerate_json(self, prompt: Any) -> str:
+        return await self.agenerate(prompt, json_mode=True)
@@ -0,0 +1,105 @@
+# gemini_stub_server.py
+"""
+Local stand-in for the Gemini generateContent REST endpoint, for exercising
+GeminiLLMService's async path (pooling, concurrency limit, 429/5xx backoff)
+without network access or quota.
+
+Run:   python gemini_stub_server.py --port 8765 --fail_rate 0.3 --latency 0.2
+Use:   GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=stub python main.py ...
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLIANCE_JSON = {
+    "compliance_need": False,
+    "issues": [
+        {
+            "issue": "insufficient context",
+            "reasoning": "Context lacks specific legal text to assess the feature.",
+            "evidence": "",
+        }
+    ],
+}
+
+
+class StubState:
+    def __init__(self, fail_rate: float, latency: float):
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so client connection pooling is observable
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload: dict, headers: dict | None = None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with state.lock:
+                stats = {
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "max_in_flight": state.max_in_flight,
+                }
+            self._send(200, stats)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                time.sleep(state.latency)
+                if random.random() < state.fail_rate:
+                    with state.lock:
+                        state.failures += 1
+                    status = random.choice([429, 429, 503])
+                    self._send(status, {"error": {"code": status, "message": "stub: rate limited"}}, {"Retry-After": "0.1"})
+                    return
+                json_mode = request.get("generationConfig", {}).get("responseMimeType") == "application/json"
+                text = json.dumps(COMPLIANCE_JSON) if json_mode else "Global"
+                self._send(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]})
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub for the Gemini generateContent endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="Fraction of requests answered with 429/503.")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds to wait before answering.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(args.fail_rate, args.latency)))
+    print(f"Gemini stub listening on http://{args.host}:{args.port} (GET / for stats)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
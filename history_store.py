@@ -0,0 +1,222 @@
+# history_store.py
+import csv
+import json
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from typing import List, Optional
+
+HISTORY_COLUMNS = ["timestamp", "feature", "feature_description", "response_json"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    feature TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    feature_description TEXT NOT NULL DEFAULT '',
+    response_json TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# External-content FTS index kept in sync with `history` by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    feature, feature_description, content='history', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, feature, feature_description)
+    VALUES (new.rowid, new.feature, new.feature_description);
+END;
+CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, feature, feature_description)
+    VALUES ('delete', old.rowid, old.feature, old.feature_description);
+END;
+CREATE TRIGGER IF NOT EXISTS history_au AFTER UPDATE ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, feature, feature_description)
+    VALUES ('delete', old.rowid, old.feature, old.feature_description);
+    INSERT INTO history_fts(rowid, feature, feature_description)
+    VALUES (new.rowid, new.feature, new.feature_description);
+END;
+"""
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class HistoryStore:
+    """
+    SQLite (WAL) store for evaluation history.
+
+    - one row per feature (upsert by feature name)
+    - timestamp index for newest-first pagination
+    - FTS5 full-text search over feature names and descriptions
+      (falls back to LIKE when the SQLite build lacks FTS5)
+    Connections are opened per operation, so one instance can be shared
+    across Streamlit sessions/threads; WAL lets readers run during writes.
+    """
+
+    def __init__(self, path: str = "history.db"):
+        self.path = path
+        self.fts = True
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            try:
+                conn.executescript(_FTS_SCHEMA)
+            except sqlite3.OperationalError:
+                self.fts = False
+            conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---------- Writes ----------
+    def upsert(self, feature: str, feature_description: str, response_obj, timestamp: Optional[str] = None) -> None:
+        """Upsert a row keyed by 'feature' (same JSON encoding as the CSV log)."""
+        resp_str = json.dumps(response_obj, ensure_ascii=False, separators=(",", ":"))
+        self._upsert_rows([(feature, timestamp or _now(), feature_description, resp_str)])
+
+    def _upsert_rows(self, rows, keep_newer: bool = False) -> int:
+        sql = (
+            "INSERT INTO history (feature, timestamp, feature_description, response_json) "
+            "VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(feature) DO UPDATE SET "
+            "timestamp=excluded.timestamp, "
+            "feature_description=excluded.feature_description, "
+            "response_json=excluded.response_json"
+        )
+        if keep_newer:
+            sql += " WHERE excluded.timestamp >= history.timestamp"
+        with closing(self._connect()) as conn:
+            with conn:
+                cur = conn.executemany(sql, rows)
+            return cur.rowcount
+
+    def delete(self, feature: str) -> None:
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("DELETE FROM history WHERE feature = ?", (feature,))
+
+    # ---------- Reads ----------
+    def count(self, search: str = "") -> int:
+        where, params = self._search_clause(search)
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM history {where}", params).fetchone()[0]
+
+    def page(self, limit: int = 20, offset: int = 0, search: str = "") -> List[dict]:
+        """Newest-first page of rows, optionally restricted to a full-text search."""
+        where, params = self._search_clause(search)
+        sql = (
+            f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history {where} "
+            "ORDER BY timestamp DESC LIMIT ? OFFSET ?"
+        )
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, (*params, int(limit), int(offset))).fetchall()
+        return [dict(r) for r in rows]
+
+    def get(self, feature: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history WHERE feature = ?", (feature,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def _search_clause(self, search: str):
+        terms = re.findall(r"\w+", search or "")
+        if not terms:
+            return "", ()
+        if self.fts:
+            # Quote each token and prefix-match it; tokens are ANDed
+            match = " ".join(f'"{t}"*' for t in terms)
+            return "WHERE rowid IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)", (match,)
+        clauses = " AND ".join("(feature LIKE ? OR feature_description LIKE ?)" for _ in terms)
+        params = tuple(p for t in terms for p in (f"%{t}%", f"%{t}%"))
+        return f"WHERE {clauses}", params
+
+    # ---------- CSV import / export ----------
+    def import_csv(self, csv_path: str) -> int:
+        """
+        Import rows from the legacy CSV log. Tolerates files written without a
+        header (feature, feature_description, response_json). Existing rows are
+        only replaced by imported rows with a newer or equal timestamp.
+        """
+        if not os.path.exists(csv_path):
+            return 0
+        with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f))
+        if not rows:
+            return 0
+
+        header = [c.strip() for c in rows[0]]
+        if set(HISTORY_COLUMNS) <= set(header):
+            idx = {c: header.index(c) for c in HISTORY_COLUMNS}
+            records = [
+                (r[idx["feature"]], r[idx["timestamp"]] or _now(), r[idx["feature_description"]], r[idx["response_json"]])
+                for r in rows[1:] if len(r) >= len(header)
+            ]
+        else:
+            # Old headerless format: inject an approximate timestamp
+            ts = _now()
+            records = [(r[0], ts, r[1], r[2]) for r in rows if len(r) >= 3]
+
+        records = [r for r in records if r[0].strip()]
+        if not records:
+            return 0
+        return self._upsert_rows(records, keep_newer=True)
+
+    def import_csv_once(self, csv_path: str) -> int:
+        """One-time import: remembers which CSV files were already imported."""
+        if not os.path.exists(csv_path):
+            # No marker, so a CSV that appears later is still imported
+            return 0
+        key = f"imported_csv:{os.path.abspath(csv_path)}"
+        with closing(self._connect()) as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return 0
+        imported = self.import_csv(csv_path)
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, _now())
+                )
+        return imported
+
+    def export_csv(self, csv_path: str) -> int:
+        """Write the whole history (oldest first) with the canonical CSV header."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history ORDER BY timestamp ASC"
+            ).fetchall()
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(HISTORY_COLUMNS)
+            for r in rows:
+                writer.writerow([r[c] for c in HISTORY_COLUMNS])
+        return len(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import/export the evaluation history store.")
+    parser.add_argument("--db", default="history.db", help="SQLite history database path.")
+    parser.add_argument("--import_csv", help="Import rows from a history CSV.")
+    parser.add_argument("--export_csv", help="Export the history to a CSV.")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.db)
+    if args.import_csv:
+        print(f"Imported {store.import_csv(args.import_csv)} rows from {args.import_csv}")
+    if args.export_csv:
+        print(f"Exported {store.export_csv(args.export_csv)} rows to {args.export_csv}")
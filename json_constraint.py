@@ -0,0 +1,357 @@
+# json_constraint.py
+"""
+Schema-constrained JSON decoding for the local HF model.
+
+A small pushdown machine validates generated text character by character
+against a fixed schema (objects with required keys in a fixed order,
+arrays, strings, booleans). The logits processor only lets through tokens
+whose text keeps the output a valid prefix of a schema-conforming JSON
+document, and forces EOS once the top-level object is closed, so the
+compliance / dev-doc / code-change outputs parse on the first try.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import torch
+    from transformers import LogitsProcessor, LogitsProcessorList
+except ImportError:  # the schemas and JsonMachine work without them; the logits processor does not
+    torch = None
+    LogitsProcessor, LogitsProcessorList = object, list
+
+_WS = " \t\n\r"
+_ESCAPES = '"\\/bfnrt'
+
+
+# ---------- Schema nodes ----------
+@dataclass(frozen=True)
+class Bool:
+    pass
+
+
+@dataclass(frozen=True)
+class String:
+    max_len: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class Array:
+    item: object
+    max_items: Optional[int] = None
+    min_items: int = 0
+
+
+@dataclass(frozen=True)
+class Object:
+    fields: Tuple[Tuple[str, object], ...]
+
+
+_ISSUE = Object((
+    ("issue", String(max_len=200)),
+    ("reasoning", String(max_len=600)),
+    ("evidence", String(max_len=800)),
+))
+
+COMPLIANCE_SCHEMA = Object((
+    ("compliance_need", Bool()),
+    ("issues", Array(_ISSUE, max_items=5)),
+))
+
+EVIDENCE_SCHEMA = Object((
+    ("evidence", Array(String(max_len=800), max_items=5)),
+))
+
+DEV_DOC_SCHEMA = Object((
+    ("file", String(max_len=300)),
+    ("features", Array(Object((
+        ("feature_name", String(max_len=200)),
+        ("feature_description", String(max_len=1000)),
+    )))),
+))
+
+CODE_CHANGE_SCHEMA = Object((
+    ("file", String(max_len=300)),
+    ("feature_name", String(max_len=200)),
+    ("feature_description", String(max_len=1000)),
+))
+
+
+# ---------- Validator ----------
+class JsonMachine:
+    """
+    Incremental validator. Each stack frame is [node, phase, a, b]:
+      Object: phase 0 '{' | 1 key quote | 2 in key (a=field idx, b=key pos) | 3 ':' | 4 ',' or '}' | 5 '}' (no fields)
+      Array:  phase 0 '[' | 1 item or ']' | 2 ',' or ']' | 3 item   (a=item count)
+      String: phase 0 '"' | 1 content      (a=length, b=escape state)
+      Bool:   a=chars matched, b=0 true / 1 false
+    """
+
+    def __init__(self, schema, max_ws: int = 16):
+        self.stack: List[list] = [[schema, 0, 0, 0]]
+        self.max_ws = max_ws
+        self.ws_run = 0
+
+    def clone(self) -> "JsonMachine":
+        m = JsonMachine.__new__(JsonMachine)
+        m.stack = [f[:] for f in self.stack]
+        m.max_ws = self.max_ws
+        m.ws_run = self.ws_run
+        return m
+
+    @property
+    def done(self) -> bool:
+        return not self.stack
+
+    def feed_text(self, text: str) -> bool:
+        for ch in text:
+            if not self.feed(ch):
+                return False
+        return True
+
+    def _ws(self, ch: str) -> bool:
+        # Whitespace between tokens, bounded so the model cannot pad forever
+        if ch in _WS and self.ws_run < self.max_ws:
+            self.ws_run += 1
+            return True
+        return False
+
+    def feed(self, ch: str) -> bool:
+        if not self.stack:
+            return self._ws(ch)
+        frame = self.stack[-1]
+        node = frame[0]
+        if isinstance(node, String):
+            ok = self._feed_string(frame, node, ch)
+        elif isinstance(node, Object):
+            ok = self._feed_object(frame, node, ch)
+        elif isinstance(node, Array):
+            ok = self._feed_array(frame, node, ch)
+        elif isinstance(node, Bool):
+            ok = self._feed_bool(frame, ch)
+        else:
+            raise TypeError(f"Unsupported schema node: {node!r}")
+        if ok and ch not in _WS:
+            self.ws_run = 0
+        return ok
+
+    def _push(self, node) -> None:
+        self.stack.append([node, 0, 0, 0])
+
+    def _feed_string(self, frame, node: String, ch: str) -> bool:
+        if frame[1] == 0:
+            if ch == '"':
+                frame[1] = 1
+                return True
+            return self._ws(ch)
+        if frame[3] == 1:
+            if ch in _ESCAPES or ch == "u":
+                frame[3] = 2 if ch == "u" else 0
+                frame[2] += 1
+                return True
+            return False
+        if frame[3]:
+            # \uXXXX: frame[3] counts 2..5 through the hex digits
+            if ch not in "0123456789abcdefABCDEF":
+                return False
+            frame[3] = 0 if frame[3] == 5 else frame[3] + 1
+            return True
+        if ch == '"':
+            self.stack.pop()
+            return True
+        if ord(ch) < 0x20 or (node.max_len is not None and frame[2] >= node.max_len):
+            return False
+        if ch == "\\":
+            frame[3] = 1
+            return True
+        frame[2] += 1
+        return True
+
+    def _feed_bool(self, frame, ch: str) -> bool:
+        if frame[2] == 0:
+            if ch not in "tf":
+                return self._ws(ch)
+            frame[3] = 0 if ch == "t" else 1
+            frame[2] = 1
+            return True
+        literal = "true" if frame[3] == 0 else "false"
+        if ch != literal[frame[2]]:
+            return False
+        frame[2] += 1
+        if frame[2] == len(literal):
+            self.stack.pop()
+        return True
+
+    def _feed_object(self, frame, node: Object, ch: str) -> bool:
+        phase = frame[1]
+        if phase == 0:
+            if ch == "{":
+                frame[1] = 1 if node.fields else 5
+                return True
+            return self._ws(ch)
+        if phase == 1:
+            if ch == '"':
+                frame[1], frame[3] = 2, 0
+                return True
+            return self._ws(ch)
+        if phase == 2:
+            key = node.fields[frame[2]][0]
+            if frame[3] < len(key):
+                if ch != key[frame[3]]:
+                    return False
+                frame[3] += 1
+                return True
+            if ch != '"':
+                return False
+            frame[1] = 3
+            return True
+        if phase == 3:
+            if ch == ":":
+                frame[1] = 4
+                self._push(node.fields[frame[2]][1])
+                return True
+            return self._ws(ch)
+        if phase == 4:
+            last = frame[2] + 1 == len(node.fields)
+            if ch == "," and not last:
+                frame[1], frame[2] = 1, frame[2] + 1
+                return True
+            if ch == "}" and last:
+                self.stack.pop()
+                return True
+            return self._ws(ch)
+        # phase 5: empty object
+        if ch == "}":
+            self.stack.pop()
+            return True
+        return self._ws(ch)
+
+    def _feed_array(self, frame, node: Array, ch: str) -> bool:
+        phase = frame[1]
+        if phase == 0:
+            if ch == "[":
+                frame[1] = 1
+                return True
+            return self._ws(ch)
+        if phase == 2:
+            if ch == "," and (node.max_items is None or frame[2] < node.max_items):
+                frame[1] = 3
+                return True
+            if ch == "]" and frame[2] >= node.min_items:
+                self.stack.pop()
+                return True
+            return self._ws(ch)
+        # phase 1 (right after '[') or 3 (after ','): start the next item
+        if ch in _WS:
+            return self._ws(ch)
+        if phase == 1 and ch == "]" and node.min_items == 0:
+            self.stack.pop()
+            return True
+        if node.max_items is not None and frame[2] >= node.max_items:
+            return False
+        frame[1], frame[2] = 2, frame[2] + 1
+        self._push(node.item)
+        return self.feed(ch)
+
+
+# ---------- Logits processor ----------
+_VOCAB_CACHE: Dict[int, List[str]] = {}
+
+
+def _vocab_strings(tokenizer) -> List[str]:
+    key = id(tokenizer)
+    if key not in _VOCAB_CACHE:
+        _VOCAB_CACHE[key] = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+    return _VOCAB_CACHE[key]
+
+
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Masks every token that would break the schema. Candidates are checked in
+    score order (top_k first, widening only if none fits), so the cost per
+    step is a handful of machine clones rather than a full vocabulary scan.
+    """
+
+    def __init__(self, tokenizer, schemas: Sequence[object], eos_token_ids: Sequence[int], top_k: int = 32):
+        self.vocab = _vocab_strings(tokenizer)
+        self.eos = set(eos_token_ids)
+        # Special/added tokens (chat headers, reserved ids) never belong in the JSON body
+        self.blocked = (set(getattr(tokenizer, "added_tokens_decoder", {}) or {}) | set(tokenizer.all_special_ids)) - self.eos
+        self.machines = [JsonMachine(s) for s in schemas]
+        self.finished = [False] * len(schemas)
+        self.top_k = top_k
+        self._fed: Optional[int] = None
+
+    def _advance(self, input_ids: torch.LongTensor) -> None:
+        if self._fed is None:
+            self._fed = input_ids.shape[1]
+            return
+        for row, machine in enumerate(self.machines):
+            for tid in input_ids[row, self._fed:].tolist():
+                if self.finished[row]:
+                    break
+                if tid in self.eos or machine is None:
+                    self.finished[row] = True
+                elif not machine.feed_text(self.vocab[tid] if tid < len(self.vocab) else ""):
+                    # Should not happen; stop constraining rather than corrupt the mask
+                    self.machines[row] = None
+        self._fed = input_ids.shape[1]
+
+    def _allowed(self, machine: JsonMachine, row_scores: torch.FloatTensor) -> List[int]:
+        if machine.done:
+            return [t for t in self.eos if t < row_scores.shape[0]]
+        order = torch.argsort(row_scores, descending=True).tolist()
+        allowed: List[int] = []
+        start, width = 0, self.top_k
+        while start < len(order) and not allowed:
+            for tid in order[start:start + width]:
+                if tid in self.blocked or tid in self.eos or tid >= len(self.vocab):
+                    continue
+                text = self.vocab[tid]
+                if text and machine.clone().feed_text(text):
+                    allowed.append(tid)
+            start, width = start + width, width * 8
+        return allowed
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self._advance(input_ids)
+        for row, machine in enumerate(self.machines):
+            if machine is None or self.finished[row]:
+                continue
+            allowed = self._allowed(machine, scores[row])
+            if not allowed:
+                continue
+            keep = torch.tensor(allowed, device=scores.device)
+            masked = torch.full_like(scores[row], float("-inf"))
+            masked[keep] = scores[row, keep]
+            scores[row] = masked
+        return scores
+
+
+class ConstrainedJsonPipeline:
+    """
+    Wraps the text-generation pipeline: prompts whose template has a schema
+    get a fresh JsonSchemaLogitsProcessor per call; others pass through.
+    """
+
+    def __init__(self, pipe, schema_for: Callable[[str], Optional[object]], tokenizer, eos_token_ids: Sequence[int]):
+        self._pipe = pipe
+        self.schema_for = schema_for
+        self.tokenizer = tokenizer
+        self.eos_token_ids = list(eos_token_ids)
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def __call__(self, prompt, **kwargs):
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        schemas = [self.schema_for(p) if isinstance(p, str) else None for p in prompts]
+        # One processor tracks one generate() call: only constrain when the pipeline
+        # will not split the prompts across several batches
+        one_batch = len(prompts) == 1 or kwargs.get("batch_size") == len(prompts)
+        if prompts and one_batch and all(s is not None for s in schemas) and "logits_processor" not in kwargs:
+            kwargs["logits_processor"] = LogitsProcessorList([
+                JsonSchemaLogitsProcessor(self.tokenizer, schemas, self.eos_token_ids)
+            ])
+        return self._pipe(prompt, **kwargs)
@@ -1,14 +1,63 @@
 # llm_service.py
 from __future__ import annotations
-from typing import Optional
+import os
+from typing import Dict, Optional
 import torch
 from transformers import (
     AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, pipeline
 )
 from langchain_huggingface import HuggingFacePipeline
 
+from compliance_prompt import compliance_prompt, evidence_prompt
+from evaluate_change_prompt import evaluate_change_prompt
+from evaluate_dev_doc_prompt import evaluate_dev_doc_prompt
+from json_constraint import (
+    CODE_CHANGE_SCHEMA, COMPLIANCE_SCHEMA, DEV_DOC_SCHEMA, EVIDENCE_SCHEMA, ConstrainedJsonPipeline
+)
+from model_worker import ModelWorkerClient, WorkerLLM
+from prefix_cache import PrefixCachedPipeline, PrefixKVCache, static_prefix
+
 # DEFAULT_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
 DEFAULT_MODEL = "meta-llama/Meta-Llama-3-3B-Instruct"
+# Region classification only needs a few tokens of output; on CPU a 0.5B model answers it
+CPU_CLASSIFIER_MODEL = "Qwen/Qwen2.5-0.5B-Instruct"
+
+
+def cpu_threads_available() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+def configure_cpu_threads(n_threads: Optional[int] = None, pin: bool = False) -> int:
+    """
+    Size torch's intra-op pool to the cores this process may use (or n_threads);
+    pin=True also binds the process to that many cores so the OS does not
+    migrate the threads (Linux only). Returns the thread count.
+    """
+    n = max(1, n_threads or cpu_threads_available())
+    if pin and hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))[:n]
+        os.sched_setaffinity(0, cores)
+        n = len(cores)
+    torch.set_num_threads(n)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # can only be set before the first parallel op
+    return n
+
+
+def load_cpu_model(model_name: str, int8: bool = True):
+    """fp32 weights, with every nn.Linear swapped for an int8 dynamically quantized one."""
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model.eval()
+    if int8:
+        # in place: a copy would double peak memory for the largest models
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
 
 class LLMService:
     def __init__(
@@ -19,32 +68,75 @@ class LLMService:
         do_sample: bool = False,         # deterministic
         top_p: float = 1.0,              # ignored when do_sample=False
         use_4bit: bool = True,           # quantize to fit on 8GB VRAM
+        use_worker: bool = False,        # thin client of a running model_worker.py (same user only)
+        use_prefix_cache: bool = True,   # reuse KV of the static system prompts
+        constrained_json: bool = False,  # mask logits against the expected JSON schema
+        device: str = "auto",            # "auto" (cuda if available), "cuda" or "cpu"
+        cpu_threads: Optional[int] = None,       # CPU: intra-op threads (default: cores available)
+        pin_threads: bool = False,               # CPU: bind the process to cpu_threads cores
+        cpu_int8: bool = True,                   # CPU: int8 dynamic quantization instead of 4-bit
+        classifier_model: Optional[str] = None,  # small model for region classification ("" = none; CPU default: CPU_CLASSIFIER_MODEL)
     ):
         self.model_name = model_name
+        self.prefix_cache = None
+        self.classifier_pipe = None
+        self._schemas: Dict[str, tuple] = {}
+        requested_device = device
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+
+        if use_worker:
+            client = ModelWorkerClient()
+            info = client.ping()
+            if info is not None:
+                # The worker owns the main model; its device, precision and generation settings apply
+                worker_device = info.get("device")
+                print(f"Using shared model worker at {client.path} ({info.get('model')} on {worker_device or 'unknown device'})")
+                if requested_device != "auto" and worker_device and worker_device != requested_device:
+                    print(f"Warning: device={requested_device} does not apply to the model worker, which runs on "
+                          f"{worker_device}; start model_worker.py with --device {requested_device} to change it")
+                self.model_name = info.get("model") or model_name
+                self.pipe = client.pipe
+                self.llm = WorkerLLM(client=client)
+                # Region classification stays in this process, so the CPU path still gets the small model
+                if device == "cpu" and self._classifier_name(classifier_model):
+                    configure_cpu_threads(cpu_threads, pin_threads)
+                self._load_classifier(classifier_model, cpu_int8)
+                return
+            print(f"No model worker reachable at {client.path}; loading {model_name} in this process")
 
         tok = AutoTokenizer.from_pretrained(model_name)
         if tok.pad_token_id is None:
             tok.pad_token = tok.eos_token
 
-        quant_cfg = None
-        try:
-            if use_4bit:
-                quant_cfg = BitsAndBytesConfig(
-                    load_in_4bit=True,
-                    bnb_4bit_quant_type="nf4",
-                    bnb_4bit_use_double_quant=True,
-                    bnb_4bit_compute_dtype=torch.bfloat16,
-                )
-        except Exception:
-            pass
-
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            quantization_config=quant_cfg,
-            device_map="auto",
-            low_cpu_mem_usage=True,
-            torch_dtype=torch.bfloat16 if not use_4bit else None,
-        )
+        if device == "cpu":
+            # bitsandbytes 4-bit needs CUDA; int8 dynamic quantization is the CPU counterpart
+            threads = configure_cpu_threads(cpu_threads, pin_threads)
+            print(f"Loading {model_name} on CPU ({threads} threads, {'int8' if cpu_int8 else 'fp32'})")
+            model = load_cpu_model(model_name, int8=cpu_int8)
+            device_kwargs = {}
+        else:
+            quant_cfg = None
+            try:
+                if use_4bit:
+                    quant_cfg = BitsAndBytesConfig(
+                        load_in_4bit=True,
+                        bnb_4bit_quant_type="nf4",
+                        bnb_4bit_use_double_quant=True,
+                        bnb_4bit_compute_dtype=torch.bfloat16,
+                    )
+            except Exception:
+                pass
+
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                quantization_config=quant_cfg,
+                device_map="auto",
+                low_cpu_mem_usage=True,
+                torch_dtype=torch.bfloat16 if not use_4bit else None,
+            )
+            device_kwargs = {"device_map": "auto"}
 
         gen_kwargs = dict(
             max_new_tokens=max_new_tokens,
@@ -57,14 +149,88 @@ class LLMService:
             "text-generation",
             model=model,
             tokenizer=tok,
-            device_map="auto",
+            **device_kwargs,
             **gen_kwargs
         )
 
+        if use_prefix_cache:
+            self.prefix_cache = PrefixKVCache(model, tok)
+        self.register_prompt("compliance", compliance_prompt(), schema=COMPLIANCE_SCHEMA)
+        self.register_prompt("evidence", evidence_prompt(), schema=EVIDENCE_SCHEMA)
+        self.register_prompt("evaluate_change", evaluate_change_prompt(), schema=CODE_CHANGE_SCHEMA)
+        self.register_prompt("evaluate_dev_doc", evaluate_dev_doc_prompt(), schema=DEV_DOC_SCHEMA)
+
+        if self.prefix_cache is not None:
+            pipe = PrefixCachedPipeline(pipe, self.prefix_cache, dict(
+                max_new_tokens=max_new_tokens, do_sample=do_sample, top_p=top_p,
+            ))
+        if constrained_json:
+            eos = model.generation_config.eos_token_id
+            pipe = ConstrainedJsonPipeline(pipe, self.schema_for, tok, eos if isinstance(eos, list) else [eos])
+
         self.pipe = pipe
         self.llm = HuggingFacePipeline(pipeline=self.pipe)
 
+        self._load_classifier(classifier_model, cpu_int8)
+
+    def _classifier_name(self, classifier_model: Optional[str]) -> str:
+        """Small region classifier to load ("" = classify with the main model)."""
+        if classifier_model is None:
+            classifier_model = CPU_CLASSIFIER_MODEL if self.device == "cpu" else ""
+        return classifier_model if classifier_model != self.model_name else ""
+
+    def _load_classifier(self, classifier_model: Optional[str], cpu_int8: bool) -> None:
+        name = self._classifier_name(classifier_model)
+        if name:
+            self.classifier_pipe = self._classifier_pipeline(name, cpu_int8)
+
+    def _classifier_pipeline(self, model_name: str, cpu_int8: bool):
+        tok = AutoTokenizer.from_pretrained(model_name)
+        if tok.pad_token_id is None:
+            tok.pad_token = tok.eos_token
+        if self.device == "cpu":
+            model, device_kwargs = load_cpu_model(model_name, int8=cpu_int8), {}
+        else:
+            model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16, device_map="auto")
+            device_kwargs = {"device_map": "auto"}
+        return pipeline(
+            "text-generation",
+            model=model,
+            tokenizer=tok,
+            max_new_tokens=32,
+            do_sample=False,
+            return_full_text=False,
+            **device_kwargs,
+        )
+
+    def register_prompt(self, name: str, template, schema=None) -> None:
+        """
+        Register a prompt template: its static prefix is prefilled once and
+        reused (prefix cache), and `schema` constrains decoding for prompts
+        rendered from it (constrained_json mode).
+        """
+        if self.prefix_cache is not None:
+            self.prefix_cache.register(name, template)
+        if schema is not None:
+            self._schemas[name] = (static_prefix(template), schema)
+
+    def schema_for(self, prompt: str):
+        """JSON schema of the longest registered template the prompt was rendered from."""
+        best = None
+        for prefix, schema in self._schemas.values():
+            if prompt.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+                best = (prefix, schema)
+        return best[1] if best else None
+
+    def prefix_cache_stats(self) -> Optional[dict]:
+        return self.prefix_cache.stats() if self.prefix_cache is not None else None
+
     # Small helper so main can classify regions uniformly (works for local)
     def generate_text(self, prompt: str) -> str:
         out = self.pipe(prompt)[0]["generated_text"]
         return out
+
+    def classify_text(self, prompt: str) -> str:
+        """Short classification answers (region names); uses the small classifier model when loaded."""
+        pipe = self.classifier_pipe or self.pipe
+        return pipe(prompt)[0]["generated_text"]
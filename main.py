@@ -1,15 +1,24 @@
 # main.py
-import argparse, json, os, sys, logging, warnings
+import argparse, asyncio, json, os, sys, logging, warnings
 
 import torch
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from typing import Literal
-from retriever_service import RetrieverService
+from retriever_service import AdaptiveCutoff, RetrieverService
 from llm_service import LLMService
-from rag_chain import build_rag_chain, extract_json  # the builder we set up for RetrievalQA
+from rag_chain import (
+    extract_json, answer_with_docs, aanswer_with_docs, ask_evidence, aask_evidence, stream_answer,
+    ExpandedFilteredRetriever,
+)
+from semantic_cache import SemanticCache, fingerprint_docs
+from terminology import expand_query
 from db_orchestrator import DBOrchestrator
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from code_change_evaluator import CodeChangeEvaluator
+from evaluation_cache import EvaluationCache
+from evidence_index import EvidenceVerifier
+from change_prescreen import ChangePreScreen
 from dev_doc_evaluator import DevDocEvaluator
 from gemini_llm_service import GeminiLLMService
 
@@ -28,27 +37,27 @@ for name in [
 os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
 os.environ.setdefault("NUMEXPR_MAX_THREADS", "1")
 
-def process_query(llm, query, k):
-    AVAILABLE_REGIONS = [
-        "Utah",
-        "United States",
-        "European Union",
-        "California",
-        "Florida",
-        "Global"
-    ]
-
-    embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
+AVAILABLE_REGIONS = [
+    "Utah",
+    "United States",
+    "European Union",
+    "California",
+    "Florida",
+    "Global"
+]
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+def load_embeddings():
     # Create the embeddings object once and reuse it
-    embeddings = HuggingFaceEmbeddings(
-        model_name=embedding_model,
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
         model_kwargs={"device": 'cuda' if torch.cuda.is_available() else 'cpu'},
         encode_kwargs={"normalize_embeddings": True},
     )
-    db_orchestrator = DBOrchestrator(embeddings)
-    
 
-    prompt = f"""System: Classify this query into geographic regions. Return only the region names and end response.
+def region_prompt(query):
+    return f"""System: Classify this query into geographic regions. Return only the region names and end response.
         Available regions: {', '.join(AVAILABLE_REGIONS)}
 
         Examples:
@@ -67,41 +76,312 @@ def process_query(llm, query, k):
         Query: {query}
         Answer:"""
 
-    text = (llm.generate_text(prompt) if isinstance(llm, GeminiLLMService) else llm.pipe(prompt)[0]['generated_text']) or ""
+def parse_regions(text):
+    text = text or ""
     try:
         response = text.splitlines()[0].strip()
     except Exception as e:
         response = "Global"
-    regions = [r.strip() for r in response.split(",") if r.strip()]
+    return [r.strip() for r in response.split(",") if r.strip()]
+
+def classify_regions(llm, query):
+    prompt = region_prompt(query)
+    text = llm.generate_text(prompt) if isinstance(llm, GeminiLLMService) else llm.classify_text(prompt)
+    return parse_regions(text)
+
+async def aclassify_regions(llm, query):
+    return parse_regions(await llm.agenerate_text(region_prompt(query)))
+
+def retrieve_for_query(llm, query, k, embeddings, db_orchestrator, cutoff=None):
+    '''
+    Classify the query into regions and retrieve its context (at most k
+    chunks per region; fewer with an AdaptiveCutoff).
+
+    Output:
+        (regions, docs, query_vector) where query_vector embeds the expanded query
+    '''
+    # 1) Classify the query into regions
+    regions = classify_regions(llm, query) or ["Global"]
     print("Regions: ", regions)
 
     # 2) Load retriever and retrievalservice according to regions
+    version = db_orchestrator.index_version()
     retrievers = db_orchestrator.get_retriever_by_region(regions)
-    retrieverServices = RetrieverService(k=k, retriever=retrievers, embedding=embeddings)
-
-    # 3) Build the QA chain (stuff prompt, return sources)
-    qa = build_rag_chain(retrieverServices, llm)
-
-    # 4) Get the RAW result (dict) and print it verbatim
-    raw = qa.invoke({"query": query})
-
-    # print("\n--- RAW DICT ---")
-    # pprint(raw)  # shows everything without any parsing
-
-    # obj = extract_json(raw['result'])
-    # print("\n--- PARSED JSON ---")
-    # pprint(obj)  # shows the parsed JSON object
-    return raw.get("result", "")
+    retriever = ExpandedFilteredRetriever(
+        base=RetrieverService(k=k, retriever=retrievers, embedding=embeddings,
+                              cache=db_orchestrator.retrieval_cache, index_version=version),
+        cutoff=cutoff,
+    )
+    vector = embeddings.embed_query(expand_query(query))
+    docs = retriever.retrieve_many([query], query_embeddings=[vector])[0]
+    return regions, docs, vector
+
+def process_query(llm, query, k, *, embeddings=None, db_orchestrator=None, cache=None, verifier=None, cutoff=None):
+    embeddings = embeddings or load_embeddings()
+    db_orchestrator = db_orchestrator or DBOrchestrator(embeddings)
+
+    regions, docs, vector = retrieve_for_query(llm, query, k, embeddings, db_orchestrator, cutoff)
+
+    # 3) Reuse a stored answer for a near-duplicate request with identical context
+    if cache is not None:
+        fingerprint, version = fingerprint_docs(docs), db_orchestrator.index_version()
+        cached = cache.lookup(vector, regions, fingerprint, version)
+        if cached is not None:
+            return cached
+
+    # 4) Run the compliance prompt ("stuff" chain) over the retrieved context
+    result = answer_with_docs(llm, query, docs)
+    if verifier is not None:
+        answers = {query: result}
+        verify_answers(llm, verifier, answers, {query: docs})
+        result = answers[query]
+    if cache is not None:
+        cache.store(vector, regions, fingerprint, version, result)
+    return result
+
+def stream_query(llm, query, k, *, embeddings=None, db_orchestrator=None, cache=None, cutoff=None):
+    '''
+    Streaming variant of process_query: classifies and retrieves up front,
+    then yields the compliance JSON text chunk by chunk as it is generated.
+    A semantic cache hit is yielded as a single chunk.
+    '''
+    embeddings = embeddings or load_embeddings()
+    db_orchestrator = db_orchestrator or DBOrchestrator(embeddings)
+
+    regions, docs, vector = retrieve_for_query(llm, query, k, embeddings, db_orchestrator, cutoff)
+    if cache is not None:
+        fingerprint, version = fingerprint_docs(docs), db_orchestrator.index_version()
+        cached = cache.lookup(vector, regions, fingerprint, version)
+        if cached is not None:
+            yield cached
+            return
 
-def evaluate_code_change(llm, json_path):
-    code_change_evaluator = CodeChangeEvaluator(llm)
+    chunks = []
+    for chunk in stream_answer(llm, query, docs):
+        chunks.append(chunk)
+        yield chunk
+    if cache is not None:
+        cache.store(vector, regions, fingerprint, version, "".join(chunks))
+
+def feature_query(feature):
+    if isinstance(feature, dict):
+        return feature['feature_name'] + ' ' + feature['feature_description']
+    return feature
+
+def _run_concurrently(llm, sync_fn, async_fn, items, max_workers):
+    '''
+    Apply one LLM-bound function to every item concurrently, returning
+    results (or the raised exception) in input order. Services with an
+    async client are driven by asyncio; others use a thread pool.
+    '''
+    use_async = hasattr(llm, "agenerate_json") and hasattr(llm, "aclose")
+    if use_async:
+        try:
+            asyncio.get_running_loop()
+            use_async = False  # already inside an event loop (e.g. a notebook)
+        except RuntimeError:
+            pass
+
+    if use_async:
+        async def _all():
+            try:
+                return await asyncio.gather(*(async_fn(item) for item in items), return_exceptions=True)
+            finally:
+                # The pooled client is bound to this loop; release it with the loop
+                await llm.aclose()
+        return asyncio.run(_all())
+
+    def _safe(item):
+        try:
+            return sync_fn(item)
+        except Exception as e:
+            return e
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(_safe, items))
+
+def process_queries(llm, features, k, *, embeddings=None, db_orchestrator=None, max_workers=None, cache=None, verifier=None,
+                    cutoff=None):
+    '''
+    Batch counterpart of process_query.
+
+    Region classification and answer generation run concurrently, identical
+    queries are classified/answered once, and retrieval for the whole batch
+    shares one embedding encode plus one vector search per region.
+
+    Parameters:
+        features: list of query strings or dicts with feature_name/feature_description
+        max_workers: concurrent LLM calls for services without an async client
+                     (default: 4 for Gemini, 1 for the local model)
+        cache: optional SemanticCache consulted before each LLM call
+        verifier: optional EvidenceVerifier; new answers have their evidence
+                  quotes checked against the retrieved context (see verify_answers)
+        cutoff: optional AdaptiveCutoff; weak hits are dropped instead of
+                always sending k chunks per region to the LLM
+
+    Output:
+        list (input order) of dict: {"query", "regions", "result", "error"}
+    '''
+    queries = [feature_query(f) for f in features]
+    if not queries:
+        return []
+    embeddings = embeddings or load_embeddings()
+    db_orchestrator = db_orchestrator or DBOrchestrator(embeddings)
+    if max_workers is None:
+        max_workers = 4 if isinstance(llm, GeminiLLMService) else 1
+
+    results = [{"query": q, "regions": [], "result": "", "error": None} for q in queries]
+    unique_queries = list(dict.fromkeys(queries))
+
+    # 1) Classify every unique query into regions
+    classified = _run_concurrently(
+        llm,
+        lambda q: classify_regions(llm, q),
+        lambda q: aclassify_regions(llm, q),
+        unique_queries,
+        max_workers,
+    )
+    regions_by_query = {}
+    for query, regions in zip(unique_queries, classified):
+        if isinstance(regions, Exception):
+            print(f"Error classifying regions for {query}: {regions}")
+            regions = []
+        regions_by_query[query] = regions or ["Global"]
+    for item in results:
+        item["regions"] = regions_by_query[item["query"]]
+        print("Regions: ", item["regions"])
+
+    # 2) Retrieve for the whole batch at once
+    all_regions = list(dict.fromkeys(r for rs in regions_by_query.values() for r in rs))
+    try:
+        version = db_orchestrator.index_version()
+        retrievers = db_orchestrator.get_retriever_by_region(all_regions)
+        retriever = ExpandedFilteredRetriever(
+            base=RetrieverService(k=k, retriever=retrievers, embedding=embeddings,
+                                  cache=db_orchestrator.retrieval_cache, index_version=version),
+            cutoff=cutoff,
+        )
+        vectors = embeddings.embed_documents([expand_query(q) for q in unique_queries])
+        docs = retriever.retrieve_many(
+            unique_queries,
+            [regions_by_query[q] for q in unique_queries],
+            query_embeddings=vectors,
+        )
+    except Exception as e:
+        for item in results:
+            item["error"] = f"Retrieval failed: {e}"
+        return results
+    docs_by_query = dict(zip(unique_queries, docs))
+
+    # 3) Reuse cached answers, then one LLM call per remaining unique query
+    answers = {}
+    cache_keys = {}
+    if cache is not None:
+        version = db_orchestrator.index_version()
+        for q, vector in zip(unique_queries, vectors):
+            cache_keys[q] = (vector, regions_by_query[q], fingerprint_docs(docs_by_query[q]), version)
+            cached = cache.lookup(*cache_keys[q])
+            if cached is not None:
+                answers[q] = cached
+    pending = [q for q in unique_queries if q not in answers]
+    generated = _run_concurrently(
+        llm,
+        lambda q: answer_with_docs(llm, q, docs_by_query[q]),
+        lambda q: aanswer_with_docs(llm, q, docs_by_query[q]),
+        pending,
+        max_workers,
+    )
+    fresh = dict(zip(pending, generated))
+
+    # 4) Verify the evidence quotes of new answers; only failed issues are re-asked
+    if verifier is not None:
+        verify_answers(llm, verifier, fresh, docs_by_query, max_workers)
+    for q, answer in fresh.items():
+        answers[q] = answer
+        if cache is not None and not isinstance(answer, Exception):
+            cache.store(*cache_keys[q], answer)
+
+    for item in results:
+        answer = answers[item["query"]]
+        if isinstance(answer, Exception):
+            item["error"] = str(answer)
+        else:
+            item["result"] = answer
+    return results
+
+def verify_answers(llm, verifier, answers, docs_by_query, max_workers=1):
+    '''
+    Check every evidence quote of the given answers (query -> raw answer text,
+    updated in place) against the documents retrieved for that query. Near
+    misses are repaired locally; for the issues that still fail, the model is
+    re-asked for just their quotes, not the whole answer. Quotes that cannot
+    be verified are kept and flagged with "evidence_verified": false.
+    Unparseable answers and errors are left as they are.
+    '''
+    checked = {}
+    for q, answer in answers.items():
+        if isinstance(answer, Exception):
+            continue
+        try:
+            obj = extract_json(answer)
+        except ValueError:
+            continue
+        before = json.dumps(obj, sort_keys=True)
+        checked[q] = (obj, verifier.check(obj, docs_by_query[q]), before)
+
+    def failed_issues(q):
+        obj, failed, _ = checked[q]
+        return [obj["issues"][i] for i in failed]
+
+    for _ in range(verifier.max_retries):
+        retry = [q for q, (_, failed, _) in checked.items() if failed]
+        if not retry:
+            break
+        replies = _run_concurrently(
+            llm,
+            lambda q: ask_evidence(llm, failed_issues(q), docs_by_query[q]),
+            lambda q: aask_evidence(llm, failed_issues(q), docs_by_query[q]),
+            retry,
+            max_workers,
+        )
+        for q, reply in zip(retry, replies):
+            obj, failed, before = checked[q]
+            try:
+                quotes = None if isinstance(reply, Exception) else extract_json(reply)
+            except ValueError:
+                quotes = None
+            checked[q] = (obj, verifier.apply_retry(obj, docs_by_query[q], failed, quotes), before)
+
+    for q, (obj, failed, before) in checked.items():
+        verifier.mark_unverified(obj, failed)
+        if json.dumps(obj, sort_keys=True) != before:
+            answers[q] = json.dumps(obj, indent=2, ensure_ascii=False)
+
+def evaluate_code_change(llm, json_path, eval_cache=None, prescreen=None):
+    code_change_evaluator = CodeChangeEvaluator(llm, cache=eval_cache, prescreen=prescreen)
     response = code_change_evaluator.evaluate(json_path)
     print(f'Code change evaluation: {response}')
     return response
 
-def evaluate_dev_doc(llm, dev_doc_dir):
-    dev_doc_evaluator = DevDocEvaluator(llm)
-    response = dev_doc_evaluator.evaluate(dev_doc_dir)
+def evaluate_code_file(llm, json_path, k, *, embeddings=None, db_orchestrator=None, cache=None, eval_cache=None, prescreen=None,
+                       verifier=None, cutoff=None):
+    '''
+    Summarize every changed file of a recorded changes JSON into a feature,
+    then run the compliance check on each feature.
+    eval_cache: optional EvaluationCache for the per-file summaries.
+    prescreen: optional ChangePreScreen; files it rules out get no LLM call.
+    verifier: optional EvidenceVerifier for the compliance answers.
+    cutoff: optional AdaptiveCutoff for retrieval.
+    Returns (code_changes, results) with results as from process_queries.
+    '''
+    code_changes = evaluate_code_change(llm, json_path, eval_cache=eval_cache, prescreen=prescreen)
+    results = process_queries(llm, code_changes, k, embeddings=embeddings, db_orchestrator=db_orchestrator, cache=cache,
+                              verifier=verifier, cutoff=cutoff)
+    return code_changes, results
+
+def evaluate_dev_doc(llm, dev_doc_dir, windowed=False, embeddings=None, dedup_threshold=0.9):
+    # embeddings enable similarity de-duplication of the features merged from windows
+    dev_doc_evaluator = DevDocEvaluator(llm, embedding=embeddings, dedup_threshold=dedup_threshold)
+    response = dev_doc_evaluator.evaluate(dev_doc_dir, windowed=windowed)
     print(f'Dev doc evaluation: {response}')
     return response
 
@@ -113,10 +393,30 @@ def main():
     
     parser.add_argument("-evaluate_code", "--evaluate_code",type=str, help="Evaluate the code change stored in json path")
     parser.add_argument("-evaluate_doc", "--evaluate_doc",type=str, help="Evaluate the dev doc stored in json path")
+    parser.add_argument("--windowed", action="store_true", help="Extract dev doc features per page/section window concurrently (for large docs).")
+    parser.add_argument("--dedup_threshold", type=float, default=0.9, help="With --windowed: cosine similarity above which features from different windows are merged (default: 0.9).")
+    parser.add_argument("--cache_threshold", type=float, default=0.95, help="Cosine similarity above which a near-duplicate feature reuses a cached answer (default: 0.95).")
+    parser.add_argument("--no_cache", action="store_true", help="Disable the semantic answer cache and the code-change evaluation cache for batch evaluations.")
+    parser.add_argument("--prescreen_threshold", type=float, default=0.25, help="Code changes whose diff is less similar than this to every regulation/glossary centroid skip the LLM (default: 0.25).")
+    parser.add_argument("--no_prescreen", action="store_true", help="Send every changed file to the LLM.")
+    parser.add_argument("--min_score", type=float, default=0.25, help="Drop retrieved chunks below this cosine similarity (the best hit is always kept; default: 0.25).")
+    parser.add_argument("--max_score_gap", type=float, default=0.15, help="Drop retrieved chunks scoring more than this below the best hit (default: 0.15).")
+    parser.add_argument("--max_context_tokens", type=int, default=3000, help="Token budget for the retrieved chunks of one query, filled best-first (default: 3000).")
+    parser.add_argument("--fixed_k", action="store_true", help="Always send the top-k chunks per region (no score cutoffs or token budget).")
+    parser.add_argument("--no_verify_evidence", action="store_true", help="Do not check evidence quotes against the retrieved context (no repair, no re-ask).")
+    parser.add_argument("--constrained_json", action="store_true", help="Local model only: mask logits so outputs always match the expected JSON schema.")
+    parser.add_argument("--device", choices=["auto", "cpu", "cuda"], default="auto", help="Local model only: cpu uses int8 dynamic quantization and a small region classifier.")
+    parser.add_argument("--cpu_threads", type=int, help="Local model on CPU: intra-op threads (default: available cores).")
+    parser.add_argument("--use_worker", action="store_true", help="Local model only: send prompts to a running model_worker.py instead of loading the model.")
 
     args = parser.parse_args()
 
-    llm = GeminiLLMService() if args.model == "gemini" else LLMService()
+    llm = GeminiLLMService() if args.model == "gemini" else LLMService(constrained_json=args.constrained_json, device=args.device, cpu_threads=args.cpu_threads, use_worker=args.use_worker)
+    cache = None if args.no_cache else SemanticCache(threshold=args.cache_threshold)
+    db_orchestrator = verifier = None
+    cutoff = None if args.fixed_k else AdaptiveCutoff(
+        min_score=args.min_score, max_gap=args.max_score_gap, max_tokens=args.max_context_tokens
+    )
 
     if args.evaluate_code:
         # Check if the file exists
@@ -124,7 +424,12 @@ def main():
             print(f"Error: {args.evaluate_code} does not exist")
             return
 
-        code_changes = evaluate_code_change(llm, args.evaluate_code)
+        embeddings = load_embeddings()
+        db_orchestrator = DBOrchestrator(embeddings)
+        eval_cache = None if args.no_cache else EvaluationCache()
+        prescreen = None if args.no_prescreen else ChangePreScreen(embeddings, db_orchestrator, threshold=args.prescreen_threshold)
+        verifier = None if args.no_verify_evidence else EvidenceVerifier(db_orchestrator)
+        code_changes, results = evaluate_code_file(llm, args.evaluate_code, args.k, embeddings=embeddings, db_orchestrator=db_orchestrator, cache=cache, eval_cache=eval_cache, prescreen=prescreen, verifier=verifier, cutoff=cutoff)
         # Save code change evaluation into txt file
         # Check if the directory exists
         if not os.path.exists('code_change_eval'):
@@ -134,10 +439,12 @@ def main():
             for code_change in code_changes:
                 f.write(f'{code_change}\n')
 
-        for code_change in code_changes:
+        for code_change, result in zip(code_changes, results):
             print(f'code_change: {code_change}')
-            query = code_change['feature_name'] + ' ' + code_change['feature_description']
-            response = process_query(llm, query, args.k)
+            if result["error"]:
+                print(f'Error processing code change: {code_change}: {result["error"]}')
+                continue
+            response = result["result"]
 
             # Save query response into txt file
             if not os.path.exists('code_change_geocompliance'):
@@ -151,30 +458,29 @@ def main():
             print(f"Error: {args.evaluate_doc} does not exist")
             return
 
-        dev_docs = evaluate_dev_doc(llm, args.evaluate_doc)
+        embeddings = load_embeddings()
+        dev_docs = evaluate_dev_doc(llm, args.evaluate_doc, windowed=args.windowed, embeddings=embeddings,
+                                    dedup_threshold=args.dedup_threshold)
         # Save code change evaluation into txt file
         # Check if the directory exists
         if not os.path.exists('dev_doc_eval'):
             os.makedirs('dev_doc_eval')
 
+        db_orchestrator = DBOrchestrator(embeddings)
+        verifier = None if args.no_verify_evidence else EvidenceVerifier(db_orchestrator)
         for dev_doc in dev_docs:
             with open(f'dev_doc_eval/{dev_doc["file"]}_features.txt', 'w') as f:
-                geocompliance_responses = []
                 for feature in dev_doc['features']:
                     f.write(f'{feature["feature_name"]} {feature["feature_description"]}\n')
 
-                    query = feature['feature_name'] + ' ' + feature['feature_description']
-                    print(f'query: {query}')
-                    try:
-                        response = process_query(llm, query, args.k)
-                    except Exception as e:
-                        print(f'Error processing feature: {feature}: {e}')
-                        continue
-                    
-                    try:
-                        geocompliance_responses.append(response)
-                    except Exception as e:
-                        print(f'Error processing feature: {feature}: {e}')
+            geocompliance_responses = []
+            results = process_queries(llm, dev_doc['features'], args.k, embeddings=embeddings, db_orchestrator=db_orchestrator, cache=cache, verifier=verifier, cutoff=cutoff)
+            for feature, result in zip(dev_doc['features'], results):
+                print(f'query: {result["query"]}')
+                if result["error"]:
+                    print(f'Error processing feature: {feature}: {result["error"]}')
+                    continue
+                geocompliance_responses.append(result["result"])
 
             # Save query response into txt file
             if not os.path.exists('dev_doc_geocompliance'):
@@ -183,9 +489,19 @@ def main():
                 f.write(f'{geocompliance_responses}\n')
 
     elif args.query:
-        response = process_query(llm, args.query, args.k)
+        embeddings = load_embeddings()
+        db_orchestrator = DBOrchestrator(embeddings)
+        verifier = None if args.no_verify_evidence else EvidenceVerifier(db_orchestrator)
+        response = process_query(llm, args.query, args.k, embeddings=embeddings, db_orchestrator=db_orchestrator, verifier=verifier, cutoff=cutoff)
         print(response)
 
+    if cache is not None and (args.evaluate_code or args.evaluate_doc):
+        print(f'Semantic cache: {cache.stats()}')
+    if db_orchestrator is not None and db_orchestrator.retrieval_cache is not None:
+        print(f'Retrieval cache: {db_orchestrator.retrieval_cache.stats()}')
+    if verifier is not None:
+        print(f'Evidence check: {verifier.stats()}')
+
 if __name__ == "__main__":
     # Run as: python main.py "Your query here" -k 5
     main()
\ No newline at end of file
@@ -0,0 +1,325 @@
+# model_worker.py
+"""
+Shared local-model worker.
+
+One process owns the HF text-generation pipeline and serves prompts over a
+Unix-domain socket, so the CLI, the Streamlit app and the pre-commit hook no
+longer each load their own copy of the weights. Concurrent requests are
+collected into dynamic batches (up to max_batch_size, waiting at most
+max_wait_ms for the batch to fill) and each caller gets its own result back.
+
+Only the user running the worker can reach it: the socket lives in a 0700
+directory owned by that user, is created 0600, and peers of another uid are
+rejected on both ends. Messages are newline-delimited JSON (never pickle).
+
+Run:  python model_worker.py --max_batch_size 8 --max_wait_ms 20
+then pass use_worker=True to LLMService (--use_worker on the CLI).
+"""
+from __future__ import annotations
+
+import json
+import os
+import queue
+import socket
+import stat
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from pydantic import Field
+
+# Largest accepted message (one JSON line): prompts carry the retrieved context
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+def default_socket_path() -> str:
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "geo-compliance", "model_worker.sock")
+
+
+DEFAULT_SOCKET = os.environ.get("GEOCOMPLIANCE_WORKER_SOCKET") or default_socket_path()
+
+
+def _check_private_dir(path: str) -> None:
+    """The socket directory must be ours and closed to group/other, or anyone could swap the socket."""
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by the current user with mode 0700")
+
+
+def _peer_uid(sock: socket.socket) -> Optional[int]:
+    """uid of the process at the other end (Linux SO_PEERCRED); None where unsupported."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def _check_peer(sock: socket.socket) -> None:
+    uid = _peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        raise PermissionError(f"Model worker peer runs as uid {uid}")
+
+
+def _send(wfile, msg: dict) -> None:
+    wfile.write(json.dumps(msg).encode("utf-8") + b"\n")
+    wfile.flush()
+
+
+def _recv(rfile) -> dict:
+    line = rfile.readline(MAX_MESSAGE_BYTES + 1)
+    if not line:
+        raise EOFError("Connection closed")
+    if len(line) > MAX_MESSAGE_BYTES:
+        raise ValueError("Message too large")
+    msg = json.loads(line)
+    if not isinstance(msg, dict):
+        raise ValueError("Message is not a JSON object")
+    return msg
+
+
+@dataclass
+class _Request:
+    prompt: str
+    kwargs: Dict[str, Any]
+    done: threading.Event = field(default_factory=threading.Event)
+    text: str = ""
+    error: Optional[str] = None
+
+
+class ModelWorker:
+    def __init__(self, pipe, model_name: str = "", max_batch_size: int = 8, max_wait_ms: float = 20.0,
+                 device: str = ""):
+        self.pipe = pipe
+        self.model_name = model_name
+        self.device = device
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self.batches = 0
+        self.requests = 0
+        # Decoder-only models must be left-padded for batched generation
+        tokenizer = getattr(pipe, "tokenizer", None)
+        if tokenizer is not None:
+            tokenizer.padding_side = "left"
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+    # ---------- Batching ----------
+    def submit(self, prompt: str, **kwargs) -> _Request:
+        req = _Request(prompt, kwargs)
+        self._queue.put(req)
+        return req
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._collect()
+            # Only requests with identical generation kwargs can share a forward pass
+            groups: Dict[str, List[_Request]] = {}
+            for req in batch:
+                groups.setdefault(json.dumps(req.kwargs, sort_keys=True), []).append(req)
+            for reqs in groups.values():
+                self._run(reqs, reqs[0].kwargs)
+
+    def _run(self, reqs: List[_Request], kwargs: Dict[str, Any]):
+        try:
+            outputs = self.pipe([r.prompt for r in reqs], batch_size=len(reqs), **kwargs)
+            for req, out in zip(reqs, outputs):
+                # A list input yields one list of candidates per prompt
+                first = out[0] if isinstance(out, list) else out
+                req.text = first["generated_text"]
+        except Exception as e:
+            for req in reqs:
+                req.error = str(e)
+        finally:
+            self.batches += 1
+            self.requests += len(reqs)
+            for req in reqs:
+                req.done.set()
+
+    # ---------- Serving ----------
+    def _handle(self, conn: socket.socket):
+        with conn, conn.makefile("rb") as rfile, conn.makefile("wb") as wfile:
+            while True:
+                try:
+                    msg = _recv(rfile)
+                except (EOFError, OSError):
+                    return
+                except ValueError as e:
+                    _send(wfile, {"ok": False, "error": f"Bad message: {e}"})
+                    return
+                op = msg.get("op")
+                if op == "ping":
+                    _send(wfile, {
+                        "ok": True,
+                        "model": self.model_name,
+                        "device": self.device,
+                        "batches": self.batches,
+                        "requests": self.requests,
+                        "queued": self._queue.qsize(),
+                    })
+                elif op == "generate":
+                    kwargs = msg.get("kwargs") or {}
+                    if not isinstance(msg.get("prompt"), str) or not isinstance(kwargs, dict):
+                        _send(wfile, {"ok": False, "error": "generate needs a prompt string and a kwargs object"})
+                        continue
+                    req = self.submit(msg["prompt"], **kwargs)
+                    req.done.wait()
+                    _send(wfile, {"ok": req.error is None, "text": req.text, "error": req.error})
+                else:
+                    _send(wfile, {"ok": False, "error": f"Unknown op: {op}"})
+
+    def serve(self, path: str = DEFAULT_SOCKET):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _check_private_dir(directory)
+        if os.path.exists(path):
+            if ModelWorkerClient(path).ping() is not None:
+                raise RuntimeError(f"A model worker is already listening on {path}")
+            os.unlink(path)  # left over from a worker that did not shut down cleanly
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # the socket is never group/other accessible, not even briefly
+        try:
+            listener.bind(path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(path, 0o600)
+        # Default backlog is small: concurrent first connects would stall
+        listener.listen(64)
+        print(f"Model worker ({self.model_name}) listening on {path}")
+        try:
+            while True:
+                conn, _ = listener.accept()
+                try:
+                    _check_peer(conn)
+                except Exception as e:
+                    print(f"Rejected connection: {e}")
+                    conn.close()
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class ModelWorkerClient:
+    """Thread-safe client: one persistent connection per calling thread."""
+
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: float = 600.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not hasattr(socket, "AF_UNIX"):
+                raise OSError("The model worker needs Unix-domain sockets")
+            _check_private_dir(os.path.dirname(os.path.abspath(self.path)))
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+                _check_peer(sock)
+            except Exception:
+                sock.close()
+                raise
+            conn = self._local.conn = (sock, sock.makefile("rb"), sock.makefile("wb"))
+        return conn
+
+    def _request(self, msg: dict) -> dict:
+        sock, rfile, wfile = self._conn()
+        try:
+            _send(wfile, msg)
+            return _recv(rfile)
+        except Exception:
+            # Drop a broken connection so the next call reconnects
+            self._local.conn = None
+            for f in (rfile, wfile, sock):
+                try:
+                    f.close()
+                except Exception:
+                    pass
+            raise
+
+    def ping(self) -> Optional[dict]:
+        try:
+            return self._request({"op": "ping"})
+        except Exception:
+            return None
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        resp = self._request({"op": "generate", "prompt": prompt, "kwargs": kwargs})
+        if not resp.get("ok"):
+            raise RuntimeError(f"Model worker error: {resp.get('error')}")
+        return resp["text"]
+
+    def pipe(self, prompt, **kwargs):
+        """Mimics the HF pipeline call shape used across the repo: pipe(p)[0]['generated_text']."""
+        if isinstance(prompt, str):
+            return [{"generated_text": self.generate(prompt, **kwargs)}]
+        return [[{"generated_text": self.generate(p, **kwargs)}] for p in prompt]
+
+
+class WorkerLLM(LLM):
+    """LangChain LLM backed by the shared model worker (drop-in for HuggingFacePipeline)."""
+    client: Any = Field(exclude=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "geo-compliance-model-worker"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        text = self.client.generate(prompt)
+        if stop:
+            cut = min((i for i in (text.find(s) for s in stop) if i != -1), default=-1)
+            if cut != -1:
+                text = text[:cut]
+        return text
+
+
+if __name__ == "__main__":
+    import argparse
+    from llm_service import DEFAULT_MODEL, LLMService
+
+    parser = argparse.ArgumentParser(description="Serve the local LLM to every process on this machine.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path (its directory must be private to this user).")
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--max_wait_ms", type=float, default=20.0, help="Max time to wait for a batch to fill.")
+    parser.add_argument("--constrained_json", action="store_true", help="Mask logits against the expected JSON schemas.")
+    parser.add_argument("--device", choices=["auto", "cpu", "cuda"], default="auto")
+    parser.add_argument("--cpu_threads", type=int, help="CPU only: intra-op threads (default: available cores).")
+    parser.add_argument("--pin_threads", action="store_true", help="CPU only: bind the worker to --cpu_threads cores.")
+    args = parser.parse_args()
+
+    service = LLMService(
+        model_name=args.model,
+        use_worker=False,
+        constrained_json=args.constrained_json,
+        device=args.device,
+        cpu_threads=args.cpu_threads,
+        pin_threads=args.pin_threads,
+        classifier_model="",  # clients send every prompt through the served pipe
+    )
+    ModelWorker(service.pipe, model_name=args.model, device=service.device,
+                max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms).serve(args.socket)
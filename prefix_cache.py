@@ -0,0 +1,168 @@
+# prefix_cache.py
+"""
+Prefix KV-cache reuse for the local HF model.
+
+The compliance / evaluate-change / dev-doc prompts start with a long system
+block that is identical on every call. Each registered prompt template gets
+its static prefix (everything before the first input variable) prefilled
+once; later calls copy those past key/values and only prefill the
+per-request suffix.
+"""
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import torch
+from transformers import DynamicCache
+
+_SENTINEL = "\x00PREFIX_CUT_{}\x00"
+
+
+def static_prefix(template) -> str:
+    """
+    Text every rendering of `template` starts with, as the local pipeline sees it.
+    Formats the template with sentinel values and cuts at the first one.
+    """
+    values = {var: _SENTINEL.format(i) for i, var in enumerate(template.input_variables)}
+    rendered = template.format_prompt(**values).to_string()
+    cuts = [rendered.find(v) for v in values.values() if v in rendered]
+    return rendered[:min(cuts)] if cuts else rendered
+
+
+@dataclass
+class _Prefix:
+    name: str
+    text: str
+    input_ids: Optional[torch.Tensor] = None
+    cache: Optional[DynamicCache] = None
+    prefill_s: float = 0.0
+
+
+class PrefixKVCache:
+    """Past key/values for registered static prompt prefixes, built lazily on first use."""
+
+    def __init__(self, model, tokenizer, min_prefix_tokens: int = 32):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.min_prefix_tokens = min_prefix_tokens
+        self._prefixes: Dict[str, _Prefix] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_s = 0.0
+        self.last_saved_s = 0.0
+
+    def register(self, name: str, template) -> None:
+        text = static_prefix(template)
+        with self._lock:
+            self._prefixes[name] = _Prefix(name, text)
+
+    def match(self, prompt: str) -> Optional[_Prefix]:
+        """Longest registered prefix the prompt starts with."""
+        best = None
+        for prefix in self._prefixes.values():
+            if prompt.startswith(prefix.text) and (best is None or len(prefix.text) > len(best.text)):
+                best = prefix
+        return best
+
+    def _sync(self):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def _build(self, prefix: _Prefix) -> None:
+        ids = self.tokenizer(prefix.text, return_tensors="pt").input_ids.to(self.model.device)
+        cache = DynamicCache()
+        self._sync()
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            self.model(input_ids=ids, past_key_values=cache, use_cache=True)
+        self._sync()
+        prefix.prefill_s = time.perf_counter() - t0
+        prefix.input_ids = ids
+        prefix.cache = cache
+        print(f"[prefix-cache] {prefix.name}: {ids.shape[1]} tokens prefilled in {prefix.prefill_s:.3f}s")
+
+    def generate(self, prompt: str, **gen_kwargs) -> Optional[str]:
+        """
+        Generate continuing from a cached prefix. Returns None when no prefix
+        applies (caller should fall back to the plain pipeline).
+        """
+        prefix = self.match(prompt)
+        if prefix is None:
+            self.misses += 1
+            return None
+        with self._lock:
+            if prefix.cache is None:
+                self._build(prefix)
+        n_prefix = prefix.input_ids.shape[1]
+
+        ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.model.device)
+        # Tokens can merge across the prefix boundary; only reuse an exact match
+        if (n_prefix < self.min_prefix_tokens or ids.shape[1] <= n_prefix
+                or not torch.equal(ids[0, :n_prefix], prefix.input_ids[0])):
+            self.misses += 1
+            return None
+
+        with torch.no_grad():
+            out = self.model.generate(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                past_key_values=copy.deepcopy(prefix.cache),
+                pad_token_id=self.tokenizer.pad_token_id,
+                **gen_kwargs,
+            )
+        self.hits += 1
+        self.last_saved_s = prefix.prefill_s
+        self.saved_s += prefix.prefill_s
+        print(f"[prefix-cache] {prefix.name}: reused {n_prefix} tokens, ~{prefix.prefill_s:.3f}s prefill saved")
+        return self.tokenizer.decode(out[0, ids.shape[1]:], skip_special_tokens=True)
+
+    def stats(self) -> dict:
+        return {
+            "prefixes": {p.name: (p.input_ids.shape[1] if p.input_ids is not None else None)
+                         for p in self._prefixes.values()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefill_saved_s": round(self.saved_s, 3),
+            "last_prefill_saved_s": round(self.last_saved_s, 3),
+        }
+
+
+class PrefixCachedPipeline:
+    """
+    Drop-in for the HF text-generation pipeline: single prompts that start
+    with a registered prefix go through PrefixKVCache, everything else
+    (unmatched prompts, real batches) is passed to the wrapped pipeline.
+    """
+
+    def __init__(self, pipe, prefix_cache: PrefixKVCache, gen_kwargs: Dict[str, Any]):
+        self._pipe = pipe
+        self.prefix_cache = prefix_cache
+        self.gen_kwargs = gen_kwargs
+
+    def __getattr__(self, name):
+        # task, model, tokenizer, ... as HuggingFacePipeline expects
+        return getattr(self._pipe, name)
+
+    def _cached(self, prompt: str, kwargs: Dict[str, Any]) -> Optional[List[dict]]:
+        if not isinstance(prompt, str) or kwargs.get("return_full_text"):
+            return None
+        gen_kwargs = dict(self.gen_kwargs)
+        gen_kwargs.update({k: v for k, v in kwargs.items() if k not in ("batch_size", "return_full_text")})
+        text = self.prefix_cache.generate(prompt, **gen_kwargs)
+        return None if text is None else [{"generated_text": text}]
+
+    def __call__(self, prompt, **kwargs):
+        if isinstance(prompt, list) and len(prompt) == 1:
+            out = self._cached(prompt[0], kwargs)
+            if out is not None:
+                return [out]
+        elif not isinstance(prompt, list):
+            out = self._cached(prompt, kwargs)
+            if out is not None:
+                return out
+        return self._pipe(prompt, **kwargs)
@@ -1,14 +1,15 @@
 # rag_chain.py
 from __future__ import annotations
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional
 from pydantic import Field
 
 from langchain.chains import RetrievalQA
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
 
-from compliance_prompt import compliance_prompt
+from compliance_prompt import compliance_prompt, evidence_prompt
+from retriever_service import AdaptiveCutoff, Retrieved
 from terminology import expand_query
 
 
@@ -17,17 +18,23 @@ class ExpandedFilteredRetriever(BaseRetriever):
     A compliant LangChain retriever that:
       - expands acronyms/codenames in the query before retrieval
       - filters out glossary docs (metadata.doc_type == "glossary") so they
-        never get stuffed into the prompt
+        never get stuffed into the prompt. Glossary exclusion normally happens
+        inside the vector search (separate collection / `$ne` filter, see
+        DB.regulation_filter); stripping here is only a safety net.
+      - with a `cutoff` (AdaptiveCutoff), keeps only the hits that score close
+        enough to the best one, within a token budget, instead of a fixed k
     """
     base: BaseRetriever | Any = Field(repr=False)
+    cutoff: Optional[AdaptiveCutoff] = None
+
+    @staticmethod
+    def _is_glossary(doc: Document) -> bool:
+        return (getattr(doc, "metadata", None) or {}).get("doc_type") == "glossary"
 
     def _strip_glossary(self, docs: List[Document]) -> List[Document]:
         if not docs:
             return []
-        return [
-            d for d in docs
-            if (getattr(d, "metadata", None) or {}).get("doc_type") != "glossary"
-        ]
+        return [d for d in docs if not self._is_glossary(d)]
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: Any = None
@@ -51,6 +58,100 @@ class ExpandedFilteredRetriever(BaseRetriever):
             docs = self.base.get_relevant_documents(q)
         return self._strip_glossary(docs)
 
+    def retrieve_many(
+        self,
+        queries: List[str],
+        regions: List[List[str]] | None = None,
+        query_embeddings: List[List[float]] | None = None,
+    ) -> List[List[Document]]:
+        """
+        Batched counterpart of retrieval: expand every query, search once, strip glossary.
+        query_embeddings, if given, must embed the *expanded* queries.
+        """
+        if not hasattr(self.base, "retrieve_scored"):
+            expanded = [expand_query(q) for q in queries]
+            batches = self.base.retrieve_many(expanded, regions, query_embeddings=query_embeddings)
+            return [self._strip_glossary(docs) for docs in batches]
+        batches = self.retrieve_scored(queries, regions, query_embeddings=query_embeddings)
+        return [[r.doc for r in items] for items in batches]
+
+    def retrieve_scored(
+        self,
+        queries: List[str],
+        regions: List[List[str]] | None = None,
+        query_embeddings: List[List[float]] | None = None,
+    ) -> List[List[Retrieved]]:
+        """retrieve_many with similarity scores, after the glossary strip and the cutoff."""
+        expanded = [expand_query(q) for q in queries]
+        # Filter on metadata and scores first; chunk text is only read for what is kept
+        batches = self.base.retrieve_scored(expanded, regions, query_embeddings=query_embeddings, materialize_text=False)
+        batches = [[r for r in items if not self._is_glossary(r.doc)] for items in batches]
+        if self.cutoff is not None:
+            batches = [self.cutoff.select(items) for items in batches]
+        self.base.materialize([[r.doc for r in items] for items in batches])
+        if self.cutoff is not None:
+            batches = [self.cutoff.fit_budget(items) for items in batches]
+        return batches
+
+
+def format_context(docs: List[Document]) -> str:
+    # Same layout as the "stuff" chain: page contents separated by blank lines.
+    # Statute-chunked docs carry their anchor so the model can cite it.
+    parts = []
+    for d in docs:
+        anchor = (d.metadata or {}).get("anchor")
+        parts.append(f"[{anchor}]\n{d.page_content}" if anchor else d.page_content)
+    return "\n\n".join(parts)
+
+
+def answer_with_docs(llm_service, query: str, docs: List[Document]) -> str:
+    """
+    Run the compliance prompt over already-retrieved documents.
+    Equivalent to the RetrievalQA "stuff" step without re-running retrieval.
+    """
+    prompt = compliance_prompt().format_prompt(question=query, context=format_context(docs))
+    out = llm_service.llm.invoke(prompt)
+    return getattr(out, "content", out) or ""
+
+
+async def aanswer_with_docs(llm_service, query: str, docs: List[Document]) -> str:
+    """Async answer_with_docs; uses the service's pooled async client when it has one."""
+    prompt = compliance_prompt().format_prompt(question=query, context=format_context(docs))
+    if hasattr(llm_service, "agenerate_json"):
+        return await llm_service.agenerate_json(prompt)
+    out = await llm_service.llm.ainvoke(prompt)
+    return getattr(out, "content", out) or ""
+
+
+def _evidence_request(issues: List[dict], docs: List[Document]):
+    lines = "\n".join(
+        f"{n}. {issue.get('issue', '')} — {issue.get('reasoning', '')}" for n, issue in enumerate(issues, 1)
+    )
+    return evidence_prompt().format_prompt(issues=lines, context=format_context(docs))
+
+
+def ask_evidence(llm_service, issues: List[dict], docs: List[Document]) -> str:
+    """Re-ask only for the quotes of `issues` (see evidence_index); returns {"evidence": [...]} as text."""
+    out = llm_service.llm.invoke(_evidence_request(issues, docs))
+    return getattr(out, "content", out) or ""
+
+
+async def aask_evidence(llm_service, issues: List[dict], docs: List[Document]) -> str:
+    prompt = _evidence_request(issues, docs)
+    if hasattr(llm_service, "agenerate_json"):
+        return await llm_service.agenerate_json(prompt)
+    out = await llm_service.llm.ainvoke(prompt)
+    return getattr(out, "content", out) or ""
+
+
+def stream_answer(llm_service, query: str, docs: List[Document]) -> Iterator[str]:
+    """Streaming variant of answer_with_docs: yields text chunks as they are generated."""
+    prompt = compliance_prompt().format_prompt(question=query, context=format_context(docs))
+    for chunk in llm_service.llm.stream(prompt):
+        text = getattr(chunk, "content", chunk)
+        if text:
+            yield text
+
 
 def build_rag_chain(
     retriever,         # can be a BaseRetriever OR your custom service
@@ -85,3 +186,55 @@ def extract_json(raw: str) -> dict:
     if s == -1 or e == -1 or e <= s:
         raise ValueError("No JSON object found in input.")
     return json.loads(raw[s:e+1])
+
+
+def parse_partial_json(raw: str) -> dict | None:
+    """
+    Best-effort parse of an incomplete (still streaming) JSON object: open
+    strings, arrays and objects are closed so the prefix can be displayed.
+    Returns None while nothing parseable has arrived yet.
+    """
+    raw = raw.replace("```json", "").replace("```", "")
+    s = raw.find("{")
+    if s == -1:
+        return None
+    text = raw[s:]
+    stack, in_str, escape = [], False, False
+    cuts = []  # (position, closers) where the prefix can be cut cleanly
+    end = len(text)
+    for i, ch in enumerate(text):
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch in "}]" and stack:
+            stack.pop()
+            if not stack:
+                end = i + 1
+                break
+        elif ch == ",":
+            cuts.append((i, "".join(reversed(stack))))
+
+    candidate = text[:end]
+    if escape:
+        candidate = candidate[:-1]
+    if in_str:
+        candidate += '"'
+    attempts = [candidate + "".join(reversed(stack))]
+    # Fall back to the last clean cut (drops a half-written key or value)
+    attempts += [text[:pos] + closers for pos, closers in reversed(cuts[-3:])]
+    for attempt in attempts:
+        try:
+            obj = json.loads(attempt)
+            return obj if isinstance(obj, dict) else None
+        except ValueError:
+            continue
+    return None
@@ -5,12 +5,15 @@ Uses git diff to detect changes and saves them to changes/ directory.
 """
 
 import json
+import os
 import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
 import re
 
+from evaluation_queue import EvaluationQueue, spawn_worker, tree_key
+
 
 def run_git_command(cmd):
   """Run a git command and return the output."""
@@ -159,10 +162,17 @@ def record_changes():
       line_changes = get_file_changes(file_path, status)
       
       if line_changes:  # Only include files with actual changes
-        changed_files.append({
+        changed_file = {
           "file_path": file_path,
           "line_changes": line_changes
-        })
+        }
+        if status != 'D':
+          # Staged content, since the queued evaluation runs after the working tree may have moved on
+          # Read unstripped, and without newline translation, so the content is byte-for-byte what was staged
+          result = subprocess.run(["git", "show", f":0:{file_path}"], capture_output=True)
+          if result.returncode == 0:
+            changed_file["file_content"] = result.stdout.decode("utf-8", errors="replace")
+        changed_files.append(changed_file)
     
     if not changed_files:
       print("No meaningful changes detected in staged files.")
@@ -190,25 +200,20 @@ def record_changes():
     print(f"Changes recorded in: {changes_file}")
     print(f"Total files processed: {len(changed_files)}")
     
-    # Call main.py with --evaluate to process the changes
+    # Queue the evaluation and return; a background worker runs it so the commit is not blocked
     try:
-      print(f"Evaluating changes using main.py --evaluate...")
-      eval_result = subprocess.run(
-        f"python main.py -evaluate {changes_file}",
-        shell=True, capture_output=True, text=True, timeout=60
-      )
-      
-      if eval_result.returncode == 0:
-        print("✅ Change evaluation completed successfully:")
-        print(eval_result.stdout)
+      queue = EvaluationQueue()
+      key = tree_key() or str(changes_file.resolve())
+      if queue.enqueue(key, str(changes_file)):
+        print(f"Queued evaluation of {changes_file} (tree {key[:12]})")
       else:
-        print(f"⚠️  Change evaluation failed with exit code {eval_result.returncode}")
-        print(f"Error output: {eval_result.stderr}")
-        
-    except subprocess.TimeoutExpired:
-      print("⚠️  Change evaluation timed out after 60 seconds")
+        print(f"Tree {key[:12]} is already queued or evaluated")
+      # Same default model as main.py; GEOCOMPLIANCE_EVAL_MODEL=local evaluates with the local Llama instead
+      if spawn_worker(model=os.environ.get("GEOCOMPLIANCE_EVAL_MODEL", "gemini")):
+        print("Started background evaluation worker (log: changes/worker.log)")
+      print("Check progress with: python evaluation_queue.py status")
     except Exception as e:
-      print(f"⚠️  Error during change evaluation: {e}")
+      print(f"⚠️  Could not queue change evaluation: {e}")
     
     print("Continuing with commit...")
     
@@ -1,6 +1,9 @@
 from __future__ import annotations
+import json
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Any, Literal
+from typing import List, Optional, Dict, Any, Literal, Tuple
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
 from langchain_core.retrievers import BaseRetriever
@@ -8,18 +11,138 @@ from langchain_core.vectorstores.base import VectorStoreRetriever
 from pydantic import Field
 from langchain_core.runnables import RunnableConfig
 
-from db import DB
+from chunk_store import CHUNK_ID_KEY, materialize
+from db import DB, chunk_store_for, distance_space, query_collection, similarity_from_distance
 
 search_type = Literal["similarity"]
 
 @dataclass
 class Retrieved:
     doc: Document
-    score: Optional[float] = None
+    score: Optional[float] = None   # cosine similarity to the query (higher is closer)
+
+def estimate_tokens(text: str) -> int:
+  # ~4 characters per token, as in sweep_retrieval's context_tokens
+  return (len(text or "") + 3) // 4
+
+@dataclass
+class AdaptiveCutoff:
+  '''
+  Drops weak hits from a query's retrieved chunks instead of always keeping k:
+    min_score: absolute cosine-similarity floor
+    max_gap:   largest allowed drop below the best hit's score
+    max_tokens: budget for the chunk texts, filled best-first (None = no budget)
+    min_docs:  the best hits kept regardless of the floor and gap
+  select() needs only scores (run it before materializing text); fit_budget()
+  needs the text. Kept chunks stay in their retrieval order.
+  '''
+  min_score: float = 0.25
+  max_gap: float = 0.15
+  max_tokens: Optional[int] = 3000
+  min_docs: int = 1
+
+  def select(self, items: List[Retrieved]) -> List[Retrieved]:
+    scored = [r.score for r in items if r.score is not None]
+    if not scored:
+      return list(items)
+    best = max(scored)
+    ranked = sorted(range(len(items)), key=lambda i: -(items[i].score if items[i].score is not None else best))
+    keep = set(ranked[:self.min_docs])
+    for i in ranked[self.min_docs:]:
+      score = items[i].score
+      if score is None or (score >= self.min_score and best - score <= self.max_gap):
+        keep.add(i)
+    return [r for i, r in enumerate(items) if i in keep]
+
+  def fit_budget(self, items: List[Retrieved]) -> List[Retrieved]:
+    if self.max_tokens is None:
+      return list(items)
+    ranked = sorted(range(len(items)), key=lambda i: -(items[i].score or 0.0))
+    keep, used = set(), 0
+    for n, i in enumerate(ranked):
+      tokens = estimate_tokens(items[i].doc.page_content)
+      if n >= self.min_docs and used + tokens > self.max_tokens:
+        continue
+      keep.add(i)
+      used += tokens
+    return [r for i, r in enumerate(items) if i in keep]
+
+class RetrievalCache:
+  '''
+  Bounded LRU cache of vector-search results, one entry per (expanded query,
+  region, k, filter, store, index version). Entries hold (document, distance)
+  snapshots and every lookup returns fresh Document copies, so callers may
+  fill in or alter what they get. Seeing a new index version drops all
+  entries. Shared by every RetrieverService of a DBOrchestrator.
+  '''
+
+  def __init__(self, max_entries: int = 4096):
+    self.max_entries = max_entries
+    self.index_version: Optional[str] = None
+    self._entries: "OrderedDict[tuple, List[Tuple[str, dict, float]]]" = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  @staticmethod
+  def key(query: str, region: str, retriever: VectorStoreRetriever, index_version: Optional[str]) -> tuple:
+    kwargs = retriever.search_kwargs
+    store = getattr(retriever.vectorstore, "_persist_directory", None)
+    where = json.dumps(kwargs.get("filter"), sort_keys=True, default=str)
+    return (query, region, kwargs.get("k", 5), where, store, index_version)
+
+  def check_version(self, index_version: Optional[str]) -> None:
+    with self._lock:
+      if index_version != self.index_version:
+        if self._entries:
+          self.invalidations += 1
+        self._entries.clear()
+        self.index_version = index_version
+
+  def get(self, key: tuple) -> Optional[List[Tuple[Document, float]]]:
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._entries.move_to_end(key)
+    return [(Document(page_content=text, metadata=dict(meta)), dist) for text, meta, dist in entry]
+
+  def put(self, key: tuple, pairs: List[Tuple[Document, float]]) -> None:
+    entry = [(doc.page_content, dict(doc.metadata or {}), dist) for doc, dist in pairs]
+    with self._lock:
+      if key[-1] != self.index_version:
+        return  # searched against a version that has since been replaced
+      self._entries[key] = entry
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self) -> dict:
+    total = self.hits + self.misses
+    return {
+      "entries": len(self._entries),
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": (self.hits / total) if total else 0.0,
+      "evictions": self.evictions,
+      "invalidations": self.invalidations,
+    }
+
 
 class RetrieverService(BaseRetriever):
   embedding: Optional[HuggingFaceEmbeddings] = Field(default=None, exclude=True)
   retriever: Dict[str, VectorStoreRetriever] = Field(default_factory=dict, exclude=True)
+  cache: Optional[RetrievalCache] = Field(default=None, exclude=True)
+  index_version: Optional[str] = None
   
   def __init__(self,
         embedding: HuggingFaceEmbeddings,
@@ -27,12 +150,21 @@ class RetrieverService(BaseRetriever):
         db_name: str = "",
         retriever: Dict[str, VectorStoreRetriever] = dict(),
         k: int = 5,
+        cache: Optional[RetrievalCache] = None,
+        index_version: Optional[str] = None,
         ):
+    '''
+    cache: optional RetrievalCache (e.g. DBOrchestrator.retrieval_cache);
+           index_version must then be the version the retrievers belong to,
+           read before they were handed out
+    '''
 
     # Initialize parent class
     super().__init__()
 
     self.embedding = embedding
+    self.cache = cache
+    self.index_version = index_version
     
     if not retriever:
       try:
@@ -47,17 +179,153 @@ class RetrieverService(BaseRetriever):
       self.retriever = retriever
 
   def _get_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
-    result = []
-    for region, retriever in self.retriever.items():
+    result = self.retrieve_many([query])[0]
+    print(result)
+    return result
+
+  def retrieve_many(
+        self,
+        queries: List[str],
+        regions: Optional[List[List[str]]] = None,
+        query_embeddings: Optional[List[List[float]]] = None,
+        materialize_text: bool = True,
+        ) -> List[List[Document]]:
+    '''Documents only; see retrieve_scored.'''
+    batches = self.retrieve_scored(queries, regions, query_embeddings, materialize_text)
+    return [[r.doc for r in items] for items in batches]
+
+  def retrieve_scored(
+        self,
+        queries: List[str],
+        regions: Optional[List[List[str]]] = None,
+        query_embeddings: Optional[List[List[float]]] = None,
+        materialize_text: bool = True,
+        ) -> List[List[Retrieved]]:
+    '''
+    Batched retrieval for many queries.
+
+    Identical (query, regions) requests are searched once, (query, region)
+    pairs held by the RetrievalCache are not searched again, the remaining
+    queries are embedded in one encode call, and each region runs a single
+    multi-query vector search.
+
+    Parameters:
+        queries: list of query strings
+        regions: optional list (one per query) of region names to search;
+                 defaults to every region held by this service
+        query_embeddings: optional precomputed embeddings (one per query)
+        materialize_text: False leaves chunks kept in a ChunkStore without
+                 text (metadata["chunk_id"] only) so the caller can filter
+                 first and then call materialize() on what it keeps
+
+    Output:
+        list (one per query, input order) of Retrieved (document and cosine
+        similarity), grouped by region in the order the regions were
+        requested; a chunk found through several regions is listed once
+    '''
+    if regions is None:
+      regions = [list(self.retriever.keys())] * len(queries)
+
+    # De-duplicate identical retrieval requests
+    request_index: Dict[tuple, int] = {}
+    requests: List[tuple] = []
+    slots: List[int] = []
+    for query, query_regions in zip(queries, regions):
+      key = (query, tuple(query_regions))
+      if key not in request_index:
+        request_index[key] = len(requests)
+        requests.append(key)
+      slots.append(request_index[key])
+
+    texts = list(dict.fromkeys(q for q, _ in requests))
+    text_index = {q: i for i, q in enumerate(texts)}
+
+    by_region: Dict[str, Dict[int, None]] = {}
+    for q, query_regions in requests:
+      for region in query_regions:
+        by_region.setdefault(region, {})[text_index[q]] = None
+
+    # Reuse cached searches; the rest is searched per region below
+    cache = self.cache
+    if cache is not None:
+      cache.check_version(self.index_version)
+    hits: Dict[tuple, List[Tuple[Document, float]]] = {}
+    misses: Dict[str, List[int]] = {}
+    spaces: Dict[str, str] = {}
+    for region, wanted in by_region.items():
+      retriever = self.retriever.get(region)
+      if retriever is None:
+        print(f"Region {region} not found in the database")
+        continue
+      spaces[region] = distance_space(retriever.vectorstore)
+      for i in wanted:
+        cached = cache.get(RetrievalCache.key(texts[i], region, retriever, self.index_version)) if cache is not None else None
+        if cached is not None:
+          hits[(texts[i], region)] = cached
+        else:
+          misses.setdefault(region, []).append(i)
+
+    needed = sorted({i for text_ids in misses.values() for i in text_ids})
+    vectors: Dict[int, List[float]] = {}
+    if query_embeddings is not None:
+      given = {}
+      for q, v in zip(queries, query_embeddings):
+        given.setdefault(q, v)
+      vectors = {i: given[texts[i]] for i in needed}
+    elif needed:
+      vectors = dict(zip(needed, self.embedding.embed_documents([texts[i] for i in needed])))
+
+    # One vectorized search per region over every query that needs it
+    for region, text_ids in misses.items():
+      retriever = self.retriever[region]
       try:
-        # Use get_relevant_documents instead of invoke for vector store retrievers
-        docs = retriever.invoke(query)
-        result.extend(docs)  # Flatten the list of documents
+        found = query_collection(
+          retriever.vectorstore,
+          [vectors[i] for i in text_ids],
+          k=retriever.search_kwargs.get("k", 5),
+          where=retriever.search_kwargs.get("filter"),
+          chunks=chunk_store_for(retriever.vectorstore),
+          materialize_text=False,
+        )
       except Exception as e:
         print(f"Error retrieving from {region}: {e}")
         raise
-    print(result)
-    return result
+      for i, pairs in zip(text_ids, found):
+        if cache is not None:
+          cache.put(RetrievalCache.key(texts[i], region, retriever, self.index_version), pairs)
+        hits[(texts[i], region)] = pairs
+
+    results = []
+    for q, query_regions in requests:
+      items = []
+      seen = set()
+      for region in query_regions:
+        for doc, distance in hits.get((q, region), []):
+          chunk_id = doc.metadata.get(CHUNK_ID_KEY)
+          if chunk_id is not None:
+            if chunk_id in seen:
+              continue
+            seen.add(chunk_id)
+          items.append(Retrieved(doc, similarity_from_distance(distance, spaces[region])))
+      results.append(items)
+    if materialize_text:
+      self.materialize([[r.doc for r in items] for items in results])
+    return [list(results[i]) for i in slots]
+
+  def chunk_stores(self) -> list:
+    stores = []
+    for retriever in self.retriever.values():
+      store = chunk_store_for(retriever.vectorstore)
+      if store is not None and store not in stores:
+        stores.append(store)
+    return stores
+
+  def materialize(self, batches: List[List[Document]]) -> List[List[Document]]:
+    '''Fill in (in place) the text of documents retrieved with materialize_text=False.'''
+    stores = self.chunk_stores()
+    if stores:
+      materialize((doc for docs in batches for doc in docs), stores)
+    return batches
 
   # def retrieve(self, query: str) -> List[Document]:
   #   # Since self.retriever is a dict, we need to aggregate results from all retrievers
@@ -0,0 +1,137 @@
+# semantic_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+
+def fingerprint_docs(docs) -> str:
+    """Stable hash of the retrieved chunks (order-sensitive, as stuffed into the prompt)."""
+    h = hashlib.sha1()
+    for d in docs:
+        meta = getattr(d, "metadata", None) or {}
+        h.update(str(meta.get("source", "")).encode("utf-8"))
+        h.update(str(meta.get("page", "")).encode("utf-8"))
+        h.update(str(meta.get("start_index", "")).encode("utf-8"))
+        h.update(hashlib.sha1(d.page_content.encode("utf-8")).digest())
+    return h.hexdigest()
+
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = sum(x * x for x in vector) ** 0.5 or 1.0
+    return [x / norm for x in vector]
+
+
+@dataclass
+class _Entry:
+    vector: List[float]
+    bucket: tuple
+    answer: str
+    created: float
+
+
+class SemanticCache:
+    """
+    Answer cache for near-duplicate feature descriptions.
+
+    A stored compliance answer is reused only when
+      - the query embedding is within `threshold` cosine similarity,
+      - the retrieved chunks hash to the same fingerprint, and
+      - the region set and index version are identical.
+    Entries are grouped into buckets by (regions, fingerprint, index version),
+    so a lookup only compares vectors inside one bucket. The least recently
+    used entry is evicted beyond `max_entries`; `ttl_seconds` optionally
+    expires old answers. Seeing a new index version drops all entries.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.index_version: Optional[str] = None
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[tuple, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _bucket(regions, fingerprint: str, index_version: str) -> tuple:
+        return (tuple(sorted(set(regions))), fingerprint, index_version)
+
+    def _check_version(self, index_version: str) -> None:
+        if index_version != self.index_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._buckets.clear()
+            self.index_version = index_version
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._buckets.get(entry.bucket, [])
+        if entry_id in ids:
+            ids.remove(entry_id)
+        if not ids:
+            self._buckets.pop(entry.bucket, None)
+
+    def lookup(self, query_vector, regions, fingerprint: str, index_version: str) -> Optional[str]:
+        """Return a cached answer for a semantically equivalent request, or None."""
+        vector = _normalize(query_vector)
+        bucket = self._bucket(regions, fingerprint, index_version)
+        now = time.time()
+        with self._lock:
+            self._check_version(index_version)
+            best_id, best_sim = None, self.threshold
+            for entry_id in list(self._buckets.get(bucket, [])):
+                entry = self._entries[entry_id]
+                if self.ttl_seconds is not None and now - entry.created > self.ttl_seconds:
+                    self._drop(entry_id)
+                    continue
+                sim = sum(a * b for a, b in zip(vector, entry.vector))
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id].answer
+
+    def store(self, query_vector, regions, fingerprint: str, index_version: str, answer: str) -> None:
+        if not answer:
+            return
+        bucket = self._bucket(regions, fingerprint, index_version)
+        with self._lock:
+            self._check_version(index_version)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(_normalize(query_vector), bucket, answer, time.time())
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,169 @@
+# statute_chunker.py
+"""
+Statute-structure-aware chunking.
+
+Splits regulation text on section / subsection boundaries instead of fixed
+overlapping windows: "Article 15", "§ 2258A", "13-63-105.", "27000.5.",
+"SEC. 2." start sections; "(a)", "(1)", "(A)", "(ii)" and "1.   " start
+subsections. Consecutive subsections of one section are packed into chunks
+up to `chunk_size`, each tagged with its anchor (e.g. "13-63-105(3)(a)").
+Only a single subsection larger than `chunk_size` falls back to windowed
+splitting.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# (pattern, anchor format); matched against stripped lines
+SECTION_PATTERNS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"^Article\s+(\d+[a-z]?)\s*$"), "Article {}"),
+    (re.compile(r"^§\s*(\d+[A-Za-z]*)\.?\s*$"), "§ {}"),
+    (re.compile(r"^(\d+[A-Za-z]?-\d+[A-Za-z]?-\d+(?:\.\d+)?)\.?(?:\s|$)"), "{}"),   # Utah 13-63-105.
+    (re.compile(r"^(\d{3}\.\d{3,5})\s+[A-Z][^.]*\.—"), "{}"),                          # Florida 501.1736 Title.—
+    (re.compile(r"^(\d{4,6}(?:\.\d+)?)\.\s*$"), "{}"),                                 # California 27000.5.
+    (re.compile(r"^(?:SECTION|SEC\.)\s+(\d+)\.?\s*$"), "SEC. {}"),
+]
+
+_MARKER = re.compile(r"^\(([0-9]{1,3}|[a-z]{1,4}|[A-Z]{1,3})\)\s*")
+_NUMBERED_PARAGRAPH = re.compile(r"^(\d{1,3})\.\s{2,}")          # EU "1.   Providers shall ..."
+_ROMAN = re.compile(r"^[ivxl]+$")
+
+
+def section_anchor(line: str) -> Optional[str]:
+    for pattern, fmt in SECTION_PATTERNS:
+        m = pattern.match(line)
+        if m:
+            return fmt.format(m.group(1))
+    return None
+
+
+def _marker_type(token: str, stack: List[Tuple[str, str]]) -> str:
+    if token.isdigit():
+        return "num"
+    if token.islower():
+        if _ROMAN.match(token):
+            # "(i)" right after "(h)" is a letter, not a roman numeral
+            prev = next((t for kind, t in reversed(stack) if kind == "lower"), None)
+            if not (len(token) == 1 and prev and ord(prev) == ord(token) - 1):
+                return "roman"
+        return "lower"
+    return "upper"
+
+
+def subsection_markers(line: str) -> List[str]:
+    """Leading markers of a line: "(b) (1) “Addictive…" -> ["b", "1"]."""
+    m = _NUMBERED_PARAGRAPH.match(line)
+    if m:
+        return [m.group(1)]
+    tokens = []
+    rest = line
+    while True:
+        m = _MARKER.match(rest)
+        if not m:
+            return tokens
+        tokens.append(m.group(1))
+        rest = rest[m.end():]
+
+
+@dataclass
+class _Block:
+    path: str
+    page_meta: dict
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+class StatuteChunker:
+    def __init__(self, chunk_size: int = 1500, fallback_overlap: int = 150):
+        self.chunk_size = chunk_size
+        self.fallback = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=fallback_overlap,
+            length_function=len,
+        )
+
+    def split(self, pages: Iterable[Document]) -> Iterator[Document]:
+        """
+        Consume a stream of page/section Documents (e.g. DocumentLoader.lazy_load())
+        and yield chunks section by section; sections may span pages.
+        """
+        section: Optional[str] = None
+        heading: List[str] = []
+        blocks: List[_Block] = []
+        stack: List[Tuple[str, str]] = []
+        section_meta: dict = {}
+
+        for page in pages:
+            meta = dict(page.metadata or {})
+            for raw in page.page_content.split("\n"):
+                line = raw.strip()
+                if not line:
+                    continue
+                anchor = section_anchor(line)
+                if anchor is not None:
+                    yield from self._pack(section, heading, blocks, section_meta)
+                    section, heading, blocks, stack, section_meta = anchor, [line], [], [], meta
+                    continue
+                tokens = subsection_markers(line)
+                if tokens:
+                    for token in tokens:
+                        kind = _marker_type(token, stack)
+                        kinds = [k for k, _ in stack]
+                        if kind in kinds:
+                            del stack[kinds.index(kind):]
+                        stack.append((kind, token))
+                    blocks.append(_Block("".join(f"({t})" for _, t in stack), meta))
+                elif not blocks:
+                    if len(heading) < 3 and section is not None and len(line) < 200:
+                        # Section title lines ("Transparency reporting obligations ...")
+                        heading.append(line)
+                        continue
+                    blocks.append(_Block("", meta))
+                blocks[-1].lines.append(line)
+
+        yield from self._pack(section, heading, blocks, section_meta)
+
+    def _chunk(self, section: Optional[str], path: str, text: str, meta: dict) -> Document:
+        metadata = dict(meta)
+        metadata["section_anchor"] = section or ""
+        metadata["anchor"] = f"{section or ''}{path}"
+        return Document(page_content=text, metadata=metadata)
+
+    def _pack(self, section: Optional[str], heading: List[str], blocks: List[_Block], meta: dict) -> Iterator[Document]:
+        head = "\n".join(heading)
+        if not blocks:
+            # Short section made only of heading lines
+            if head:
+                yield self._chunk(section, "", head, meta)
+            return
+        budget = max(self.chunk_size - len(head) - 1, self.chunk_size // 2)
+        current: List[_Block] = []
+        size = 0
+
+        def flush():
+            text = "\n".join(b.text for b in current)
+            # Every chunk repeats the section heading so it stands on its own
+            return self._chunk(section, current[0].path, f"{head}\n{text}" if head else text, current[0].page_meta)
+
+        for block in blocks:
+            length = len(block.text) + 1
+            if length > budget:
+                if current:
+                    yield flush()
+                    current, size = [], 0
+                for piece in self.fallback.split_text(block.text):
+                    yield self._chunk(section, block.path, f"{head}\n{piece}" if head else piece, block.page_meta)
+                continue
+            if current and size + length > budget:
+                yield flush()
+                current, size = [], 0
+            current.append(block)
+            size += length
+        if current:
+            yield flush()
@@ -0,0 +1,212 @@
+# sweep_retrieval.py
+"""
+Parameter sweep over chunking and retrieval settings.
+
+For every chunking config a throwaway index of regulations/ is built in a
+temp directory; the sample_data.csv queries are then replayed against it
+for every k. Evidence sentences quoted in sample_data_response.csv (or any
+history export with a response_json column) are the relevance labels: a
+label counts as retrieved when one of the top-k chunks contains it.
+With --adaptive, an extra "adaptive" row applies the score cutoffs and token
+budget (retriever_service.AdaptiveCutoff) to the top max(k) chunks.
+
+Run: python sweep_retrieval.py --chunkers statute recursive --chunk_sizes 800 1500 --k 3 5 8
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+from db import DB, chunk_store_for, distance_space, query_collection, similarity_from_distance
+from document_manager import DocumentManager
+from rag_chain import extract_json
+from retriever_service import AdaptiveCutoff, Retrieved
+from terminology import expand_query
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+COLUMNS = [
+    "chunker", "chunk_size", "chunk_overlap", "k", "chunks", "index_mb", "ingest_s",
+    "query_ms", "context_tokens", "labelled_queries", "recall", "hit_rate",
+]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def evidence_found(evidence: str, chunk: str, min_overlap: float = 0.8) -> bool:
+    """Verbatim containment (whitespace-insensitive), else token recall >= min_overlap."""
+    ev = _normalize(evidence)
+    if ev in _normalize(chunk):
+        return True
+    ev_tokens = _tokens(evidence)
+    if not ev_tokens:
+        return False
+    chunk_tokens = set(_tokens(chunk))
+    return sum(t in chunk_tokens for t in ev_tokens) / len(ev_tokens) >= min_overlap
+
+
+def load_queries(path: str) -> Dict[str, str]:
+    """feature name -> query text, formatted like the CLI / demo do."""
+    queries = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            name = (row.get("feature_name") or "").strip()
+            desc = (row.get("feature_description") or "").strip()
+            if name or desc:
+                queries[name] = f"{name}: {desc}" if name else desc
+    return queries
+
+
+def load_labels(path: str) -> Dict[str, List[str]]:
+    """feature name -> evidence sentences quoted in a stored compliance answer."""
+    labels: Dict[str, List[str]] = {}
+    if not os.path.exists(path):
+        return labels
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            raw = (row.get("response_json") or "").strip()
+            try:
+                if raw.startswith('"'):
+                    raw = json.loads(raw)   # stored as a JSON-encoded string
+                result = extract_json(raw.replace("```json", "").replace("```", ""))
+            except Exception:
+                continue
+            evidence = [i.get("evidence", "").strip() for i in result.get("issues", []) if isinstance(i, dict)]
+            evidence = [e for e in evidence if e]
+            if evidence:
+                labels.setdefault((row.get("feature") or "").strip(), []).extend(evidence)
+    return labels
+
+
+def dir_size_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total / 1e6
+
+
+def run_config(embedding, regulations_dir, chunker, chunk_size, chunk_overlap, ks, names, vectors, labels, cutoff=None):
+    tmp = tempfile.mkdtemp(prefix="sweep_")
+    try:
+        manager = DocumentManager(regulations_dir, versioned=False, base_path=tmp, embedding=embedding)
+        t0 = time.perf_counter()
+        manager.process_documents(chunk_size=chunk_size, chunk_overlap=chunk_overlap, chunker=chunker)
+        ingest_s = time.perf_counter() - t0
+
+        db = DB(embedding, persist_directory=tmp)
+        n_chunks = db.db._collection.count()
+        t0 = time.perf_counter()
+        results = query_collection(db.db, vectors, k=max(ks), where=db.regulation_filter(None), chunks=chunk_store_for(db.db))
+        query_ms = (time.perf_counter() - t0) * 1e3 / max(1, len(vectors))
+        space = distance_space(db.db)
+        index_mb = dir_size_mb(tmp)
+        db.close()
+
+        # One row per k, plus "adaptive": the top max(ks) after the score cutoffs and token budget
+        selections = [(k, [[doc.page_content for doc, _ in pairs[:k]] for pairs in results]) for k in ks]
+        if cutoff is not None:
+            adaptive = []
+            for pairs in results:
+                items = [Retrieved(doc, similarity_from_distance(dist, space)) for doc, dist in pairs]
+                adaptive.append([r.doc.page_content for r in cutoff.fit_budget(cutoff.select(items))])
+            selections.append(("adaptive", adaptive))
+
+        rows = []
+        for k, selected in selections:
+            found = total = hits = labelled = 0
+            context_chars = 0
+            for name, docs in zip(names, selected):
+                context_chars += sum(len(d) for d in docs)
+                evidence = labels.get(name)
+                if not evidence:
+                    continue
+                labelled += 1
+                matched = sum(any(evidence_found(e, d) for d in docs) for e in evidence)
+                found += matched
+                total += len(evidence)
+                hits += matched > 0
+            rows.append({
+                "chunker": chunker,
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap if chunker == "recursive" else "",
+                "k": k,
+                "chunks": n_chunks,
+                "index_mb": round(index_mb, 2),
+                "ingest_s": round(ingest_s, 1),
+                "query_ms": round(query_ms, 2),
+                # ~4 characters per token for the stuffed context
+                "context_tokens": round(context_chars / max(1, len(names)) / 4),
+                "labelled_queries": labelled,
+                "recall": round(found / total, 3) if total else "",
+                "hit_rate": round(hits / labelled, 3) if labelled else "",
+            })
+        return rows
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking and k over throwaway indexes; report size/latency/recall.")
+    parser.add_argument("--regulations_dir", default="./regulations/")
+    parser.add_argument("--queries", default="sample_data.csv")
+    parser.add_argument("--labels", default="sample_data_response.csv", help="CSV with feature + response_json (e.g. a history export).")
+    parser.add_argument("--chunkers", nargs="+", choices=["statute", "recursive"], default=["statute", "recursive"])
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", default=[500, 1000, 1500])
+    parser.add_argument("--chunk_overlaps", type=int, nargs="+", default=[0, 250, 500], help="Recursive chunker only.")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--adaptive", action="store_true", help="Add a row with the adaptive cutoffs applied to the top max(k).")
+    parser.add_argument("--min_score", type=float, default=0.25)
+    parser.add_argument("--max_score_gap", type=float, default=0.15)
+    parser.add_argument("--max_context_tokens", type=int, default=3000)
+    parser.add_argument("--out", default="sweep_results.csv")
+    args = parser.parse_args()
+
+    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    queries = load_queries(args.queries)
+    labels = load_labels(args.labels)
+    names = list(queries)
+    # Same query text the retriever searches with: glossary-expanded
+    vectors = embedding.embed_documents([expand_query(queries[n]) for n in names])
+    print(f"{len(names)} queries, {sum(1 for n in names if n in labels)} with evidence labels")
+
+    configs = []
+    for chunker, size in itertools.product(args.chunkers, args.chunk_sizes):
+        if chunker == "statute":
+            configs.append((chunker, size, 0))
+        else:
+            configs += [(chunker, size, o) for o in args.chunk_overlaps if o < size]
+
+    cutoff = AdaptiveCutoff(args.min_score, args.max_score_gap, args.max_context_tokens) if args.adaptive else None
+    rows = []
+    for chunker, size, overlap in configs:
+        print(f"Building {chunker} chunk_size={size}" + (f" overlap={overlap}" if chunker == "recursive" else ""))
+        rows += run_config(embedding, args.regulations_dir, chunker, size, overlap, sorted(args.k), names, vectors, labels, cutoff)
+
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in COLUMNS}
+    print(" ".join(c.rjust(widths[c]) for c in COLUMNS))
+    for r in rows:
+        print(" ".join(str(r[c]).rjust(widths[c]) for c in COLUMNS))
+
+    with open(args.out, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
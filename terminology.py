@@ -1,7 +1,12 @@
 # terminology.py
-import re
-from typing import Dict, List, Tuple
+import csv
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+# Built-in fallback; terminology_table.csv (and any other configured source) overrides it
 GLOSSARY: Dict[str, str] = {
     "NR": "Not recommended",
     "PF": "Personalized feed",
@@ -25,30 +30,263 @@ GLOSSARY: Dict[str, str] = {
     "IMT": "Internal monitoring trigger",
 }
 
-# Build regex once for term detection (whole words, case-sensitive for acronyms/codenames)
-_TERMS = sorted(GLOSSARY.keys(), key=len, reverse=True)
-_TERM_RE = re.compile(r"\b(" + "|".join(map(re.escape, _TERMS)) + r")\b")
+GLOSSARY_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "terminology_table.csv")
+
+# Codecs UTF-8 text is typically mis-decoded with before being saved as UTF-8 again
+_MOJIBAKE_CODECS = ("cp1252", "mac_roman", "latin-1")
+
+
+def mojibake_original(text: str) -> Optional[str]:
+    """
+    The text before a UTF-8 -> legacy codec -> UTF-8 round-trip ("T1‚ÄìT4" for
+    "T1–T4"), or None if it does not look garbled. Genuine non-ASCII text almost
+    never re-encodes to valid multi-byte UTF-8.
+    """
+    if text.isascii():
+        return None
+    for codec in _MOJIBAKE_CODECS:
+        try:
+            original = text.encode(codec).decode("utf-8")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            continue
+        if original != text:
+            return original
+    return None
+
+
+
+class AhoCorasick:
+    """
+    Minimal Aho-Corasick automaton. Scanning is linear in the text length
+    (plus the number of matches), independent of how many patterns exist.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]
+
+    def add(self, pattern: str, payload: object) -> None:
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(pattern), payload))
+
+    def build(self) -> "AhoCorasick":
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        return self
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """Yield (start, end, payload) for every pattern occurrence."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for length, payload in out[state]:
+                    yield i + 1 - length, i + 1, payload
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _is_acronym(term: str) -> bool:
+    # PF, GH, T5, ... stay case-sensitive so they don't collide with ordinary words
+    return term.upper() == term
+
+
+def _plural(word: str) -> str:
+    suffix = "es" if word[-1:].lower() in ("s", "x") or word[-2:].lower() in ("ch", "sh") else "s"
+    return word + (suffix.upper() if word.isupper() else suffix)
+
+
+def term_variants(term: str) -> List[str]:
+    """Surface forms matched for a term: case variants (codenames only) and plurals."""
+    if _is_acronym(term):
+        return [term, term + "s"]                       # PF -> PFs, CDS -> CDSs
+    forms = [term, term.lower(), term.upper(), term[:1].upper() + term[1:]]
+    variants = []
+    for form in forms:
+        variants += [form, _plural(form)]
+    return list(dict.fromkeys(variants))
+
+
+GlossarySource = Union[str, Dict[str, str]]
+
+
+class TerminologyEngine:
+    """
+    Glossary term detection/expansion backed by an Aho-Corasick automaton.
+
+    Sources are merged in order (later ones win): dicts or CSV files with a
+    `term,explanation` header. Matching uses whole-word semantics, so "PF"
+    does not match inside "PFX", and recognizes case variants of codenames
+    plus plurals ("Softblocks", "PFs"). CSV sources are re-read when their
+    modification time changes (checked at most every `check_interval` s).
+    """
+
+    def __init__(self, sources: Iterable[GlossarySource] = (), check_interval: float = 2.0):
+        self.sources: List[GlossarySource] = list(sources)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtimes: Dict[str, Optional[float]] = {}
+        self._last_check = 0.0
+        self.glossary: Dict[str, str] = {}
+        self._automaton = AhoCorasick().build()
+        self.reload()
+
+    # ---------- Loading ----------
+    @staticmethod
+    def load_csv(path: str) -> Dict[str, str]:
+        """Terms of a term,explanation CSV; rows garbled by an encoding round-trip are skipped."""
+        terms = {}
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                term = (row.get("term") or "").strip()
+                explanation = (row.get("explanation") or "").strip()
+                if not term:
+                    continue
+                original = mojibake_original(term) or mojibake_original(explanation)
+                if original is not None:
+                    # Skipping keeps the built-in (or an earlier source's) definition
+                    print(f"Skipping garbled glossary row {term!r} in {path} (probably {original!r}; re-save the file as UTF-8)")
+                    continue
+                terms[term] = explanation
+        return terms
+
+    def _source_mtimes(self) -> Dict[str, Optional[float]]:
+        mtimes = {}
+        for source in self.sources:
+            if isinstance(source, str):
+                mtimes[source] = os.path.getmtime(source) if os.path.exists(source) else None
+        return mtimes
+
+    def reload(self) -> None:
+        glossary: Dict[str, str] = {}
+        for source in self.sources:
+            if isinstance(source, dict):
+                glossary.update(source)
+            elif os.path.exists(source):
+                try:
+                    glossary.update(self.load_csv(source))
+                except Exception as e:
+                    print(f"Error loading glossary {source}: {e}")
+
+        automaton = AhoCorasick()
+        for term in glossary:
+            for variant in term_variants(term):
+                automaton.add(variant, term)
+        automaton.build()
+
+        with self._lock:
+            self.glossary = glossary
+            self._automaton = automaton
+            self._mtimes = self._source_mtimes()
+            self._last_check = time.monotonic()
+
+    def maybe_reload(self) -> bool:
+        """Hot-reload when a CSV source changed on disk. Returns True if reloaded."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        if self._source_mtimes() == self._mtimes:
+            return False
+        self.reload()
+        return True
+
+    # ---------- Matching ----------
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """Non-overlapping whole-word matches (leftmost, then longest) as (start, end, term)."""
+        if not text:
+            return []
+        self.maybe_reload()
+        automaton = self._automaton
+        candidates = [
+            (start, end, term)
+            for start, end, term in automaton.iter(text)
+            if (start == 0 or not _is_word_char(text[start - 1]))
+            and (end == len(text) or not _is_word_char(text[end]))
+        ]
+        candidates.sort(key=lambda m: (m[0], m[0] - m[1]))
+        matches, last_end = [], 0
+        for start, end, term in candidates:
+            if start >= last_end:
+                matches.append((start, end, term))
+                last_end = end
+        return matches
+
+    def detect_terms(self, text: str) -> List[str]:
+        return sorted(set(term for _, _, term in self.find(text)))
+
+    def expand_query(self, query: str) -> str:
+        """Append meaning next to terms to help retrieval, keeping the original phrasing."""
+        if not query:
+            return ""
+        glossary = self.glossary
+        parts, pos = [], 0
+        for start, end, term in self.find(query):
+            expl = glossary.get(term, "")
+            parts.append(query[pos:end])
+            if expl:
+                parts.append(f" ({expl})")
+            pos = end
+        parts.append(query[pos:])
+        return "".join(parts)
+
+    def make_definitions_block(self, query: str, max_items: int = 10) -> str:
+        """Make a compact block to inject into the prompt. Do NOT treat as legal evidence."""
+        hits = self.detect_terms(query)
+        if not hits:
+            return "None."
+        glossary = self.glossary
+        pairs: List[Tuple[str, str]] = [(t, glossary.get(t, "")) for t in hits][:max_items]
+        lines = [f"- {t}: {exp}" for t, exp in pairs]
+        return "\n".join(lines)
+
+
+_ENGINE = TerminologyEngine([GLOSSARY, GLOSSARY_CSV])
+
+def default_engine() -> TerminologyEngine:
+    return _ENGINE
+
+def get_glossary() -> Dict[str, str]:
+    _ENGINE.maybe_reload()
+    return dict(_ENGINE.glossary)
 
 def detect_terms(text: str) -> List[str]:
     if not text:
         return []
-    return sorted(set(m.group(1) for m in _TERM_RE.finditer(text)))
+    return _ENGINE.detect_terms(text)
 
 def expand_query(query: str) -> str:
     """Append meaning next to terms to help retrieval, keeping the original phrasing."""
-    if not query:
-        return ""
-    def repl(m):
-        t = m.group(1)
-        expl = GLOSSARY.get(t, "")
-        return f"{t} ({expl})" if expl else t
-    return _TERM_RE.sub(repl, query)
+    return _ENGINE.expand_query(query)
 
 def make_definitions_block(query: str, max_items: int = 10) -> str:
     """Make a compact block to inject into the prompt. Do NOT treat as legal evidence."""
-    hits = detect_terms(query)
-    if not hits:
-        return "None."
-    pairs: List[Tuple[str, str]] = [(t, GLOSSARY[t]) for t in hits][:max_items]
-    lines = [f"- {t}: {exp}" for t, exp in pairs]
-    return "\n".join(lines)
+    return _ENGINE.make_definitions_block(query, max_items=max_items)
@@ -0,0 +1,105 @@
+# tests/test_chunk_store.py
+import sqlite3
+
+import pytest
+
+import chunk_store
+from chunk_store import CHUNK_ID_KEY, ChunkStore, close_chunk_store, materialize, open_chunk_store
+
+
+class Doc:
+    def __init__(self, page_content, **metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+def statute_chunks(n):
+    return [
+        (f"id{i}", f"Section 13-63-{100 + i}. (1) A social media company shall verify the age of account "
+                   f"holder {i} in this state.\n(2) A minor may not hold an account without parental consent. §{i}")
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def zlib_only(monkeypatch):
+    monkeypatch.setattr(chunk_store, "zstandard", None)
+
+
+@pytest.fixture
+def zstd():
+    return pytest.importorskip("zstandard")
+
+
+def test_zlib_round_trip(tmp_path, zlib_only):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite3"))
+    items = statute_chunks(5) + [("unicode", "“Curfew” – 10:30 p.m. ✓")]
+    assert store.put_many(items) == 6
+    assert store.get_many([i for i, _ in items] + ["missing"]) == dict(items)
+    stats = store.stats()
+    assert (stats["codec"], stats["chunks"], stats["dictionary"]) == ("zlib", 6, False)
+
+
+def test_zstd_round_trip_and_dictionary(tmp_path, zstd):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite3"), dict_size=4096, min_dict_samples=64)
+    items = statute_chunks(300)
+    store.put_many(items)
+    assert store.get_many([i for i, _ in items]) == dict(items)
+    stats = store.stats()
+    assert (stats["codec"], stats["dictionary"]) == ("zstd", True)
+    # A second handle decodes with the dictionary recorded in the store
+    assert ChunkStore(store.path).get_many(["id7"]) == {"id7": dict(items)["id7"]}
+
+
+def test_zstd_dictionary_needs_enough_samples(tmp_path, zstd):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite3"), min_dict_samples=64)
+    store.put_many(statute_chunks(3))
+    # Frames already exist without a dictionary: a later big batch must not add one
+    store.put_many(statute_chunks(300)[3:])
+    assert store.stats()["dictionary"] is False
+    assert store.get_many(["id1", "id299"]) == {k: v for k, v in statute_chunks(300) if k in ("id1", "id299")}
+
+
+def test_codec_is_fixed_at_creation(tmp_path, zlib_only, monkeypatch):
+    path = str(tmp_path / "chunks.sqlite3")
+    ChunkStore(path).put_many([("a", "text")])
+    monkeypatch.setattr(chunk_store, "zstandard", object())  # available later: the store stays zlib
+    assert ChunkStore(path).codec == "zlib"
+
+
+def test_zstd_store_without_zstandard_fails_loudly(tmp_path, zlib_only):
+    path = str(tmp_path / "chunks.sqlite3")
+    ChunkStore(path)
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE meta SET value='zstd' WHERE key='codec'")
+    with pytest.raises(ImportError):
+        ChunkStore(path)
+
+
+def test_get_many_batches_past_parameter_limit(tmp_path, zlib_only):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite3"))
+    items = [(f"c{i}", f"text {i}") for i in range(1200)]
+    store.put_many(items)
+    assert store.get_many([i for i, _ in items]) == dict(items)
+
+
+def test_open_chunk_store(tmp_path, zlib_only):
+    path = str(tmp_path / "index" / "chunks.sqlite3")
+    assert open_chunk_store(path) is None
+    store = open_chunk_store(path, create=True)
+    assert open_chunk_store(path) is store
+    close_chunk_store(str(tmp_path / "index" / ".." / "index" / "chunks.sqlite3"))
+    assert open_chunk_store(path) is not store
+
+
+def test_materialize_fills_text_once_per_chunk(tmp_path, zlib_only):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite3"))
+    store.put_many([("a", "alpha"), ("b", "beta")])
+    calls = []
+    get_many = store.get_many
+    store.get_many = lambda ids: calls.append(sorted(ids)) or get_many(ids)
+    docs = [Doc("", **{CHUNK_ID_KEY: "a"}), Doc("", **{CHUNK_ID_KEY: "a"}), Doc("", **{CHUNK_ID_KEY: "b"}),
+            Doc("inline", **{CHUNK_ID_KEY: "b"}), Doc("", **{CHUNK_ID_KEY: "gone"})]
+    materialize(docs, [store])
+    assert [d.page_content for d in docs] == ["alpha", "alpha", "beta", "inline", ""]
+    assert calls == [["a", "b", "gone"]]
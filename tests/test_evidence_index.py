@@ -0,0 +1,136 @@
+# tests/test_evidence_index.py
+import pytest
+
+import evidence_index
+from evidence_index import (
+    EvidenceIndex, EvidenceVerifier, close_evidence_index, evidence_variants, normalize_sentence, open_evidence_index,
+    sentence_hash, split_sentences
+)
+
+CHUNK = (
+    "A social media company shall verify the age of an existing Utah account holder. "
+    "A minor may not hold an account between 10:30 p.m. and 6:30 a.m.\n"
+    "without the consent of a parent. Nothing in this section applies to email."
+)
+ANCHOR = "13-63-105(3)(a)"
+CURFEW = "A minor may not hold an account between 10:30 p.m. and 6:30 a.m. without the consent of a parent."
+
+
+class Doc:
+    def __init__(self, page_content, **metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+@pytest.fixture(params=["rapidfuzz", "difflib"])
+def matcher(request, monkeypatch):
+    """Run the fuzzy repair with both backends."""
+    if request.param == "rapidfuzz":
+        pytest.importorskip("rapidfuzz")
+    else:
+        monkeypatch.setattr(evidence_index, "process", None)
+    return request.param
+
+
+def answer(*quotes):
+    return {"compliance_need": True, "issues": [{"issue": f"i{n}", "reasoning": "r", "evidence": q} for n, q in enumerate(quotes)]}
+
+
+def test_normalization_and_hash():
+    assert normalize_sentence('  “Minors  Must” log out – now.  ') == 'minors must" log out - now'
+    assert sentence_hash("A minor may not hold an account.") == sentence_hash('"a minor may  not hold an account"')
+    assert sentence_hash("A minor may hold an account.") != sentence_hash("A minor may not hold an account.")
+
+
+def test_split_sentences_joins_line_breaks():
+    sentences = split_sentences(CHUNK)
+    assert len(sentences) == 3
+    assert sentences[1] == CURFEW
+
+
+def test_evidence_variants_strip_trailing_anchor():
+    assert evidence_variants(f"{CURFEW} ({ANCHOR})") == [f"{CURFEW} ({ANCHOR})", CURFEW]
+    assert evidence_variants(CURFEW) == [CURFEW]
+
+
+def test_index_add_lookup_stats(tmp_path):
+    index = EvidenceIndex(str(tmp_path / "evidence.sqlite3"))
+    assert index.add_chunks(["c1", "c2"], [CHUNK, "Nothing in this section applies to email."], [ANCHOR, None]) == 4
+    found = index.lookup([sentence_hash(CURFEW), sentence_hash("Nothing in this section applies to email."), "missing"])
+    assert found[sentence_hash(CURFEW)] == [("c1", ANCHOR)]
+    assert sorted(found[sentence_hash("Nothing in this section applies to email.")]) == [("c1", ANCHOR), ("c2", None)]
+    assert "missing" not in found
+    assert index.stats() == {"sentences": 4, "chunks": 2}
+
+
+def test_open_and_close_evidence_index(tmp_path):
+    path = str(tmp_path / "evidence.sqlite3")
+    assert open_evidence_index(path) is None
+    index = open_evidence_index(path, create=True)
+    assert open_evidence_index(path) is index
+    close_evidence_index(path)
+    assert open_evidence_index(path) is not index
+
+
+def test_hash_match_through_the_index(tmp_path):
+    index = EvidenceIndex(str(tmp_path / "evidence.sqlite3"))
+    index.add_chunks(["c1"], [CHUNK], [ANCHOR])
+    verifier = EvidenceVerifier()
+    verifier._index = lambda: index
+    docs = [Doc(CHUNK, chunk_id="c1", anchor=ANCHOR)]
+    assert verifier.check(answer(f"“{CURFEW}” ({ANCHOR})"), docs) == []
+    # A sentence of a chunk that was not in the prompt does not count
+    assert verifier.check(answer(CURFEW), [Doc("Other text entirely.", chunk_id="c9")]) == [0]
+    assert verifier.stats() == {"checked": 2, "hash": 1, "failed": 1}
+
+
+def test_hash_span_and_failure_without_index(matcher):
+    verifier = EvidenceVerifier(min_words=5)
+    docs = [Doc(CHUNK, anchor=ANCHOR)]
+    result = answer(
+        CURFEW.upper(),                                        # hash (inline chunk, hashed on the fly)
+        "verify the age of an existing Utah account holder",   # span
+        "account between",                                     # too short for a span
+        "Minors get free ice cream on Sundays.",               # unrelated
+    )
+    assert verifier.check(result, docs) == [2, 3]
+    assert verifier.stats() == {"checked": 4, "hash": 1, "span": 1, "failed": 2}
+
+
+def test_fuzzy_repair_replaces_near_miss(matcher):
+    verifier = EvidenceVerifier(fuzzy_threshold=90)
+    result = answer("A minor may not hold an acount between 10:30 pm and 6:30 a.m. without the consent of a parent")
+    assert verifier.check(result, [Doc(CHUNK, anchor=ANCHOR)]) == []
+    assert result["issues"][0]["evidence"] == f"{CURFEW} ({ANCHOR})"
+    assert verifier.stats()["repaired"] == 1
+
+
+def test_insufficient_context_needs_no_quote():
+    result = {"compliance_need": False, "issues": [{"issue": "Insufficient context", "reasoning": "", "evidence": ""}]}
+    verifier = EvidenceVerifier()
+    assert verifier.check(result, [Doc(CHUNK)]) == []
+    assert verifier.stats() == {"checked": 0}
+
+
+def test_retry_outcomes(matcher):
+    verifier = EvidenceVerifier()
+    docs = [Doc(CHUNK, anchor=ANCHOR)]
+    result = answer("Invented quote one here.", "Invented quote two here.", "Invented quote three here.")
+    failed = verifier.check(result, docs)
+    assert failed == [0, 1, 2]
+    # One good quote, one still invented, and the model left out the third
+    still = verifier.apply_retry(result, docs, failed, {"evidence": [CURFEW, "Still invented."]})
+    assert still == [1, 2]
+    assert result["issues"][0]["evidence"] == CURFEW
+    assert result["issues"][1]["evidence"] == "Invented quote two here."
+    verifier.mark_unverified(result, still)
+    assert [i.get("evidence_verified") for i in result["issues"]] == [None, False, False]
+    stats = verifier.stats()
+    assert (stats["retried"], stats["retry_failed"], stats["failed"]) == (1, 2, 3)
+
+
+def test_retry_with_unparseable_reply():
+    verifier = EvidenceVerifier()
+    result = answer("Invented quote.")
+    assert verifier.apply_retry(result, [Doc(CHUNK)], [0], None) == [0]
+    assert result["issues"][0]["evidence"] == "Invented quote."
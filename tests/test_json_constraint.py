@@ -0,0 +1,121 @@
+# tests/test_json_constraint.py
+import json
+
+import pytest
+
+from json_constraint import (
+    CODE_CHANGE_SCHEMA, COMPLIANCE_SCHEMA, DEV_DOC_SCHEMA, EVIDENCE_SCHEMA, Array, Bool, JsonMachine, Object, String
+)
+
+VALID = {
+    "compliance": (COMPLIANCE_SCHEMA, {
+        "compliance_need": True,
+        "issues": [{
+            "issue": "Curfew for minors",
+            "reasoning": "The feature restricts logins by age.",
+            "evidence": "A minor may not hold an account between 10:30 p.m. and 6:30 a.m. (13-63-105(3)(a))",
+        }],
+    }),
+    "evidence": (EVIDENCE_SCHEMA, {"evidence": ["First quote.", "Second \"quoted\" one."]}),
+    "dev_doc": (DEV_DOC_SCHEMA, {
+        "file": "prd.md",
+        "features": [
+            {"feature_name": "PF default", "feature_description": "Personalized feed off for minors."},
+            {"feature_name": "Curfew", "feature_description": "No logins at night in Utah."},
+        ],
+    }),
+    "code_change": (CODE_CHANGE_SCHEMA, {
+        "file": "src/geo_handler.py",
+        "feature_name": "GH routing",
+        "feature_description": "Routes EU users through the LCP checks.",
+    }),
+}
+
+
+def accepts(schema, text: str) -> bool:
+    machine = JsonMachine(schema)
+    return machine.feed_text(text) and machine.done
+
+
+# What an unconstrained model likes to emit instead; the trailing newline also
+# rules each one out inside a string, the newline run exceeds the whitespace bound
+JUNK = ("Sure! Here is the JSON:\n", "```json\n", "null\n", "'\n", "\n" * 20)
+
+
+def constrained_decode(schema, target: str, junk=JUNK) -> str:
+    """
+    Greedy decoding with the processor's rule: candidates in preference order
+    (junk the model "prefers" first, then the next character of target), the
+    first one that keeps the output a valid schema prefix wins.
+    """
+    machine, out = JsonMachine(schema), ""
+    for _ in range(10 * len(target)):
+        if machine.done:
+            return out
+        for token in list(junk) + [target[len(out)]]:
+            if machine.clone().feed_text(token):
+                break
+        assert machine.feed_text(token)
+        out += token
+    raise AssertionError(f"decoding did not finish: {out!r}")
+
+
+@pytest.mark.parametrize("name", sorted(VALID))
+def test_accepts_valid_documents(name):
+    schema, doc = VALID[name]
+    assert accepts(schema, json.dumps(doc))
+    assert accepts(schema, json.dumps(doc, indent=1))
+
+
+@pytest.mark.parametrize("name", sorted(VALID))
+def test_constrained_decoding_outputs_parse(name):
+    schema, doc = VALID[name]
+    target = json.dumps(doc)
+    out = constrained_decode(schema, target)
+    assert json.loads(out) == doc
+
+
+def test_empty_array_and_escapes():
+    assert accepts(EVIDENCE_SCHEMA, '{"evidence": []}')
+    assert accepts(EVIDENCE_SCHEMA, r'{"evidence": ["tab\there", "é", "back\\slash"]}')
+    assert not JsonMachine(EVIDENCE_SCHEMA).feed_text(r'{"evidence": ["bad \x"')
+    assert not JsonMachine(EVIDENCE_SCHEMA).feed_text(r'{"evidence": ["\u00g')
+
+
+@pytest.mark.parametrize("prefix", [
+    'Sure, {"compliance_need"',             # prose before the object
+    '{"issues"',                            # keys out of order
+    '{"compliance_need": tru3',             # broken literal
+    '{"compliance_need": "yes"',            # wrong type
+    '{"compliance_need": true}',            # missing required key
+    '{"compliance_need": true, "issues": [], "extra"',
+    '{"compliance_need": true, "issues": [{"issue": "a\nb"',  # raw control character in a string
+])
+def test_rejects_invalid_prefixes(prefix):
+    assert not JsonMachine(COMPLIANCE_SCHEMA).feed_text(prefix)
+
+
+def test_limits():
+    schema = Object((("tags", Array(String(max_len=3), max_items=2)), ("ok", Bool())))
+    assert accepts(schema, '{"tags": ["abc", "de"], "ok": false}')
+    assert not JsonMachine(schema).feed_text('{"tags": ["abcd"')
+    assert not JsonMachine(schema).feed_text('{"tags": ["a", "b", "c"')
+    assert not JsonMachine(schema).feed_text('{"tags": [], "ok": true}x')
+    # Whitespace runs are bounded so the model cannot pad forever
+    assert not JsonMachine(schema, max_ws=4).feed_text('{' + ' ' * 5)
+
+
+def test_min_items():
+    schema = Object((("xs", Array(Bool(), min_items=1)),))
+    assert not JsonMachine(schema).feed_text('{"xs": []')
+    assert accepts(schema, '{"xs": [true]}')
+
+
+def test_clone_is_independent():
+    machine = JsonMachine(CODE_CHANGE_SCHEMA)
+    assert machine.feed_text('{"file": "a')
+    clone = machine.clone()
+    assert clone.feed_text('", ')
+    # The clone waits for the next key (whitespace allowed); the original is still inside the string
+    assert clone.feed("\n")
+    assert not machine.feed("\n")
@@ -0,0 +1,88 @@
+# tests/test_semantic_cache.py
+import semantic_cache
+from semantic_cache import SemanticCache, fingerprint_docs
+
+REGIONS = ["Utah", "California"]
+
+
+class Doc:
+    def __init__(self, page_content, **metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+def test_near_duplicate_hit_and_miss():
+    cache = SemanticCache(threshold=0.95)
+    cache.store([1.0, 0.0, 0.0], REGIONS, "fp", "v1", "answer")
+    assert cache.lookup([0.99, 0.05, 0.0], REGIONS[::-1], "fp", "v1") == "answer"  # region order does not matter
+    assert cache.lookup([0.7, 0.7, 0.0], REGIONS, "fp", "v1") is None             # cos ~0.71
+    assert cache.lookup([1.0, 0.0, 0.0], ["Utah"], "fp", "v1") is None            # other region set
+    assert cache.lookup([1.0, 0.0, 0.0], REGIONS, "other", "v1") is None          # other retrieved chunks
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_best_match_wins_and_vectors_are_normalized():
+    cache = SemanticCache(threshold=0.9)
+    cache.store([10.0, 0.0], REGIONS, "fp", "v1", "x-axis")
+    cache.store([0.6, 0.8], REGIONS, "fp", "v1", "diagonal")
+    assert cache.lookup([3.0, 0.1], REGIONS, "fp", "v1") == "x-axis"
+    assert cache.lookup([0.5, 0.7], REGIONS, "fp", "v1") == "diagonal"
+
+
+def test_empty_answers_are_not_stored():
+    cache = SemanticCache()
+    cache.store([1.0], REGIONS, "fp", "v1", "")
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction():
+    cache = SemanticCache(threshold=0.99, max_entries=2)
+    cache.store([1.0, 0.0, 0.0], REGIONS, "fp", "v1", "a")
+    cache.store([0.0, 1.0, 0.0], REGIONS, "fp", "v1", "b")
+    assert cache.lookup([1.0, 0.0, 0.0], REGIONS, "fp", "v1") == "a"  # a is now most recently used
+    cache.store([0.0, 0.0, 1.0], REGIONS, "fp", "v1", "c")
+    assert cache.lookup([0.0, 1.0, 0.0], REGIONS, "fp", "v1") is None
+    assert cache.lookup([1.0, 0.0, 0.0], REGIONS, "fp", "v1") == "a"
+    assert cache.lookup([0.0, 0.0, 1.0], REGIONS, "fp", "v1") == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(ttl_seconds=60)
+    cache.store([1.0, 0.0], REGIONS, "fp", "v1", "answer")
+    now[0] += 59
+    assert cache.lookup([1.0, 0.0], REGIONS, "fp", "v1") == "answer"
+    now[0] += 2
+    assert cache.lookup([1.0, 0.0], REGIONS, "fp", "v1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_new_index_version_drops_everything():
+    cache = SemanticCache()
+    cache.store([1.0, 0.0], REGIONS, "fp", "v1", "a")
+    cache.store([0.0, 1.0], ["Utah"], "fp2", "v1", "b")
+    assert cache.lookup([1.0, 0.0], REGIONS, "fp", "v2") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
+    # Going back to the old version does not resurrect its answers
+    assert cache.lookup([1.0, 0.0], REGIONS, "fp", "v1") is None
+
+
+def test_stats_and_clear():
+    cache = SemanticCache()
+    cache.store([1.0], REGIONS, "fp", "v1", "a")
+    cache.lookup([1.0], REGIONS, "fp", "v1")
+    cache.lookup([1.0], REGIONS, "fp2", "v1")
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5, "evictions": 0, "invalidations": 0}
+    cache.clear()
+    assert cache.lookup([1.0], REGIONS, "fp", "v1") is None
+
+
+def test_fingerprint_docs():
+    a = Doc("Section 1 text.", source="utah.pdf", page=1, start_index=0)
+    b = Doc("Section 2 text.", source="utah.pdf", page=2, start_index=0)
+    assert fingerprint_docs([a, b]) == fingerprint_docs([Doc("Section 1 text.", source="utah.pdf", page=1, start_index=0), b])
+    assert fingerprint_docs([a, b]) != fingerprint_docs([b, a])
+    assert fingerprint_docs([a]) != fingerprint_docs([Doc("Section 1 text!", source="utah.pdf", page=1, start_index=0)])